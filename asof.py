@@ -0,0 +1,243 @@
+""" As-of lookups of captured quotes, for pricing trades against the archive.
+
+Given any number of (ticker, time, expiration, strike, call/put) contracts, finds the last
+capture of each ticker at or before each time and reads the contract's quote from it:
+
+    captured_at     capture time used, NaT if none is recent enough
+    underlying      underlying price of the capture's stock price row, estimated from put-call
+                    parity (greeks.estimate_underlying) where the capture doesn't have it
+    mid             mid of the contract's quote (greeks.mid_price)
+    iv              implied volatility of the mid (greeks.implied_vol)
+
+The catalog's capture times of a ticker are sorted into one array and every contract is matched
+with a single np.searchsorted, then each capture that is needed is loaded once, whatever the
+number of contracts priced against it. Times are naive, in the clock of the capture machine
+(see to_capture_clock).
+"""
+import datetime
+import logging
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import catalog
+import greeks
+import segment
+import store
+from constants import UNDERLYING_COLUMN
+
+log = logging.getLogger(__name__)
+
+# Chain columns needed to price a contract
+QUOTE_COLUMNS = ["{}_{}".format(otype, header)
+                 for otype in ["call", "put"] for header in ["Bid", "Ask", "Last"]] + \
+    [UNDERLYING_COLUMN]
+QUOTE_FIELDS = ["captured_at", "underlying", "mid", "iv"]
+# Captures older than this are not used for a contract
+MAX_AGE = datetime.timedelta(days=1)
+
+def to_capture_clock(times, tz=None):
+    """ Converts timezone-aware times to the naive local times captures are recorded in
+
+    Args:
+        times (iterable): aware datetimes
+        tz (str): time zone of the capture machine. Default is the local time zone.
+
+    Returns:
+        DatetimeIndex: naive times
+    """
+    times = pd.DatetimeIndex(pd.to_datetime(list(times), utc=True))
+    if tz is not None:
+        return times.tz_convert(tz).tz_localize(None)
+    return pd.DatetimeIndex([time.astimezone().replace(tzinfo=None)
+                             for time in times.to_pydatetime()])
+
+class CaptureIndex(object):
+    """ Capture times of one ticker in an archive, sorted for as-of lookups.
+
+    Every columnar snapshot and delta capture is one capture, and so is every capture appended
+    to a segment. CSV files are named by day and rewritten by later captures that day, so the
+    CSV files of a day make up a single capture at the time of its latest file.
+
+    Args:
+        outdir (str): output directory of options_csv, with its catalog (built with
+            catalog.index_directory if missing)
+        ticker (str): ticker symbol of the option data
+        since (datetime.date or str): only captures on or after this day
+        until (datetime.date or str): only captures on or before this day
+    """
+    def __init__(self, outdir, ticker, since=None, until=None):
+        self.outdir = outdir
+        self.ticker = ticker
+        with catalog.Catalog(catalog.catalog_path(outdir)) as snapshots:
+            found = snapshots.find(ticker, since=since, until=until)
+        captures = OrderedDict()
+        for record in found:
+            if record.format == segment.CATALOG_FORMAT:
+                # A segment is recorded once, with its captures listed in its own index
+                with segment.Segment(record.path) as captured:
+                    for frame in captured.frames:
+                        captured_at = frame.captured_at.isoformat(timespec="seconds")
+                        captures[(captured_at, record.path)] = [
+                            record._replace(captured_at=captured_at)]
+            elif record.expiration == catalog.ALL_EXPIRATIONS:
+                captures[(record.captured_at, record.path)] = [record]
+            else:
+                captures.setdefault(("csv", record.capture_date), []).append(record)
+        self.records = sorted(captures.values(),
+                              key=lambda records: max(record.captured_at for record in records))
+        self.times = np.array([max(record.captured_at for record in records)
+                               for records in self.records], dtype="datetime64[s]")
+
+    def __len__(self):
+        return len(self.times)
+
+    def locate(self, times, max_age=MAX_AGE):
+        """ Finds the last capture at or before each time
+
+        Args:
+            times (array-like): naive times
+            max_age (datetime.timedelta): ignore captures older than this. None for no limit.
+
+        Returns:
+            ndarray: position of the capture for each time, -1 where there is none
+        """
+        times = np.asarray(pd.DatetimeIndex(times).values, dtype="datetime64[s]")
+        positions = np.searchsorted(self.times, times, side="right") - 1
+        if max_age is not None and len(self.times):
+            age = times - self.times[np.maximum(positions, 0)]
+            positions[age > np.timedelta64(int(max_age.total_seconds()), "s")] = -1
+        return positions
+
+    def load(self, position):
+        """ Loads the quote columns of one capture
+
+        Returns:
+            DataFrame: snapshot table, see store.chain_to_frame
+        """
+        records = self.records[position]
+        first = records[0]
+        if first.format == "delta":
+            import delta
+            when = datetime.datetime.fromisoformat(first.captured_at)
+            return delta.read_frame_at(self.outdir, self.ticker, when)[1]
+        if first.format == segment.CATALOG_FORMAT:
+            when = datetime.datetime.fromisoformat(first.captured_at)
+            return segment.read_frame_at(first.path, when, QUOTE_COLUMNS)[1]
+        if first.expiration == catalog.ALL_EXPIRATIONS:
+            # Snapshots saved before the underlying column was parsed don't have it
+            columns = store.snapshot_columns(first.path)
+            return store.read_snapshot(first.path, columns=[
+                column for column in QUOTE_COLUMNS if column in columns])
+        tables = OrderedDict(
+            (record.expiration, pd.read_csv(
+                record.path, index_col=0,
+                usecols=lambda column: column in QUOTE_COLUMNS or column.startswith("Unnamed")))
+            for record in records)
+        return store.chain_to_frame(tables)
+
+def _underlying(quoted, strikes, call_mid, put_mid):
+    """ Underlying price of one expiration: the quoted one, else estimated from parity """
+    quoted = quoted[np.isfinite(quoted)]
+    if len(quoted):
+        return float(quoted[0])
+    return greeks.estimate_underlying(strikes, call_mid, put_mid)
+
+def price_contracts(frame, captured_at, expirations, strikes, is_call, rate=0.0, div=0.0):
+    """ Prices contracts against one capture
+
+    Args:
+        frame (DataFrame): snapshot table of the capture, see CaptureIndex.load. Not empty.
+        captured_at (datetime.datetime): capture time
+        expirations (ndarray): ISO expiration date of each contract
+        strikes (ndarray): strike of each contract
+        is_call (ndarray): whether each contract is a call
+        rate (float): continuously compounded risk-free rate
+        div (float): continuous dividend yield
+
+    Returns:
+        tuple: underlying, mid and iv arrays, NaN where the capture doesn't have the contract
+    """
+    keys = frame["expiration"].astype(str).map(catalog.expiration_key).to_numpy()
+    chain_strikes = frame["strike"].to_numpy(dtype=np.float64)
+    mids = {otype: greeks.mid_price(frame[otype + "_Bid"], frame[otype + "_Ask"],
+                                    frame[otype + "_Last"]) for otype in ["call", "put"]}
+
+    # One underlying price per expiration, from its stock price row or else estimated from
+    # parity, and the median of them for expirations not captured
+    codes, uniques = pd.factorize(keys)
+    quoted = frame[UNDERLYING_COLUMN].to_numpy(dtype=np.float64) \
+        if UNDERLYING_COLUMN in frame else np.full(len(frame), np.nan)
+    spots = np.array([_underlying(quoted[codes == i], chain_strikes[codes == i],
+                                  mids["call"][codes == i], mids["put"][codes == i])
+                      for i in range(len(uniques))])
+    fallback = np.nanmedian(spots) if np.isfinite(spots).any() else np.nan
+    code = pd.Index(uniques).get_indexer(expirations)
+    underlying = spots[np.maximum(code, 0)]
+    underlying = np.where((code >= 0) & np.isfinite(underlying), underlying, fallback)
+
+    # Row of each contract in the capture, the last one if a strike is listed twice
+    chain_index = pd.MultiIndex.from_arrays([keys, chain_strikes])
+    unique_rows = np.flatnonzero(~chain_index.duplicated(keep="last"))
+    found_at = chain_index[unique_rows].get_indexer(
+        pd.MultiIndex.from_arrays([expirations, strikes]))
+    found = found_at >= 0
+    rows = unique_rows[np.where(found, found_at, 0)]
+    mid = np.where(found, np.where(is_call, mids["call"][rows], mids["put"][rows]), np.nan)
+
+    t = np.array([greeks.years_to_expiration(expiration, captured_at)
+                  for expiration in expirations])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        iv = greeks.implied_vol(mid, is_call, underlying, strikes, t, rate, div)
+    return underlying, mid, np.where(found, iv, np.nan)
+
+def quotes_asof(outdir, contracts, max_age=MAX_AGE, rate=0.0, div=0.0):
+    """ Looks up the quote of each contract in the last capture before its time.
+
+    Args:
+        outdir (str): output directory of options_csv holding the archive
+        contracts (DataFrame): one row per contract with 'ticker', 'time' (naive, capture
+            clock), 'expiration' (date or ISO date), 'strike' and 'instrument' ('call' or 'put')
+        max_age (datetime.timedelta): ignore captures older than this. None for no limit.
+        rate (float): continuously compounded risk-free rate
+        div (float): continuous dividend yield
+
+    Returns:
+        DataFrame: the QUOTE_FIELDS of each contract, aligned with contracts
+    """
+    n = len(contracts)
+    result = pd.DataFrame({"captured_at": np.full(n, np.datetime64("NaT"), "datetime64[s]"),
+                           "underlying": np.full(n, np.nan), "mid": np.full(n, np.nan),
+                           "iv": np.full(n, np.nan)}, index=contracts.index)
+    if not n:
+        return result
+    expirations = pd.to_datetime(contracts["expiration"]).dt.strftime("%Y-%m-%d").to_numpy()
+    strikes = contracts["strike"].to_numpy(dtype=np.float64)
+    is_call = (contracts["instrument"] == "call").to_numpy()
+    tickers = contracts["ticker"].str.lower().to_numpy()
+
+    for ticker in pd.unique(tickers):
+        rows = np.flatnonzero(tickers == ticker)
+        index = CaptureIndex(outdir, ticker)
+        if not len(index):
+            log.info("No captures of %s", ticker)
+            continue
+        positions = index.locate(contracts["time"].to_numpy()[rows], max_age)
+        for position in np.unique(positions[positions >= 0]):
+            priced = rows[positions == position]
+            captured_at = index.times[position].astype(datetime.datetime)
+            frame = index.load(position)
+            if frame is None or not len(frame):
+                continue
+            underlying, mid, iv = price_contracts(
+                frame, captured_at, expirations[priced], strikes[priced], is_call[priced],
+                rate, div)
+            result.iloc[priced, 0] = np.datetime64(captured_at, "s")
+            result.iloc[priced, 1] = underlying
+            result.iloc[priced, 2] = mid
+            result.iloc[priced, 3] = iv
+        log.info("Priced %d of %d %s contracts against %d captures",
+                 int((positions >= 0).sum()), len(rows), ticker,
+                 len(np.unique(positions[positions >= 0])))
+    return result
@@ -0,0 +1,482 @@
+""" Benchmarks for the options chain parser.
+
+Compares the current parser against the original row-by-row implementation, either on a saved
+MarketWatch page or on a synthetic page of a given size. With --greeks, compares the vectorized
+implied volatility solver against a contract-by-contract reference instead.
+
+With --stages, times every stage of a capture separately (fetch, HTML parse, row extraction,
+table building, serialization and the whole fetch-to-disk path) for each page of a fixture
+directory, see fixtures.py, and can compare the results against a saved baseline:
+
+    python fixtures.py synthetic fixtures/
+    python bench.py --stages fixtures/ --json baseline.json
+    python bench.py --stages fixtures/ --baseline baseline.json
+
+With --imports, times a cold import of each entry point in a fresh interpreter and fails if one
+is over its start-up budget or loads a heavy package it shouldn't need.
+"""
+import os
+import json
+import math
+import tempfile
+import numpy as np
+import pandas as pd
+import time
+import resource
+import logging
+import subprocess
+import sys
+import multiprocessing
+from collections import OrderedDict
+from bs4 import BeautifulSoup
+
+import greeks
+import options_csv
+
+log = logging.getLogger(__name__)
+
+CHAIN_HEADERS = ["Symbol", "Last", "Change", "Vol", "Bid", "Ask", "Open Int."]
+
+def make_chain_page(n_expirations=10, n_strikes=100, spot=2700.0, step=5.0, dropped=None,
+                    header_first=False):
+    """ Builds a synthetic page laid out like the MarketWatch options page.
+
+    Args:
+        n_expirations (int): number of expiration sections
+        n_strikes (int): number of strike rows per expiration
+        spot (float): price of the underlying, used to place the stock price row
+        step (float): distance between strikes
+        dropped (dict): expiration number -> CHAIN_HEADERS left out of that block, to lay
+            blocks out differently
+        header_first (bool): put the header row of each block before its heading instead of
+            after it
+
+    Returns:
+        str: html of the page
+    """
+    dropped = dropped or {}
+    cell = lambda value, cls: '<td class="{}">{}</td>'.format(cls, value)
+    header_row = lambda headers: '<tr class="chainrow understated">{}</tr>'.format("".join(
+        "<td>{}</td>".format(h) for h in headers + ["Strike"] + headers))
+    lines = ['<html><body><div id="options"><table>']
+    lines.append(header_row(CHAIN_HEADERS))
+    first_strike = spot - step * (n_strikes // 2)
+    for e in range(n_expirations):
+        expiration = (pd.Timestamp("2018-03-16") + pd.Timedelta(weeks=e)).strftime("%B %d, %Y")
+        kept = [i for i, h in enumerate(CHAIN_HEADERS) if h not in dropped.get(e, ())]
+        heading = '<tr class="chainrow heading"><td colspan="15">Expires {}</td></tr>'.format(
+            expiration)
+        header = header_row([CHAIN_HEADERS[i] for i in kept])
+        lines += [header, heading] if header_first else [heading, header]
+        price_row_written = False
+        for s in range(n_strikes):
+            strike = first_strike + step * s
+            if strike > spot and not price_row_written:
+                lines.append('<tr class="chainrow stockprice"><td colspan="15">'
+                             'Current price as of 4:00 PM: {:,.2f}</td></tr>'.format(spot))
+                price_row_written = True
+            call_cls, put_cls = ("inthemoney", "") if strike <= spot else ("", "inthemoney")
+            halves = []
+            for otype, cls in [("C", call_cls), ("P", put_cls)]:
+                values = ["SPX{}{}{:.0f}".format(e, otype, strike),
+                          "{:,.2f}".format(s + 0.5), "-0.25", "{:,}".format(s * 3),
+                          "{:,.2f}".format(s + 0.25), "{:,.2f}".format(s + 0.75),
+                          "{:,}".format(s * 1000 + e)]
+                halves.append("".join(cell(values[i], cls) for i in kept))
+            lines.append('<tr class="chainrow aright">{}{}{}</tr>'.format(
+                halves[0], cell("{:,.2f}".format(strike), "strike-col"), halves[1]))
+    lines.append("</table></div></body></html>")
+    return "\n".join(lines)
+
+def legacy_parse_chain(soup):
+    """ The original parse_options loop (one DataFrame.loc insert per strike), kept as the
+    baseline to measure against. Returns the tables instead of writing them.
+    """
+    text_clean = lambda s: s.strip().replace(",","")
+    unpack_cols = lambda cols: [ text_clean(td.text) for td in cols ]
+    options = soup.find('div', {'id':'options'})
+    header_row = options.select('tr.chainrow.understated')[0]
+    headers = unpack_cols(header_row.findAll('td'))
+    main_headers = headers[:int(len(headers)/2)]
+    option_order = ["call", "put"]
+    data_headers = lambda option_type: [
+        options_csv.data_header(option_type, header) for header in main_headers]
+    data_columns = [header for option_type in option_order for header in data_headers(option_type)]
+    chain = OrderedDict()
+    calls_are_itm = True
+    current_table = None
+    for row in options.findAll('tr', {'class': 'chainrow'}):
+        if "heading" in row["class"] and "Expires" in row.text:
+            current_table = pd.DataFrame(columns=(data_columns))
+            chain[row.text.strip().replace("Expires ", "")] = current_table
+        elif "aright" in row['class']:
+            strike_col = text_clean(row.find('td', {'class': 'strike-col'}).text)
+            results = OrderedDict()
+            extract_order = ["inthemoney", ""] if calls_are_itm else ["", "inthemoney"]
+            for option_type, extract in zip(option_order, extract_order):
+                cols = unpack_cols(row.findAll('td', {'class': extract}))
+                if len(cols) < len(main_headers):
+                    cols += [None] * (len(headers) - len(cols))
+                cols = cols[:len(headers)]
+                results.update(zip(data_headers(option_type), cols))
+            current_table.loc[float(strike_col)] = results
+        elif "stockprice" in row['class']:
+            calls_are_itm = False
+    return chain
+
+def time_call(func, *args, repeat=3):
+    """ Runs func(*args) repeat times and returns (best time in seconds, last result) """
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def bench_parser(page, repeat=3):
+    """ Times the legacy and streaming parsers on one page.
+
+    Args:
+        page (str): html of the page to parse
+        repeat (int): number of runs per parser, the best one is reported
+
+    Returns:
+        OrderedDict: parser name -> best time in seconds
+    """
+    soup = BeautifulSoup(page, "html.parser")
+    results = OrderedDict()
+    results["legacy"], _ = time_call(legacy_parse_chain, soup, repeat=repeat)
+    results["streaming"], chain = time_call(options_csv.parse_chain, soup, repeat=repeat)
+    n_rows = sum(len(table) for table in chain.values())
+    for name, elapsed in results.items():
+        print("{:>10}: {:8.3f}s  {:10.0f} rows/s".format(name, elapsed, n_rows / elapsed))
+    return results
+
+def check_backends(page):
+    """ Checks that every extraction backend produces the same tables as the soup backend.
+
+    Args:
+        page (bytes or str): html of the page to parse
+
+    Raises:
+        AssertionError: if any backend's tables differ from the reference
+    """
+    reference = options_csv.parse_chain(page, "soup")
+    for backend in options_csv.EXTRACTORS:
+        chain = options_csv.parse_chain(page, backend)
+        assert list(chain) == list(reference), \
+            "{} found expirations {}, expected {}".format(backend, list(chain), list(reference))
+        for expiration, table in reference.items():
+            pd.testing.assert_frame_equal(chain[expiration], table, obj="{} '{}'".format(
+                backend, expiration))
+
+def _measure_backend(page, backend, repeat):
+    """ Parses page in a fresh process, returns (best seconds, peak memory growth in KiB) """
+    base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    elapsed, _ = time_call(options_csv.parse_chain, page, backend, repeat=repeat)
+    return elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base_rss
+
+def bench_backends(page, repeat=3):
+    """ Times each extraction backend and measures its peak memory use. Each backend is run in
+    its own process so the memory figures don't bleed into one another.
+
+    Args:
+        page (bytes or str): html of the page to parse
+        repeat (int): number of runs per backend, the best one is reported
+
+    Returns:
+        OrderedDict: backend name -> (best time in seconds, peak memory growth in KiB)
+    """
+    results = OrderedDict()
+    ctx = multiprocessing.get_context("spawn")
+    for backend in options_csv.EXTRACTORS:
+        with ctx.Pool(1) as pool:
+            results[backend] = pool.apply(_measure_backend, (page, backend, repeat))
+        print("{:>10}: {:8.3f}s  {:10.1f} MiB peak".format(
+            backend, results[backend][0], results[backend][1] / 1024.))
+    return results
+
+def _scalar_price(is_call, spot, strike, t, vol, rate, div):
+    sqrt_t = math.sqrt(t)
+    d1 = (math.log(spot / strike) + (rate - div + 0.5 * vol * vol) * t) / (vol * sqrt_t)
+    d2 = d1 - vol * sqrt_t
+    cdf = lambda x: 0.5 * math.erfc(-x / math.sqrt(2.0))
+    sign = 1.0 if is_call else -1.0
+    return sign * (spot * math.exp(-div * t) * cdf(sign * d1) -
+                   strike * math.exp(-rate * t) * cdf(sign * d2))
+
+def scalar_implied_vol(price, is_call, spot, strike, t, rate=0.0, div=0.0, tol=1e-8):
+    """ Reference implied volatility of one contract, by bisection in pure Python """
+    low, high = greeks.MIN_VOL, greeks.MAX_VOL
+    if not (_scalar_price(is_call, spot, strike, t, low, rate, div) <= price <=
+            _scalar_price(is_call, spot, strike, t, high, rate, div)):
+        return float("nan")
+    while high - low > tol:
+        mid = 0.5 * (low + high)
+        if _scalar_price(is_call, spot, strike, t, mid, rate, div) < price:
+            low = mid
+        else:
+            high = mid
+    return 0.5 * (low + high)
+
+def make_contracts(n_contracts=10000, spot=2700.0, rate=0.02, div=0.01, seed=0):
+    """ Random contracts around spot, priced from known volatilities.
+
+    Returns:
+        tuple: (price, is_call, strike, t, vol) arrays
+    """
+    rng = np.random.default_rng(seed)
+    strike = rng.uniform(0.75 * spot, 1.25 * spot, n_contracts)
+    t = rng.uniform(0.02, 2.0, n_contracts)
+    vol = rng.uniform(0.05, 1.0, n_contracts)
+    is_call = rng.random(n_contracts) < 0.5
+    price = greeks.bs_price(is_call, spot, strike, t, vol, rate, div)
+    return price, is_call, strike, t, vol
+
+def bench_greeks(n_contracts=10000, repeat=3, spot=2700.0, rate=0.02, div=0.01):
+    """ Times the vectorized implied volatility solver against the scalar reference, and checks
+    that both recover the volatilities the contracts were priced with.
+
+    Args:
+        n_contracts (int): number of random contracts
+        repeat (int): number of runs per solver, the best one is reported
+
+    Returns:
+        OrderedDict: solver name -> best time in seconds
+    """
+    price, is_call, strike, t, vol = make_contracts(n_contracts, spot, rate, div)
+    # Where vega vanishes the price doesn't pin down the volatility, so leave those out of
+    # the accuracy check
+    identified = greeks.bs_vega(spot, strike, t, vol, rate, div) > 1e-2
+
+    results = OrderedDict()
+    results["scalar"], scalar_iv = time_call(lambda: np.array([
+        scalar_implied_vol(p, c, spot, k, tt, rate, div)
+        for p, c, k, tt in zip(price, is_call, strike, t)]), repeat=repeat)
+    results["vectorized"], iv = time_call(
+        greeks.implied_vol, price, is_call, spot, strike, t, rate, div, repeat=repeat)
+    for name, elapsed, values in [("scalar", results["scalar"], scalar_iv),
+                                  ("vectorized", results["vectorized"], iv)]:
+        error = np.nanmax(np.abs(values - vol)[identified])
+        print("{:>10}: {:8.3f}s  {:10.0f} contracts/s  max error {:.1e}".format(
+            name, elapsed, n_contracts / elapsed, error))
+    return results
+
+# Stages timed by bench_stages, in pipeline order
+STAGES = ["fetch", "html_parse", "extract_rows", "build_tables", "write_csv", "write_parquet",
+          "fetch_to_disk"]
+
+def bench_stages(ticker, url_format, backend="soup", repeat=3):
+    """ Times each stage of capturing one page, run separately on the output of the stage
+    before it. html_parse is the BeautifulSoup build of the soup backend; the lxml backend
+    parses while it extracts, so its HTML parse is part of extract_rows.
+
+    Args:
+        ticker (str): ticker of the page
+        url_format (str): url format of a server holding the page, e.g. stub_server's
+        backend (str): name of the row extraction backend, see options_csv.EXTRACTORS
+        repeat (int): number of runs per stage, the best one is reported
+
+    Returns:
+        tuple: (OrderedDict of stage -> best time in seconds, number of rows, page size)
+    """
+    import fetch
+    import store
+    pool = fetch.ConnectionPool()
+    results = OrderedDict()
+    results["fetch"], page = time_call(fetch.fetch_page, pool, ticker, url_format, repeat=repeat)
+    if backend == "soup":
+        results["html_parse"], source = time_call(
+            BeautifulSoup, page, "html.parser", repeat=repeat)
+    else:
+        results["html_parse"], source = 0.0, page
+    extract = options_csv.EXTRACTORS[backend]
+    results["extract_rows"], rows = time_call(lambda: list(extract(source)), repeat=repeat)
+    results["build_tables"], chain = time_call(options_csv.chain_from_rows, rows, repeat=repeat)
+    n_rows = sum(len(table) for table in chain.values())
+
+    with tempfile.TemporaryDirectory() as outdir:
+        results["write_csv"], _ = time_call(
+            options_csv.write_chain, chain, ticker, outdir, repeat=repeat)
+        results["write_parquet"], _ = time_call(
+            store.write_snapshot, chain, ticker, outdir, repeat=repeat)
+        results["fetch_to_disk"], _ = time_call(lambda: options_csv.save_chain(
+            options_csv.parse_chain(fetch.fetch_page(pool, ticker, url_format), backend),
+            ticker, outdir), repeat=repeat)
+    pool.close()
+    return results, n_rows, len(page)
+
+def _measure_stages(ticker, url_format, backend, repeat):
+    """ Runs bench_stages in a fresh process, adding the peak memory growth in KiB """
+    base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results, n_rows, n_bytes = bench_stages(ticker, url_format, backend, repeat)
+    return results, n_rows, n_bytes, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base_rss
+
+def bench_fixtures(fixture_dir, repeat=3):
+    """ Runs bench_stages on every fixture of a directory with every extraction backend, each
+    in its own process, fetching the pages from a local stub_server.
+
+    Args:
+        fixture_dir (str): directory of fixtures, see fixtures.py
+        repeat (int): number of runs per stage, the best one is reported
+
+    Returns:
+        OrderedDict: '{ticker}/{backend}' -> dict with 'rows', 'bytes', 'peak_rss_kib' and
+            per-stage 'seconds' and 'rows_per_s'
+    """
+    import fixtures
+    import stub_server
+    report = OrderedDict()
+    ctx = multiprocessing.get_context("spawn")
+    with stub_server.StubServer(fixture_dir) as server:
+        for ticker in fixtures.list_fixtures(fixture_dir):
+            for backend in options_csv.EXTRACTORS:
+                with ctx.Pool(1) as pool:
+                    seconds, n_rows, n_bytes, peak = pool.apply(
+                        _measure_stages, (ticker, server.url_format, backend, repeat))
+                report["{}/{}".format(ticker, backend)] = OrderedDict([
+                    ("rows", n_rows), ("bytes", n_bytes), ("peak_rss_kib", peak),
+                    ("seconds", seconds),
+                    ("rows_per_s", OrderedDict((stage, n_rows / elapsed if elapsed else None)
+                                               for stage, elapsed in seconds.items()))])
+                print("{} {} ({} rows, {:.1f} KiB, {:.1f} MiB peak)".format(
+                    ticker, backend, n_rows, n_bytes / 1024., peak / 1024.))
+                for stage, elapsed in seconds.items():
+                    print("  {:>14}: {:8.4f}s".format(stage, elapsed))
+    return report
+
+def compare_to_baseline(report, baseline, tolerance=0.25):
+    """ Finds the stages that got slower than a baseline report by more than tolerance.
+
+    Args:
+        report (dict): report of bench_fixtures
+        baseline (dict): earlier report of bench_fixtures
+        tolerance (float): allowed slowdown, as a fraction of the baseline time
+
+    Returns:
+        list: description of each regression
+    """
+    regressions = []
+    for key, results in report.items():
+        if key not in baseline:
+            continue
+        for stage, elapsed in results["seconds"].items():
+            before = baseline[key]["seconds"].get(stage)
+            if before and elapsed > before * (1 + tolerance):
+                regressions.append("{} {}: {:.4f}s -> {:.4f}s (+{:.0%})".format(
+                    key, stage, before, elapsed, elapsed / before - 1))
+    return regressions
+
+# Module -> (cold import budget in seconds, packages it must not load)
+IMPORT_BUDGETS = OrderedDict([
+    ("constants", (0.05, ["pandas", "numpy", "bs4", "plotly"])),
+    ("cli", (0.1, ["pandas", "numpy", "bs4", "plotly", "django"])),
+    ("options_csv", (1.0, ["bs4", "plotly", "urllib.request"])),
+    ("plot_csv", (0.1, ["pandas", "bs4", "plotly"])),
+    ("heatmap", (1.5, ["bs4", "plotly", "urllib.request"])),
+])
+# Prints the import time of a module and which of a list of packages it loaded
+_IMPORT_PROBE = """
+import sys, time, json
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps([elapsed, [name for name in {forbidden!r} if name in sys.modules]]))
+"""
+
+def bench_imports(budgets=IMPORT_BUDGETS, repeat=3):
+    """ Times a cold import of each module in a fresh interpreter, keeping the best of repeat
+    runs.
+
+    Args:
+        budgets (dict): module -> (seconds, packages it must not load), see IMPORT_BUDGETS
+        repeat (int): number of interpreters started per module
+
+    Returns:
+        list: description of each module over its budget or loading a forbidden package
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    failures = []
+    for module, (budget, forbidden) in budgets.items():
+        probe = _IMPORT_PROBE.format(module=module, forbidden=forbidden)
+        best, loaded = None, []
+        for _ in range(repeat):
+            output = subprocess.check_output([sys.executable, "-W", "ignore", "-c", probe],
+                                             cwd=here)
+            elapsed, loaded = json.loads(output.decode("utf-8").splitlines()[-1])
+            best = elapsed if best is None else min(best, elapsed)
+        print("{:>12}: {:7.3f}s (budget {:.2f}s){}".format(
+            module, best, budget, " loads " + ", ".join(loaded) if loaded else ""))
+        if best > budget:
+            failures.append("{} imports in {:.3f}s, over its {:.2f}s budget".format(
+                module, best, budget))
+        if loaded:
+            failures.append("{} loads {}".format(module, ", ".join(loaded)))
+    return failures
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmarks the options chain parser.")
+    parser.add_argument("--page", action="append",
+        help="Saved MarketWatch page to parse, may be repeated. Default is a synthetic page.")
+    parser.add_argument("--expirations", type=int, default=40,
+        help="Expirations in the synthetic page")
+    parser.add_argument("--strikes", type=int, default=200,
+        help="Strikes per expiration in the synthetic page")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per parser")
+    parser.add_argument("--backends", action="store_true",
+        help="Compare the extraction backends instead of the legacy parser")
+    parser.add_argument("--check", action="store_true",
+        help="Only check that all extraction backends produce identical tables")
+    parser.add_argument("--greeks", type=int, metavar="N",
+        help="Benchmark implied volatility on N random contracts instead of parsing")
+    parser.add_argument("--imports", action="store_true",
+        help="Time cold imports of the entry points against their start-up budgets")
+    parser.add_argument("--stages", metavar="FIXTURE_DIR",
+        help="Time each capture stage on every page of a fixture directory")
+    parser.add_argument("--json", help="With --stages, save the report to this file")
+    parser.add_argument("--baseline",
+        help="With --stages, fail if any stage is slower than in this saved report")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+        help="Allowed slowdown against the baseline, as a fraction. Default is 0.25.")
+
+    args = parser.parse_args()
+    if args.imports:
+        failures = bench_imports(repeat=args.repeat)
+        for failure in failures:
+            print("OVER BUDGET " + failure)
+        raise SystemExit(1 if failures else 0)
+    if args.greeks:
+        bench_greeks(args.greeks, args.repeat)
+        raise SystemExit()
+    if args.stages:
+        report = bench_fixtures(args.stages, args.repeat)
+        if args.json:
+            with open(args.json, "w") as fobj:
+                json.dump(report, fobj, indent=2)
+        if args.baseline:
+            with open(args.baseline) as fobj:
+                regressions = compare_to_baseline(report, json.load(fobj), args.tolerance)
+            for regression in regressions:
+                print("REGRESSION " + regression)
+            raise SystemExit(1 if regressions else 0)
+        raise SystemExit()
+    pages = OrderedDict()
+    for filename in args.page or []:
+        with open(filename, "rb") as fobj:
+            pages[filename] = fobj.read()
+    if not pages:
+        pages["synthetic"] = make_chain_page(args.expirations, args.strikes).encode("utf-8")
+
+    for name, page in pages.items():
+        print("{} ({:.1f} KiB)".format(name, len(page) / 1024.))
+        if args.check:
+            check_backends(page)
+            print("  backends match")
+        elif args.backends:
+            bench_backends(page, args.repeat)
+        else:
+            bench_parser(page, args.repeat)
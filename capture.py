@@ -0,0 +1,400 @@
+""" Long-running intraday capture service.
+
+Instead of a cron job starting a fresh interpreter (and a fresh connection) for every capture,
+CaptureDaemon stays up with its imports loaded and its HTTP connections kept alive, and captures
+each ticker on its own schedule:
+
+    python capture.py --schedule spx=300 --schedule ndx=600 --session 09:30-16:15 --out data
+
+Downloads are conditional (If-None-Match / If-Modified-Since), so a page the server reports as
+unchanged costs neither the download nor the parse; a page whose body is identical to the last
+one is not parsed either. Every downloaded page goes through a write-ahead buffer on disk before
+it is parsed and saved, so captures pending when the service stops or crashes are saved on the
+next start. A page that can't be parsed or saved is moved out of the buffer to a quarantine
+directory, so it is kept for inspection but never replayed. SIGINT and SIGTERM finish the
+capture in progress and then stop.
+"""
+import os
+import gzip
+import heapq
+import signal
+import hashlib
+import logging
+import datetime
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+import options_csv
+import fetch
+import metrics
+import parse_cache
+from constants import OUTPUT_FORMATS
+
+log = logging.getLogger(__name__)
+
+# Write-ahead buffer directory, under the output directory
+PENDING_DIRNAME = ".pending"
+# Pages that failed to be processed, under the write-ahead buffer directory
+QUARANTINE_DIRNAME = "failed"
+PENDING_FILENAME_FORMAT = "{ticker}_{time}.html.gz"
+PENDING_TIME_FORMAT = "%Y%m%dT%H%M%S%f"
+
+Schedule = namedtuple("Schedule", ["ticker", "interval", "start", "end"])
+
+def parse_schedule(spec, session=None):
+    """ Reads a schedule given as 'ticker=seconds'.
+
+    Args:
+        spec (str): ticker and capture interval in seconds, e.g. 'spx=300'
+        session (str): daily capture window as 'HH:MM-HH:MM'. Default is all day.
+
+    Returns:
+        Schedule: the schedule
+    """
+    ticker, _, interval = spec.partition("=")
+    start = end = None
+    if session:
+        start, end = [datetime.datetime.strptime(value.strip(), "%H:%M").time()
+                      for value in session.split("-")]
+    return Schedule(ticker.strip().lower(), float(interval or 300), start, end)
+
+def next_run(schedule, after):
+    """ First capture time of a schedule at or after a given time, within its session.
+
+    Args:
+        schedule (Schedule): schedule of the ticker
+        after (datetime.datetime): earliest time
+
+    Returns:
+        datetime.datetime: time of the next capture
+    """
+    if schedule.start is None:
+        return after
+    if after.time() < schedule.start:
+        return datetime.datetime.combine(after.date(), schedule.start)
+    if after.time() > schedule.end:
+        return datetime.datetime.combine(after.date() + datetime.timedelta(days=1),
+                                         schedule.start)
+    return after
+
+class WriteAheadBuffer(object):
+    """ Downloaded pages waiting to be parsed and saved, one gzipped file each, so that none is
+    lost if the service stops in between.
+
+    Args:
+        directory (str): directory holding the pending pages, created if missing
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def put(self, ticker, captured_at, page):
+        """ Stores a page before it is processed.
+
+        Returns:
+            str: path of the pending file, to pass to done once the page is saved
+        """
+        path = os.path.join(self.directory, PENDING_FILENAME_FORMAT.format(
+            ticker=ticker, time=captured_at.strftime(PENDING_TIME_FORMAT)))
+        # Written under a temporary name and renamed, so a crash can't leave half a page
+        with gzip.open(path + ".tmp", "wb", compresslevel=1) as fobj:
+            fobj.write(page)
+        os.replace(path + ".tmp", path)
+        return path
+
+    def done(self, path):
+        """ Drops a page once it has been saved. """
+        os.remove(path)
+
+    def quarantine(self, path):
+        """ Moves a page that couldn't be processed out of the buffer, so it isn't replayed.
+        Moving it back into the buffer directory retries it on the next start.
+
+        Returns:
+            str: new path of the page
+        """
+        directory = os.path.join(self.directory, QUARANTINE_DIRNAME)
+        os.makedirs(directory, exist_ok=True)
+        moved = os.path.join(directory, os.path.basename(path))
+        os.replace(path, moved)
+        log.warning("Moved %s to %s", path, directory)
+        return moved
+
+    def pending(self):
+        """ Lists the pages left over by a previous run, oldest first.
+
+        Returns:
+            list: (ticker, captured_at, path) tuples
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".html.gz"):
+                continue
+            ticker, _, stamp = name[:-len(".html.gz")].rpartition("_")
+            captured_at = datetime.datetime.strptime(stamp, PENDING_TIME_FORMAT)
+            entries.append((ticker, captured_at, os.path.join(self.directory, name)))
+        return sorted(entries, key=lambda entry: entry[1])
+
+    def read(self, path):
+        with gzip.open(path, "rb") as fobj:
+            return fobj.read()
+
+class CaptureDaemon(object):
+    """ Captures options chains on per-ticker schedules, keeping its HTTP connections warm.
+
+    Args:
+        schedules (list): Schedule of each ticker
+        outdir (str): output directory
+        fmt (str): output format, 'csv', 'delta', 'segment' or one of store.FORMATS
+        url_format (str): url of the options page, formatted with the lowercase ticker
+        backend (str): name of the row extraction backend, see options_csv.EXTRACTORS
+        timeout (float): socket timeout in seconds for each request
+        retries (int): number of retries after the first attempt of each download
+        metrics_file (str): rewrite the pipeline metrics to this Prometheus text file after
+            every capture
+        cache (parse_cache.ParseCache): cache of chains already parsed, which also remembers
+            the last page saved per ticker across restarts
+    """
+    def __init__(self, schedules, outdir, fmt="csv",
+                 url_format=options_csv.MARKETWATCH_URL_FORMAT, backend="soup", timeout=10.0,
+                 retries=3, metrics_file=None, cache=None):
+        self.schedules = OrderedDict((schedule.ticker, schedule) for schedule in schedules)
+        self.outdir = outdir
+        self.fmt = fmt
+        self.url_format = url_format
+        self.backend = backend
+        self.retries = retries
+        self.metrics_file = metrics_file
+        self.cache = cache
+        self.pool = fetch.ConnectionPool(maxsize=len(self.schedules) or 1, timeout=timeout)
+        self.buffer = WriteAheadBuffer(os.path.join(outdir, PENDING_DIRNAME))
+        self.stopping = threading.Event()
+        # Per ticker: validators of the last download and digest of the last page parsed, both
+        # only for the day of _dates
+        self._validators = {}
+        self._digests = {}
+        self._dates = {}
+        self._writers = {}
+        self.stats = OrderedDict([("captured", 0), ("not_modified", 0), ("unchanged", 0),
+                                  ("failed", 0)])
+
+    def stop(self, *args):
+        """ Asks the daemon to stop after the capture in progress. Usable as a signal handler. """
+        log.info("Stopping")
+        self.stopping.set()
+
+    def _save(self, ticker, chain, captured_at):
+        if self.fmt == "delta":
+            import delta
+            writer = self._writers.get(ticker)
+            if writer is None:
+                writer = self._writers[ticker] = delta.DeltaWriter(self.outdir, ticker)
+            return delta.write_delta(chain, ticker, self.outdir, captured_at, writer=writer)
+        if self.fmt == "segment":
+            import segment
+            path = segment.write_segment(chain, ticker, self.outdir, captured_at)
+            # The first capture of a day closes the previous day's segment, and the first
+            # capture after a start closes whatever earlier days a previous run left open
+            previous = self._writers.get(ticker)
+            if previous != captured_at.date():
+                segment.close_segments(self.outdir, [ticker], since=previous,
+                                       until=captured_at.date() - datetime.timedelta(days=1))
+            self._writers[ticker] = captured_at.date()
+            return path
+        return options_csv.save_chain(chain, ticker, self.outdir, self.fmt, captured_at)
+
+    def _failed(self, ticker):
+        self.stats["failed"] += 1
+        metrics.inc("capture_failures", ticker=ticker)
+
+    def _process(self, ticker, captured_at, path, page, chain=None):
+        """ Parses (unless chain was found in the parse cache) and saves a buffered page, then
+        drops it from the buffer. A page that fails is quarantined before the error is raised.
+        """
+        try:
+            if chain is None:
+                chain = options_csv.parse_chain(page, self.backend)
+            self._save(ticker, chain, captured_at)
+        except Exception:
+            self.buffer.quarantine(path)
+            raise
+        self.buffer.done(path)
+        if self.cache is not None:
+            self.cache.saved(
+                parse_cache.cache_key(page, self.backend), chain, ticker,
+                parse_cache.destination(self.outdir, self.fmt, captured_at.date()))
+        self.stats["captured"] += 1
+        metrics.inc("captures", ticker=ticker)
+
+    def recover(self):
+        """ Saves the pages left in the write-ahead buffer by a previous run. Pages that fail are
+        logged and quarantined, see WriteAheadBuffer.quarantine.
+
+        Returns:
+            int: number of pages recovered
+        """
+        recovered = 0
+        for ticker, captured_at, path in self.buffer.pending():
+            log.info("Recovering capture of %s at %s", ticker, captured_at)
+            try:
+                self._process(ticker, captured_at, path, self.buffer.read(path))
+            except Exception:
+                log.exception("Failed to recover capture of %s at %s", ticker, captured_at)
+                self._failed(ticker)
+                continue
+            recovered += 1
+        return recovered
+
+    def capture(self, ticker, captured_at=None):
+        """ Captures one ticker now, unless its page hasn't changed since the last capture that
+        day: the first page of a day is always saved, to that day's files. A page that fails to
+        parse or save is logged and quarantined, and retried on the next capture.
+
+        Args:
+            ticker (str): ticker symbol to capture
+            captured_at (datetime.datetime): capture time. Default is now.
+
+        Returns:
+            bool: whether a new capture was saved
+        """
+        captured_at = captured_at or datetime.datetime.now()
+        if self._dates.get(ticker) != captured_at.date():
+            self._validators.pop(ticker, None)
+            self._digests.pop(ticker, None)
+            self._dates[ticker] = captured_at.date()
+        page, validators = fetch.fetch_page_if_changed(
+            self.pool, ticker, self.url_format, self._validators.get(ticker), self.retries)
+        if page is None:
+            log.info("%s not modified", ticker)
+            self.stats["not_modified"] += 1
+            metrics.inc("captures_skipped", ticker=ticker, reason="not_modified")
+            return False
+        digest = hashlib.sha1(page).digest()
+        if digest == self._digests.get(ticker):
+            log.info("%s unchanged", ticker)
+            self.stats["unchanged"] += 1
+            metrics.inc("captures_skipped", ticker=ticker, reason="unchanged")
+            return False
+        chain, unchanged = None, False
+        if self.cache is not None:
+            chain, unchanged = self.cache.unchanged(
+                parse_cache.cache_key(page, self.backend), ticker,
+                parse_cache.destination(self.outdir, self.fmt, captured_at.date()))
+        if unchanged:
+            # Saved before a restart: remembered so later captures compare against it
+            log.info("%s unchanged since it was last saved", ticker)
+            self._validators[ticker] = validators
+            self._digests[ticker] = digest
+            self.stats["unchanged"] += 1
+            metrics.inc("captures_skipped", ticker=ticker, reason="cached")
+            return False
+        path = self.buffer.put(ticker, captured_at, page)
+        try:
+            self._process(ticker, captured_at, path, page, chain)
+        except Exception:
+            log.exception("Failed to save capture of %s", ticker)
+            self._failed(ticker)
+            return False
+        # Only remembered once saved, so a failed capture is retried in full next time
+        self._validators[ticker] = validators
+        self._digests[ticker] = digest
+        return True
+
+    def run(self, duration=None):
+        """ Captures every ticker on its schedule until stop is called (or a signal arrives),
+        after saving whatever the previous run left in the write-ahead buffer.
+
+        Args:
+            duration (float): stop after this many seconds. Default runs until stopped.
+
+        Returns:
+            OrderedDict: capture counts
+        """
+        if threading.current_thread() is threading.main_thread():
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                signal.signal(signum, self.stop)
+        deadline = None if duration is None else time.monotonic() + duration
+        self.recover()
+
+        now = datetime.datetime.now()
+        queue = [(next_run(schedule, now), ticker) for ticker, schedule in self.schedules.items()]
+        heapq.heapify(queue)
+        try:
+            while queue and not self.stopping.is_set():
+                due, ticker = queue[0]
+                wait = (due - datetime.datetime.now()).total_seconds()
+                if deadline is not None:
+                    wait = min(wait, deadline - time.monotonic())
+                if wait > 0 and self.stopping.wait(wait):
+                    break
+                if deadline is not None and time.monotonic() >= deadline:
+                    break
+                if datetime.datetime.now() < due:
+                    continue
+                try:
+                    with metrics.timer("capture", ticker=ticker):
+                        self.capture(ticker)
+                except Exception:
+                    log.exception("Failed to capture %s", ticker)
+                    self._failed(ticker)
+                # Lateness of the capture against its schedule, to see it slipping
+                metrics.observe("schedule_lag", (datetime.datetime.now() - due).total_seconds(),
+                                ticker=ticker)
+                if self.metrics_file:
+                    metrics.REGISTRY.write_prometheus(self.metrics_file)
+                schedule = self.schedules[ticker]
+                heapq.heapreplace(queue, (next_run(
+                    schedule, due + datetime.timedelta(seconds=schedule.interval)), ticker))
+        finally:
+            self.pool.close()
+        log.info("Stopped: %s", dict(self.stats))
+        return self.stats
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Captures options chains on a schedule.")
+    parser.add_argument("--schedule", action="append", required=True,
+        help="Ticker and capture interval in seconds, e.g. spx=300. May be repeated.")
+    parser.add_argument("--session",
+        help="Daily capture window as HH:MM-HH:MM local time, e.g. 09:30-16:15. "
+             "Default is all day.")
+    parser.add_argument("--url-format", default=options_csv.MARKETWATCH_URL_FORMAT,
+        help="Options page url, formatted with the lowercase ticker.")
+    parser.add_argument("--out", default=os.getcwd(),
+        help="Output directory. Default is current dir.")
+    parser.add_argument("--format", default="csv", choices=OUTPUT_FORMATS,
+        help="Output format, see options_csv.py.")
+    parser.add_argument("--backend", default="soup", choices=list(options_csv.EXTRACTORS),
+        help="HTML extraction backend. Default is soup (BeautifulSoup).")
+    parser.add_argument("--timeout", type=float, default=10.0,
+        help="Per-request timeout in seconds.")
+    parser.add_argument("--retries", type=int, default=3, help="Retries per download.")
+    parser.add_argument("--parse-cache",
+        help="Keep the chains parsed in this directory, so pages unchanged since they were last "
+             "saved are skipped, also across restarts.")
+    parser.add_argument("--parse-cache-mb", type=float, default=parse_cache.MAX_BYTES / 2**20,
+        help="Size of the parse cache in MiB, least recently used chains are evicted beyond it.")
+    parser.add_argument("--duration", type=float,
+        help="Stop after this many seconds. Default runs until interrupted.")
+    parser.add_argument("--metrics-file",
+        help="Keep the pipeline metrics in this Prometheus text file, rewritten every capture.")
+    parser.add_argument("--metrics-port", type=int,
+        help="Also serve the pipeline metrics at http://127.0.0.1:PORT/metrics")
+    parser.add_argument("--summary", help="Write a JSON summary of the metrics on exit.")
+    parser.add_argument("--verbose", action="store_true", help="Print debug information")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
+    if args.metrics_port:
+        metrics.REGISTRY.serve(args.metrics_port)
+    cache = parse_cache.ParseCache(args.parse_cache, int(args.parse_cache_mb * 2**20)) \
+        if args.parse_cache else None
+    daemon = CaptureDaemon([parse_schedule(spec, args.session) for spec in args.schedule],
+                           args.out, args.format, args.url_format, args.backend, args.timeout,
+                           args.retries, args.metrics_file, cache)
+    daemon.run(args.duration)
+    if args.summary:
+        metrics.REGISTRY.write_summary(args.summary)
@@ -0,0 +1,260 @@
+""" SQLite manifest of the snapshot files written by options_csv.
+
+Every file written (a CSV per expiration, or a columnar snapshot holding all expirations) is
+recorded with its ticker, capture date and time, expiration, path, row count and size, so
+lookups like "all SPX expirations captured on a date" or "NDX December 2026 over the last 90
+days" are index queries instead of a walk of the output tree.
+
+The catalog lives next to the data, in '{outdir}/catalog.sqlite' by default.
+"""
+import os
+import sqlite3
+import datetime
+import logging
+from collections import namedtuple
+
+log = logging.getLogger(__name__)
+
+CATALOG_FILENAME = "catalog.sqlite"
+# Expiration recorded for files holding a whole chain
+ALL_EXPIRATIONS = ""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY,
+    ticker TEXT NOT NULL,
+    capture_date TEXT NOT NULL,
+    captured_at TEXT NOT NULL,
+    expiration TEXT NOT NULL,
+    format TEXT NOT NULL,
+    path TEXT NOT NULL UNIQUE,
+    rows INTEGER NOT NULL,
+    bytes INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS snapshots_by_date
+    ON snapshots (ticker, capture_date, expiration);
+CREATE INDEX IF NOT EXISTS snapshots_by_expiration
+    ON snapshots (ticker, expiration, capture_date);
+"""
+
+# Expiration formats found in page headings and in CSV filenames
+EXPIRATION_FORMATS = ["%B %d, %Y", "%B-%d-%Y", "%b %d, %Y", "%b-%d-%Y"]
+
+def expiration_key(expiration):
+    """ Normalises an expiration as found in a page heading ('March 16, 2018') or a CSV filename
+    ('March-16-2018') to an ISO date, so it can be queried the same way whatever its source.
+    Unrecognised expirations are returned unchanged.
+
+    Args:
+        expiration (str or datetime.date): expiration to normalise
+
+    Returns:
+        str: ISO date of the expiration, e.g. '2018-03-16'
+    """
+    if isinstance(expiration, datetime.date):
+        return expiration.isoformat()
+    for date_format in EXPIRATION_FORMATS:
+        try:
+            return datetime.datetime.strptime(expiration, date_format).date().isoformat()
+        except ValueError:
+            pass
+    return expiration
+
+Snapshot = namedtuple("Snapshot", [
+    "ticker", "capture_date", "captured_at", "expiration", "format", "path", "rows", "bytes"])
+
+def catalog_path(outdir):
+    """ Path of the catalog that indexes the given output directory """
+    return os.path.join(outdir or "", CATALOG_FILENAME)
+
+class Catalog(object):
+    """ Index of snapshot files, stored in an SQLite database. Paths are stored relative to the
+    directory holding the database, so the archive can be moved as a whole, and returned as
+    absolute paths.
+
+    Args:
+        path (str): path of the database file, created if missing
+    """
+    def __init__(self, path):
+        self.path = path
+        self.root = os.path.dirname(os.path.abspath(path))
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _relpath(self, path):
+        return os.path.relpath(os.path.abspath(path), self.root)
+
+    def add(self, ticker, expiration, path, rows, captured_at=None, fmt=None):
+        """ Records a snapshot file, replacing any previous record of the same path. See add_all
+        to record many files in one transaction.
+
+        Args:
+            ticker (str): ticker symbol of the option data
+            expiration (str): expiration held by the file, or ALL_EXPIRATIONS. Stored
+                normalised by expiration_key.
+            path (str): path of the file
+            rows (int): number of rows in the file
+            captured_at (datetime.datetime): capture time. Default is now.
+            fmt (str): file format. Default is the file extension.
+        """
+        self.add_all([(ticker, expiration, path, rows, captured_at, fmt)])
+
+    def add_all(self, records):
+        """ Records several snapshot files in a single transaction.
+
+        Args:
+            records (iterable): (ticker, expiration, path, rows, captured_at, fmt) tuples, with
+                the same meaning as the arguments of add
+        """
+        def make_row(ticker, expiration, path, rows, captured_at, fmt):
+            captured_at = captured_at or datetime.datetime.now()
+            return (ticker.lower(), captured_at.date().isoformat(),
+                    captured_at.isoformat(timespec="seconds"),
+                    expiration and expiration_key(expiration),
+                    fmt or os.path.splitext(path)[1].lstrip("."),
+                    self._relpath(path), int(rows), os.path.getsize(path))
+
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO snapshots (ticker, capture_date, captured_at, expiration,"
+                " format, path, rows, bytes) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (make_row(*record) for record in records))
+
+    def find(self, ticker, capture_date=None, expiration=None, since=None, until=None, fmt=None):
+        """ Looks up snapshot files, oldest first.
+
+        Args:
+            ticker (str): ticker symbol of the option data
+            capture_date (datetime.date or str): only files captured on this day
+            expiration (str or datetime.date): only files holding this expiration, in any form
+                accepted by expiration_key. Files holding a whole chain always match.
+            since (datetime.date or str): only files captured on or after this day
+            until (datetime.date or str): only files captured on or before this day
+            fmt (str): only files of this format
+
+        Returns:
+            list: Snapshot records, with absolute paths
+        """
+        query = "SELECT {} FROM snapshots WHERE ticker = ?".format(", ".join(Snapshot._fields))
+        params = [ticker.lower()]
+        for clause, value in [("capture_date = ?", capture_date), ("capture_date >= ?", since),
+                              ("capture_date <= ?", until), ("format = ?", fmt)]:
+            if value is not None:
+                query += " AND " + clause
+                params.append(str(value))
+        if expiration is not None:
+            query += " AND expiration IN (?, ?)"
+            params += [expiration_key(expiration), ALL_EXPIRATIONS]
+        query += " ORDER BY captured_at, expiration"
+        return [row._replace(path=os.path.join(self.root, row.path))
+                for row in map(Snapshot._make, self.conn.execute(query, params))]
+
+    def prune(self):
+        """ Drops records whose file no longer exists.
+
+        Returns:
+            int: number of records dropped
+        """
+        missing = [(path,) for (path,) in self.conn.execute("SELECT path FROM snapshots")
+                   if not os.path.exists(os.path.join(self.root, path))]
+        with self.conn:
+            self.conn.executemany("DELETE FROM snapshots WHERE path = ?", missing)
+        return len(missing)
+
+def record_chain_files(outdir, ticker, written, chain, captured_at=None):
+    """ Records the files of one saved chain in the catalog of outdir.
+
+    Args:
+        outdir (str): output directory holding the catalog
+        ticker (str): ticker symbol of the option data
+        written (OrderedDict or str): expiration -> CSV filename, or the path of a columnar
+            snapshot holding the whole chain
+        chain (OrderedDict): expiration string -> DataFrame that was saved
+        captured_at (datetime.datetime): capture time. Default is now.
+    """
+    with Catalog(catalog_path(outdir)) as catalog:
+        if isinstance(written, str):
+            catalog.add(ticker, ALL_EXPIRATIONS, written,
+                        sum(len(table) for table in chain.values()), captured_at)
+        else:
+            catalog.add_all((ticker, expiration, filename, len(chain[expiration]), captured_at,
+                             None) for expiration, filename in written.items())
+
+def index_directory(outdir):
+    """ Adds the files already in an output directory to its catalog, for archives written
+    before the catalog existed. Capture times are taken from the file modification times.
+
+    Args:
+        outdir (str): output directory to index
+
+    Returns:
+        int: number of files recorded
+    """
+    import re
+    import store
+    import segment
+    csv_pattern = re.compile(
+        r"^(?P<date>\d{4}-\d{2}-\d{2})_(?P<ticker>[^_]+)__exp(?P<exp>.+)\.csv$")
+    snapshot_extensions = tuple("." + extension for extension in store.FORMATS.values())
+    # Filename prefixes of full snapshots and of delta capture keyframes and deltas
+    snapshot_prefixes = ("snapshot-", "keyframe-", "delta-")
+
+    def iter_records():
+        for root, dirs, files in os.walk(outdir):
+            for name in files:
+                path = os.path.join(root, name)
+                match = csv_pattern.match(name)
+                if match:
+                    with open(path) as fobj:
+                        rows = max(sum(1 for _ in fobj) - 1, 0)
+                    captured_at = datetime.datetime.combine(
+                        datetime.date.fromisoformat(match.group("date")),
+                        datetime.datetime.fromtimestamp(os.path.getmtime(path)).time())
+                    yield match.group("ticker"), match.group("exp"), path, rows, captured_at, None
+                elif (name.endswith(snapshot_extensions) and name.startswith(snapshot_prefixes)
+                      and "ticker=" in root):
+                    date_dir, ticker_dir = os.path.split(root)
+                    captured_at = datetime.datetime.strptime(
+                        os.path.basename(date_dir).split("=", 1)[1] +
+                        name.split("-")[-1].split(".")[0], "%Y-%m-%d%H%M%S")
+                    rows = len(store.read_snapshot(path, columns=[]))
+                    # Keyframes and deltas of delta capture are told apart from full snapshots
+                    fmt = None if name.startswith("snapshot-") else "delta"
+                    yield (ticker_dir.split("=", 1)[1], ALL_EXPIRATIONS, path, rows, captured_at,
+                           fmt)
+                elif name == segment.SEGMENT_FILENAME and "ticker=" in root:
+                    with segment.Segment(path) as captures:
+                        if not len(captures):
+                            continue
+                        yield (os.path.basename(root).split("=", 1)[1], ALL_EXPIRATIONS, path,
+                               captures.rows, captures.frames[-1].captured_at,
+                               segment.CATALOG_FORMAT)
+
+    records = list(iter_records())
+    with Catalog(catalog_path(outdir)) as catalog:
+        catalog.add_all(records)
+    return len(records)
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Maintains the snapshot catalog of a directory")
+    parser.add_argument("outdir", help="Output directory of options_csv")
+    parser.add_argument("--prune", action="store_true",
+        help="Drop records of files that no longer exist instead of indexing")
+
+    args = parser.parse_args()
+    if args.prune:
+        with Catalog(catalog_path(args.outdir)) as catalog:
+            print("Dropped {} records".format(catalog.prune()))
+    else:
+        print("Recorded {} files".format(index_directory(args.outdir)))
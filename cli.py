@@ -0,0 +1,253 @@
+""" Single entry point for the options scripts, with one subcommand per task:
+
+    python cli.py fetch --symbols spx,ndx,rut --format parquet
+    python cli.py plot --csv spx.csv --param "Open Int."
+    python cli.py heatmap --symbol spx --param "call_Open Int."
+    python cli.py import-trades tastyworks.csv
+    python cli.py enrich-trades data/
+
+Only argparse and the constants are loaded up front; each subcommand imports what it needs when
+it runs, so `plot` never loads the HTML parser and `fetch` never loads plotly. The scripts'
+own command lines (`python options_csv.py --symbol spx`, `python heatmap.py ...`) go through
+here too and keep working as before.
+"""
+import os
+import sys
+import logging
+import argparse
+
+from constants import BACKENDS, MARKETWATCH_URL_FORMAT, OUTPUT_FORMATS
+
+log = logging.getLogger(__name__)
+
+# Offline rendering formats, see render.FORMATS
+RENDER_FORMATS = ["html", "png", "svg", "pdf"]
+# Django project of the trade journal, for import-trades
+JOURNAL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "journal")
+
+def add_fetch_arguments(parser):
+    parser.add_argument("--symbol", default="spx", help="Symbol to look up.")
+    parser.add_argument("--symbols",
+        help="Comma-separated symbols to fetch concurrently, e.g. spx,ndx,rut. Overrides --symbol.")
+    parser.add_argument("--url-format", default=MARKETWATCH_URL_FORMAT,
+        help="Options page url, formatted with the lowercase ticker.")
+    parser.add_argument("--concurrency", type=int, default=4,
+        help="Maximum downloads in flight with --symbols.")
+    parser.add_argument("--timeout", type=float, default=10.0,
+        help="Per-request timeout in seconds with --symbols.")
+    parser.add_argument("--retries", type=int, default=3,
+        help="Retries per download with --symbols.")
+    parser.add_argument("--out", default=os.getcwd(),
+        help="Output directory. Default is current dir.")
+    parser.add_argument("--backend", default="soup", choices=BACKENDS,
+        help="HTML extraction backend. Default is soup (BeautifulSoup).")
+    parser.add_argument("--workers", type=int, default=0,
+        help="Parse and save expirations across this many processes. Default is 0 (no split).")
+    parser.add_argument("--format", default="csv", choices=OUTPUT_FORMATS,
+        help="Output format: one CSV per expiration (default), one columnar snapshot file, or "
+             "only the strikes changed since the last capture.")
+    parser.add_argument("--greeks", action="store_true",
+        help="Also save the mid, implied volatility and Greeks of every contract.")
+    parser.add_argument("--replay",
+        help="Parse the page recorded in this fixture directory instead of downloading it.")
+    parser.add_argument("--record", help="Also save the downloaded page to this fixture directory.")
+    parser.add_argument("--parse-cache",
+        help="Keep the chains parsed in this directory, so pages unchanged since they were last "
+             "saved are neither parsed nor saved again.")
+    parser.add_argument("--parse-cache-mb", type=float, default=256,
+        help="Size of the parse cache in MiB, least recently used chains are evicted beyond it.")
+    parser.add_argument("--metrics-file",
+        help="Write per-stage timings and counts to this file in the Prometheus text format.")
+    parser.add_argument("--summary", help="Write per-stage timings and counts to this JSON file.")
+    parser.add_argument("--info", action="store_true", help="Print additional information")
+    parser.add_argument("--verbose", action="store_true", help="Print debug information")
+
+def run_fetch(args):
+    if args.verbose:
+        logging.basicConfig(level=logging.DEBUG)
+    elif args.info:
+        logging.basicConfig(level=logging.INFO)
+    else:
+        logging.basicConfig(level=logging.WARNING)
+    import metrics
+    import options_csv
+    cache = None
+    if args.parse_cache:
+        import parse_cache
+        cache = parse_cache.ParseCache(args.parse_cache, int(args.parse_cache_mb * 2**20))
+    if args.symbols:
+        import fetch
+        written = fetch.fetch_and_write(
+            [symbol.strip() for symbol in args.symbols.split(",") if symbol.strip()],
+            url_format=args.url_format, concurrency=args.concurrency, timeout=args.timeout,
+            retries=args.retries, backend=args.backend, outdir=args.out, fmt=args.format,
+            cache=cache, with_greeks=args.greeks)
+        failed = any(isinstance(result, Exception) for result in written.values())
+    else:
+        failed = False
+        page = options_csv.download_page(args.symbol, args.url_format, args.replay, args.record)
+        if args.workers:
+            options_csv.parse_options_parallel(page, args.symbol, args.backend, args.workers,
+                                               args.out, args.format, cache, args.greeks)
+        else:
+            options_csv.parse_options(page, args.symbol, args.backend, args.out, args.format,
+                                      cache, args.greeks)
+    if args.metrics_file:
+        metrics.REGISTRY.write_prometheus(args.metrics_file)
+    if args.summary:
+        metrics.REGISTRY.write_summary(args.summary)
+    return 1 if failed else 0
+
+def add_plot_arguments(parser):
+    typical_params = ["Ask", "Bid", "Change", "Last", "Open Int.", "Symbol", "Vol"]
+    parser.add_argument("--csv", default=["spx.csv"], nargs="+",
+        help="CSV file(s) to pull parameter from")
+    parser.add_argument("--param", action="append",
+        help="Parameter to pull and plot, may be repeated. Default is 'Open Int.'. "
+             "Typical params are {} ".format(typical_params))
+    parser.add_argument("--out",
+        help="Render offline into this directory instead of uploading to the plotly cloud")
+    parser.add_argument("--format", default="html", choices=RENDER_FORMATS,
+        help="File format for offline rendering")
+
+def run_plot(args):
+    import pandas as pd
+    import plot_csv
+    params = args.param or ["Open Int."]
+    jobs = []
+    for csv in args.csv:
+        options_table = pd.read_csv(csv, index_col=0)
+        symbol = os.path.basename(csv).split(".")[0]
+        jobs += [(options_table, symbol, param) for param in params]
+    if args.out:
+        for filename in plot_csv.render_hbar_plots(jobs, args.out, args.format):
+            print(filename)
+    else:
+        for job in jobs:
+            plot_csv.make_hbar_plot(*job)
+    return 0
+
+def add_heatmap_arguments(parser):
+    parser.add_argument("--symbol", default="spx",
+        help="Symbol in CSV files, or a comma-separated list of symbols")
+    parser.add_argument("--param", default="call_Open Int.",
+        help="Column to plot, or a comma-separated list of columns")
+    parser.add_argument("--indir", default=os.getcwd(), help="Directory to look for CSV files")
+    parser.add_argument("--format", default="csv", choices=OUTPUT_FORMATS,
+        help="Format the options data was saved in")
+    parser.add_argument("--out",
+        help="Render offline into this directory instead of uploading to the plotly cloud")
+    parser.add_argument("--render-format", default="html", choices=RENDER_FORMATS,
+        help="File format for offline rendering")
+
+def run_heatmap(args):
+    import datetime
+    import heatmap
+    # TODO: Add date selection (just use today for now...)
+    args.csv_date = datetime.date.today()
+
+    symbols = args.symbol.split(",")
+    params = args.param.split(",")
+    jobs = []
+    for symbol in symbols:
+        options_cube = heatmap.get_combined_options_data(args.csv_date, symbol, args.indir,
+                                                         args.format, columns=params)
+        print(options_cube)
+        jobs += [(options_cube.field(param), "{}_{}_{}".format(
+            args.csv_date, symbol, heatmap.render_name(param))) for param in params]
+
+    if args.out:
+        for filename in heatmap.render_colorscales(jobs, args.out, args.render_format):
+            print(filename)
+    else:
+        for openInt_df, name in jobs:
+            print(openInt_df)
+            heatmap.build_colorscale(openInt_df)
+    return 0
+
+def add_import_trades_arguments(parser):
+    parser.add_argument("file", type=os.path.abspath, help="Tastyworks history CSV export")
+    parser.add_argument("--batch-size", type=int, default=1000,
+        help="Legs saved per database round trip")
+    parser.add_argument("--chunk-size", type=int, default=50000,
+        help="Export rows read and saved at a time")
+    parser.add_argument("--archive", type=os.path.abspath,
+        help="Output directory of fetch to price the new legs from, see enrich-trades")
+
+def _setup_journal():
+    """ Sets up the Django project of the trade journal """
+    sys.path.insert(0, JOURNAL_DIR)
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "journal.settings")
+    import django
+    django.setup()
+
+def run_import_trades(args):
+    logging.basicConfig(level=logging.INFO)
+    _setup_journal()
+    from trades.tastyworks_trades import import_tastyworks_trades
+    saved = import_tastyworks_trades(args.file, batch_size=args.batch_size,
+                                     archive_dir=args.archive, chunksize=args.chunk_size)
+    print("Imported {} new legs".format(saved))
+    return 0
+
+def add_enrich_trades_arguments(parser):
+    parser.add_argument("archive", type=os.path.abspath,
+        help="Output directory of fetch holding the captured chains")
+    parser.add_argument("--overwrite", action="store_true",
+        help="Also price legs that already have an underlying price")
+    parser.add_argument("--max-age-hours", type=float, default=24,
+        help="Ignore captures taken longer than this before an execution")
+
+def run_enrich_trades(args):
+    import datetime
+    logging.basicConfig(level=logging.INFO)
+    _setup_journal()
+    from trades.enrichment import enrich_legs
+    priced = enrich_legs(args.archive, overwrite=args.overwrite,
+                         max_age=datetime.timedelta(hours=args.max_age_hours))
+    print("Priced {} legs".format(priced))
+    return 0
+
+# Subcommand -> (help, argument builder, runner)
+COMMANDS = {
+    "fetch": ("Download options chains and save them", add_fetch_arguments, run_fetch),
+    "plot": ("Plot parameters of saved chain CSVs as bar charts", add_plot_arguments, run_plot),
+    "heatmap": ("Plot a parameter across the expirations of a day's capture",
+                add_heatmap_arguments, run_heatmap),
+    "import-trades": ("Import a Tastyworks history export into the trade journal",
+                      add_import_trades_arguments, run_import_trades),
+    "enrich-trades": ("Price journal legs from the chains captured before their execution",
+                      add_enrich_trades_arguments, run_enrich_trades),
+}
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Options chain capture and plotting tools")
+    subparsers = parser.add_subparsers(dest="command", metavar="command")
+    subparsers.required = True
+    for name, (description, add_arguments, _) in COMMANDS.items():
+        add_arguments(subparsers.add_parser(name, help=description, description=description))
+    return parser
+
+def main(argv=None):
+    """ Runs a subcommand
+
+    Args:
+        argv (list): command line arguments, starting with the subcommand. Default is
+            sys.argv[1:].
+
+    Returns:
+        int: exit status
+    """
+    args = build_parser().parse_args(argv)
+    return COMMANDS[args.command][2](args)
+
+def script_main(command, argv=None):
+    """ Runs one subcommand from a script's own command line, which doesn't name it """
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] in COMMANDS:
+        return main(argv)
+    return main([command] + argv)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,29 @@
+""" Names and formats shared by the capture, plotting and heatmap scripts.
+
+Kept free of imports so that scripts needing only a filename format or a column name don't pay
+for the parser's dependencies (pandas, bs4, urllib) at start-up.
+"""
+
+# Make a publicly available filename output format
+OUTPUT_FILENAME_PREFIX_FORMAT = "{date}_{ticker}"
+OUTPUT_FILENAME_SUFFIX_FORMAT = "_exp{expiration}.{extension}"
+OUTPUT_FILENAME_FORMAT = OUTPUT_FILENAME_PREFIX_FORMAT + "_" + OUTPUT_FILENAME_SUFFIX_FORMAT
+# Where the options chain page of an index lives
+MARKETWATCH_URL_FORMAT = "http://www.marketwatch.com/investing/index/{ticker}/options"
+
+# Make a string clean for use a as a filename
+clean_filename = lambda s: "".join([c for c in s if c.isalpha() or c.isdigit() or c==' ']).rstrip()
+# Common helper for creating a data header
+data_header = lambda prefix, header: prefix + "_" + header
+# Strip a table cell down to its bare value
+text_clean = lambda s: s.strip().replace(",","")
+# Order of the option halves in a chain row
+OPTION_ORDER = ["call", "put"]
+# Chain column holding the underlying price of the page's stock price row
+UNDERLYING_COLUMN = "underlying"
+# Names of the row extraction backends, see options_csv.EXTRACTORS
+BACKENDS = ["soup", "lxml"]
+# Output formats of a capture: one CSV per expiration, a columnar snapshot (see store.py), only
+# the strikes that changed (see delta.py) or a capture appended to the day's segment (see
+# segment.py)
+OUTPUT_FORMATS = ["csv", "parquet", "feather", "delta", "segment"]
@@ -0,0 +1,100 @@
+""" Dense (expiration, strike, field) cube of a chain snapshot.
+
+Expirations list different strikes, so stacking their tables means aligning them on the union of
+all strikes. OptionsCube does that once, in NumPy: every row of the snapshot is scattered into a
+preallocated array in a single indexed assignment, and any field can then be sliced out as a
+strike x expiration table for plotting.
+"""
+import numpy as np
+import pandas as pd
+
+import catalog
+import store
+
+class OptionsCube(object):
+    """ Numeric chain values on (expiration, strike, field) axes. Strikes missing from an
+    expiration are NaN.
+
+    Args:
+        expirations (list): expiration labels, first axis
+        strikes (ndarray): sorted strikes shared by all expirations, second axis
+        fields (list): chain column names, third axis
+        values (ndarray): array of shape (len(expirations), len(strikes), len(fields))
+    """
+    def __init__(self, expirations, strikes, fields, values):
+        self.expirations = list(expirations)
+        self.strikes = np.asarray(strikes)
+        self.fields = list(fields)
+        self.values = values
+        self._field_index = {field: i for i, field in enumerate(self.fields)}
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    def __repr__(self):
+        return "<OptionsCube: {} expirations x {} strikes x {} fields>".format(*self.shape)
+
+    @classmethod
+    def from_frame(cls, frame, fields=None, dtype=np.float64):
+        """ Builds a cube from a long snapshot table.
+
+        Args:
+            frame (DataFrame): snapshot table with 'expiration' and 'strike' columns, as
+                returned by store.read_snapshot or store.chain_to_frame
+            fields (list): columns to keep. Default is every numeric column.
+            dtype (numpy.dtype): dtype of the cube values
+
+        Returns:
+            OptionsCube: the cube, with expirations in date order
+        """
+        if fields is None:
+            fields = [column for column in frame.columns[len(store.KEY_COLUMNS):]
+                      if pd.api.types.is_numeric_dtype(frame[column])]
+        expiration_labels = pd.Series(frame["expiration"].astype(str).unique())
+        order = expiration_labels.map(catalog.expiration_key).argsort(kind="stable")
+        expirations = list(expiration_labels.iloc[order])
+
+        strike_values = frame["strike"].to_numpy(dtype=np.float64)
+        strikes = np.unique(strike_values)
+        expiration_codes = pd.Categorical(
+            frame["expiration"].astype(str), categories=expirations).codes
+        strike_codes = np.searchsorted(strikes, strike_values)
+
+        values = np.full((len(expirations), len(strikes), len(fields)), np.nan, dtype=dtype)
+        values[expiration_codes, strike_codes] = frame[fields].to_numpy(
+            dtype=dtype, na_value=np.nan)
+        return cls(expirations, strikes, fields, values)
+
+    @classmethod
+    def from_chain(cls, chain, fields=None, dtype=np.float64):
+        """ Builds a cube from a parsed chain (expiration -> table). See from_frame. """
+        return cls.from_frame(store.chain_to_frame(chain), fields, dtype)
+
+    def field(self, name):
+        """ Slices one field out of the cube.
+
+        Args:
+            name (str): chain column name, e.g. 'call_Open Int.'
+
+        Returns:
+            DataFrame: values indexed by strike, one column per expiration
+        """
+        return pd.DataFrame(self.values[:, :, self._field_index[name]].T,
+                            index=pd.Index(self.strikes, name="strike"),
+                            columns=pd.Index(self.expirations, name="expiration"))
+
+    def field_matrix(self, name, fill_value=None):
+        """ Slices one field out of the cube as a bare (strike, expiration) array.
+
+        Args:
+            name (str): chain column name, e.g. 'call_Open Int.'
+            fill_value (float): value to put in place of NaN. Default leaves NaN.
+
+        Returns:
+            ndarray: array of shape (len(strikes), len(expirations))
+        """
+        matrix = self.values[:, :, self._field_index[name]].T
+        if fill_value is not None:
+            matrix = np.where(np.isnan(matrix), fill_value, matrix)
+        return matrix
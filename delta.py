@@ -0,0 +1,264 @@
+""" Delta capture of options chains: only the strikes that changed since the previous capture.
+
+Intraday captures come every few minutes and most strikes don't move in between, so instead of
+a full snapshot per capture this writes a full keyframe now and then, and in between a delta
+file holding only the (expiration, strike) rows that were added, changed or removed since the
+previous capture of the same ticker. Files sit next to the columnar snapshots of store:
+
+    {root}/date=2018-03-16/ticker=spx/keyframe-093000.parquet
+    {root}/date=2018-03-16/ticker=spx/delta-093500.parquet
+
+The first capture of each day is a keyframe, so a day can always be rebuilt on its own, and
+read_chain_at replays a day's keyframe and deltas to rebuild the chain at any capture time.
+"""
+import os
+import datetime
+import logging
+
+import numpy as np
+import pandas as pd
+
+import catalog
+import metrics
+import schema
+import store
+
+log = logging.getLogger(__name__)
+
+KEYFRAME_PREFIX = "keyframe"
+DELTA_PREFIX = "delta"
+DELTA_FILENAME_FORMAT = "{kind}-{time}.{extension}"
+# Catalog format of delta capture files
+CATALOG_FORMAT = "delta"
+# Captures between two keyframes
+KEYFRAME_INTERVAL = 12
+# Column of delta files flagging rows that were removed from the chain
+REMOVED_COLUMN = "removed"
+
+def delta_path(root, ticker, captured_at, kind, fmt="parquet"):
+    """ Builds the path of a keyframe or delta file
+
+    Args:
+        root (str): root directory of the store
+        ticker (str): ticker symbol of the option data
+        captured_at (datetime.datetime): capture time
+        kind (str): KEYFRAME_PREFIX or DELTA_PREFIX
+        fmt (str): file format, see store.FORMATS
+
+    Returns:
+        str: path of the file
+    """
+    directory = store.SNAPSHOT_DIR_FORMAT.format(date=captured_at.date(), ticker=ticker.lower())
+    filename = DELTA_FILENAME_FORMAT.format(
+        kind=kind, time=captured_at.strftime("%H%M%S"), extension=store.FORMATS[fmt])
+    return os.path.join(root, directory, filename)
+
+def find_captures(root, ticker, date):
+    """ Lists the keyframe and delta files of one ticker on one day, oldest first
+
+    Returns:
+        list: (captured_at, kind, path) tuples
+    """
+    directory = os.path.join(
+        root, store.SNAPSHOT_DIR_FORMAT.format(date=date, ticker=ticker.lower()))
+    if not os.path.isdir(directory):
+        return []
+    date = datetime.date.fromisoformat(str(date))
+    captures = []
+    for name in os.listdir(directory):
+        kind, _, rest = name.partition("-")
+        if kind not in (KEYFRAME_PREFIX, DELTA_PREFIX):
+            continue
+        captured_at = datetime.datetime.combine(
+            date, datetime.datetime.strptime(rest.split(".")[0], "%H%M%S").time())
+        captures.append((captured_at, kind, os.path.join(directory, name)))
+    # A delta written in the same second as a keyframe comes after it
+    return sorted(captures, key=lambda capture: (capture[0], capture[1] != KEYFRAME_PREFIX))
+
+def _keyed(frame):
+    """ Indexes a snapshot table by (expiration, strike) """
+    frame = frame.copy()
+    frame["expiration"] = frame["expiration"].astype(str)
+    return frame.set_index(store.KEY_COLUMNS)
+
+def _unkeyed(keyed):
+    """ Inverse of _keyed, with expirations in date order and strikes ascending """
+    frame = keyed.reset_index()
+    expirations = pd.Series(frame["expiration"].unique())
+    order = expirations.map(catalog.expiration_key).argsort(kind="stable")
+    frame["expiration"] = pd.Categorical(frame["expiration"],
+                                         categories=list(expirations.iloc[order]))
+    return frame.sort_values(store.KEY_COLUMNS, kind="stable").reset_index(drop=True)
+
+def diff_frames(previous, current):
+    """ Finds the rows of a snapshot table that differ from the previous capture.
+
+    Args:
+        previous (DataFrame): previous snapshot table, as made by store.chain_to_frame
+        current (DataFrame): new snapshot table with the same columns
+
+    Returns:
+        DataFrame: the added and changed rows of current, followed by the keys of rows that are
+            gone from it, with REMOVED_COLUMN telling them apart
+    """
+    previous, current = _keyed(previous), _keyed(current)
+    aligned = previous.reindex(index=current.index, columns=current.columns)
+    # Categoricals only compare with identical categories, which captures don't share
+    text = {column: object for column in current.columns
+            if isinstance(current[column].dtype, pd.CategoricalDtype)}
+    current_values, aligned_values = current.astype(text), aligned.astype(text)
+    same = current_values.eq(aligned_values).fillna(False) | (
+        current_values.isna() & aligned_values.isna())
+    changed = current[~same.to_numpy(dtype=bool).all(axis=1)]
+    removed = pd.DataFrame(index=previous.index.difference(current.index),
+                           columns=current.columns).astype(current.dtypes.to_dict())
+
+    delta = pd.concat([changed, removed])
+    delta[REMOVED_COLUMN] = np.repeat([False, True], [len(changed), len(removed)])
+    return delta.reset_index()
+
+def apply_delta(frame, delta):
+    """ Applies a delta made by diff_frames to the previous snapshot table. The columns of the
+    result are those of the delta, which are the columns of its capture: columns it added are
+    missing from the previous rows, and columns it dropped are dropped from them.
+
+    Returns:
+        DataFrame: snapshot table of the capture the delta was made from
+    """
+    keyed = _keyed(frame)
+    delta = _keyed(delta)
+    removed = delta.pop(REMOVED_COLUMN).to_numpy(dtype=bool)
+    keyed = keyed.drop(index=delta.index, errors="ignore").reindex(columns=delta.columns)
+    keyed = pd.concat([keyed, delta[~removed]])
+    # Categories differ between captures and added columns start out empty, so concat leaves
+    # some columns as objects
+    frame = _unkeyed(keyed)
+    return schema.apply_schema(frame, frame.columns[len(store.KEY_COLUMNS):])
+
+def _read(path):
+    frame = store.read_snapshot(path)
+    if REMOVED_COLUMN not in frame.columns:
+        return frame
+    return frame.astype({REMOVED_COLUMN: bool})
+
+def read_frame_at(root, ticker, when):
+    """ Rebuilds the snapshot table of the last capture of a ticker at or before a given time,
+    by replaying that day's keyframe and deltas.
+
+    Args:
+        root (str): root directory of the store
+        ticker (str): ticker symbol of the option data
+        when (datetime.datetime): point in time to rebuild
+
+    Returns:
+        tuple: (captured_at, DataFrame) of the capture rebuilt, or (None, None) if there is no
+            keyframe that day before when
+    """
+    frame = captured_at = None
+    for capture_time, kind, path in find_captures(root, ticker, when.date()):
+        if capture_time > when:
+            break
+        if kind == KEYFRAME_PREFIX:
+            frame = store.read_snapshot(path)
+        elif frame is not None:
+            frame = apply_delta(frame, _read(path))
+        else:
+            continue
+        captured_at = capture_time
+    return (captured_at, frame) if frame is not None else (None, None)
+
+def read_chain_at(root, ticker, when):
+    """ Rebuilds the chain of a ticker as of a given time. See read_frame_at.
+
+    Returns:
+        OrderedDict: expiration string -> DataFrame indexed by strike, empty if nothing was
+            captured that day before when
+    """
+    _, frame = read_frame_at(root, ticker, when)
+    return store.frame_to_chain(frame) if frame is not None else store.frame_to_chain(
+        pd.DataFrame(columns=store.KEY_COLUMNS))
+
+class DeltaWriter(object):
+    """ Writes successive captures of one ticker as keyframes and deltas. The previous capture
+    is kept in memory, and read back from disk on the first write, so a fresh writer (as in a
+    cron run) carries on where the last one stopped.
+
+    Args:
+        root (str): root directory of the store
+        ticker (str): ticker symbol of the option data
+        fmt (str): file format, see store.FORMATS
+        keyframe_interval (int): captures between two keyframes
+    """
+    def __init__(self, root, ticker, fmt="parquet", keyframe_interval=KEYFRAME_INTERVAL):
+        self.root = root
+        self.ticker = ticker
+        self.fmt = fmt
+        self.keyframe_interval = keyframe_interval
+        self.previous = None
+        self.previous_at = None
+        self.since_keyframe = 0
+
+    def _load_previous(self, captured_at):
+        """ Picks up the state of the last capture of the day from disk """
+        captures = find_captures(self.root, self.ticker, captured_at.date())
+        self.since_keyframe = 0
+        for _, kind, _ in reversed(captures):
+            if kind == KEYFRAME_PREFIX:
+                break
+            self.since_keyframe += 1
+        self.previous_at, self.previous = read_frame_at(self.root, self.ticker, captured_at)
+
+    def write(self, chain, captured_at=None):
+        """ Writes one capture, as a keyframe if it's the first of the day or keyframe_interval
+        captures have passed since the last one, otherwise as a delta.
+
+        Args:
+            chain (OrderedDict): expiration string -> DataFrame indexed by strike
+            captured_at (datetime.datetime): capture time. Default is now.
+
+        Returns:
+            tuple: (path of the file written, number of rows in it)
+        """
+        captured_at = captured_at or datetime.datetime.now()
+        if self.previous_at is None or self.previous_at.date() != captured_at.date():
+            self._load_previous(captured_at)
+        frame = store.chain_to_frame(chain)
+
+        if self.previous is None or self.since_keyframe + 1 >= self.keyframe_interval:
+            kind, written = KEYFRAME_PREFIX, frame
+            self.since_keyframe = 0
+        else:
+            kind, written = DELTA_PREFIX, diff_frames(self.previous, frame)
+            self.since_keyframe += 1
+
+        path = delta_path(self.root, self.ticker, captured_at, kind, self.fmt)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with metrics.timer("write", format=CATALOG_FORMAT):
+            if self.fmt == "parquet":
+                written.to_parquet(path, index=False)
+            else:
+                written.to_feather(path)
+        metrics.inc("delta_rows", len(written), ticker=self.ticker, kind=kind)
+        log.info("Saved %d of %d rows of %s to: %s", len(written), len(frame), self.ticker, path)
+        self.previous, self.previous_at = frame, captured_at
+        return path, len(written)
+
+def write_delta(chain, ticker, root, captured_at=None, fmt="parquet",
+                keyframe_interval=KEYFRAME_INTERVAL, writer=None):
+    """ Writes one capture and records it in the catalog of root.
+
+    Args:
+        writer (DeltaWriter): writer of this ticker to reuse, which saves reading the previous
+            capture back from disk. Default is a fresh one.
+
+    See DeltaWriter for the other arguments.
+
+    Returns:
+        str: path of the file written
+    """
+    captured_at = captured_at or datetime.datetime.now()
+    writer = writer or DeltaWriter(root, ticker, fmt, keyframe_interval)
+    path, rows = writer.write(chain, captured_at)
+    with catalog.Catalog(catalog.catalog_path(root)) as snapshots:
+        snapshots.add(ticker, catalog.ALL_EXPIRATIONS, path, rows, captured_at, CATALOG_FORMAT)
+    return path
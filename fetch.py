@@ -0,0 +1,259 @@
+""" Concurrent download and parsing of several options chains.
+
+Pages are fetched over a pool of keep-alive HTTP connections with bounded concurrency, timeouts
+and retries, and handed to a process pool for parsing as soon as they arrive so parsing overlaps
+with the remaining downloads.
+"""
+import asyncio
+import http.client
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import metrics
+import options_csv
+import parse_cache
+
+log = logging.getLogger(__name__)
+
+# Status codes worth retrying, anything else is returned to the caller as is
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Response headers validating a download -> request headers that make the next one conditional
+VALIDATOR_HEADERS = [("ETag", "If-None-Match"), ("Last-Modified", "If-Modified-Since")]
+
+class FetchError(Exception):
+    """ Raised when a page could not be downloaded after all retries. """
+
+class ConnectionPool(object):
+    """ A thread-safe pool of keep-alive HTTP connections, kept per host.
+
+    Args:
+        maxsize (int): maximum number of idle connections kept per host
+        timeout (float): socket timeout in seconds for each request
+    """
+    def __init__(self, maxsize=4, timeout=10.0):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _get(self, scheme, netloc):
+        with self._lock:
+            idle = self._idle.setdefault((scheme, netloc), queue.LifoQueue(self.maxsize))
+        try:
+            return idle.get_nowait()
+        except queue.Empty:
+            conn_type = (http.client.HTTPSConnection if scheme == "https"
+                         else http.client.HTTPConnection)
+            return conn_type(netloc, timeout=self.timeout)
+
+    def _put(self, scheme, netloc, conn):
+        try:
+            self._idle[(scheme, netloc)].put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def request(self, url, headers=None):
+        """ Performs a GET request on a pooled connection.
+
+        Args:
+            url (str): url to fetch
+            headers (dict): extra request headers
+
+        Returns:
+            tuple: (status, response headers, body)
+        """
+        parts = urlsplit(url)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        conn = self._get(parts.scheme, parts.netloc)
+        try:
+            conn.request("GET", path, headers=headers or {})
+            response = conn.getresponse()
+            body = response.read()
+        except Exception:
+            conn.close()
+            raise
+        if response.will_close:
+            conn.close()
+        else:
+            self._put(parts.scheme, parts.netloc, conn)
+        return response.status, response.headers, body
+
+    def close(self):
+        """ Closes all idle connections. """
+        with self._lock:
+            for idle in self._idle.values():
+                while not idle.empty():
+                    idle.get_nowait().close()
+            self._idle.clear()
+
+def fetch_url(pool, url, headers=None, retries=3, backoff=0.5):
+    """ Fetches a url through the pool, retrying failures with exponential backoff.
+
+    Args:
+        pool (ConnectionPool): connection pool to use
+        url (str): url to fetch
+        headers (dict): extra request headers
+        retries (int): number of retries after the first attempt
+        backoff (float): delay before the first retry in seconds, doubled on each retry
+
+    Returns:
+        tuple: (status, response headers, body)
+
+    Raises:
+        FetchError: if every attempt failed
+    """
+    for attempt in range(retries + 1):
+        try:
+            status, response_headers, body = pool.request(url, headers)
+        except (OSError, http.client.HTTPException) as e:
+            reason = repr(e)
+        else:
+            if status not in RETRY_STATUSES:
+                return status, response_headers, body
+            reason = "HTTP {}".format(status)
+        if attempt < retries:
+            delay = backoff * 2 ** attempt
+            log.warning("Fetching %s failed (%s), retrying in %.1fs", url, reason, delay)
+            metrics.inc("retries")
+            time.sleep(delay)
+    raise FetchError("Failed to fetch {} after {} attempts: {}".format(url, retries + 1, reason))
+
+def fetch_page_if_changed(pool, ticker, url_format=options_csv.MARKETWATCH_URL_FORMAT,
+                          validators=None, retries=3, backoff=0.5):
+    """ Downloads the options page of one ticker through the pool, unless the server reports it
+    unchanged since the download the validators come from.
+
+    Args:
+        validators (dict): VALIDATOR_HEADERS returned by the previous call for this ticker
+
+    See fetch_url for the other arguments.
+
+    Returns:
+        tuple: (body of the options page or None if it is unchanged, validators for the next
+            call)
+    """
+    url = url_format.format(ticker=ticker.lower())
+    log.info("Loading webpage: %s", url)
+    validators = validators or {}
+    headers = {request_header: validators[response_header]
+               for response_header, request_header in VALIDATOR_HEADERS
+               if response_header in validators}
+    with metrics.timer("download", ticker=ticker.lower()):
+        status, response_headers, body = fetch_url(pool, url, headers, retries, backoff)
+    if status == 304 and headers:
+        metrics.inc("not_modified", ticker=ticker.lower())
+        return None, validators
+    metrics.inc("download_bytes", len(body), ticker=ticker.lower())
+    if status != 200:
+        raise FetchError("Fetching {} returned HTTP {}".format(url, status))
+    return body, {response_header: response_headers[response_header]
+                  for response_header, _ in VALIDATOR_HEADERS
+                  if response_headers.get(response_header)}
+
+def fetch_page(pool, ticker, url_format=options_csv.MARKETWATCH_URL_FORMAT, retries=3,
+               backoff=0.5):
+    """ Downloads the options page of one ticker through the pool.
+
+    Returns:
+        bytes: body of the options page
+    """
+    return fetch_page_if_changed(pool, ticker, url_format, None, retries, backoff)[0]
+
+async def fetch_chains(tickers, url_format=options_csv.MARKETWATCH_URL_FORMAT, concurrency=4,
+                       timeout=10.0, retries=3, backoff=0.5, backend="soup", workers=None,
+                       pool=None, cache=None, cached=None):
+    """ Downloads and parses the options chains of several tickers concurrently.
+
+    Args:
+        tickers (list): ticker symbols to fetch
+        url_format (str): url of the options page, formatted with the lowercase ticker
+        concurrency (int): maximum number of downloads in flight
+        timeout (float): socket timeout in seconds for each request
+        retries (int): number of retries after the first attempt of each download
+        backoff (float): delay before the first retry in seconds, doubled on each retry
+        backend (str): name of the row extraction backend, see options_csv.EXTRACTORS
+        workers (int): number of parsing processes. Default is one per CPU.
+        pool (ConnectionPool): connection pool to use. Default is a new pool.
+        cache (parse_cache.ParseCache): pages found in this cache are loaded from it instead of
+            being parsed. Chains parsed here are not added to it, see fetch_and_write.
+        cached (dict): if given, filled with ticker -> cache key of every page downloaded
+
+    Returns:
+        OrderedDict: ticker -> parsed chain (or the exception raised for that ticker)
+    """
+    loop = asyncio.get_running_loop()
+    own_pool = pool is None
+    if own_pool:
+        pool = ConnectionPool(maxsize=concurrency, timeout=timeout)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    with ThreadPoolExecutor(concurrency) as io_executor, \
+            ProcessPoolExecutor(workers) as parse_executor:
+        async def fetch_one(ticker):
+            async with semaphore:
+                start = time.perf_counter()
+                page = await loop.run_in_executor(
+                    io_executor, fetch_page, pool, ticker, url_format, retries, backoff)
+                log.info("Downloaded %s (%d bytes) in %.2fs", ticker, len(page),
+                         time.perf_counter() - start)
+            if cache is not None:
+                key = parse_cache.cache_key(page, backend)
+                if cached is not None:
+                    cached[ticker] = key
+                chain = await loop.run_in_executor(io_executor, cache.get, key)
+                if chain is not None:
+                    return chain
+            # Timed here, as metrics recorded in the parsing processes stay there
+            with metrics.timer("parse", backend=backend):
+                return await loop.run_in_executor(
+                    parse_executor, options_csv.parse_chain, page, backend)
+
+        results = await asyncio.gather(*[fetch_one(ticker) for ticker in tickers],
+                                       return_exceptions=True)
+    if own_pool:
+        pool.close()
+    return OrderedDict(zip(tickers, results))
+
+def fetch_and_write(tickers, outdir=None, fmt="csv", cache=None, with_greeks=False, **kwargs):
+    """ Fetches the chains of several tickers concurrently and saves them. See fetch_chains for
+    the other keyword arguments.
+
+    Args:
+        tickers (list): ticker symbols to fetch
+        outdir (str): output directory. Default is the current directory.
+        fmt (str): output format, 'csv', 'delta', 'segment' or one of store.FORMATS
+        cache (parse_cache.ParseCache): cache of chains already parsed. Pages found in it are
+            not parsed again, nor saved again if they are the pages last saved to the same
+            outdir and fmt. Chains are added to it once saved.
+        with_greeks (bool): also save implied volatility and Greeks, see options_csv.save_chain
+
+    Returns:
+        OrderedDict: ticker -> written files (None when skipped as cached, or the exception
+            raised for that ticker)
+    """
+    cached = {}
+    target = parse_cache.destination(outdir, fmt)
+    written = OrderedDict()
+    for ticker, chain in asyncio.run(fetch_chains(tickers, cache=cache, cached=cached,
+                                                  **kwargs)).items():
+        key = cached.get(ticker)
+        if isinstance(chain, Exception):
+            log.error("Failed to capture %s: %s", ticker, chain)
+            written[ticker] = chain
+        elif key and cache.last_saved(ticker, target) == key:
+            log.info("%s unchanged since it was last saved, skipping", ticker)
+            metrics.inc("captures_skipped", ticker=ticker.lower(), reason="cached")
+            written[ticker] = None
+        else:
+            written[ticker] = options_csv.save_chain(chain, ticker, outdir, fmt,
+                                                     with_greeks=with_greeks)
+            if key:
+                cache.saved(key, chain, ticker, target)
+    return written
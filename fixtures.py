@@ -0,0 +1,122 @@
+""" Recorded options pages, for running and benchmarking the parser offline.
+
+A fixture is the raw body of one options page, gzipped, next to a small JSON file recording where
+and when it came from:
+
+    {fixture_dir}/spx.html.gz
+    {fixture_dir}/spx.json
+
+Pages are recorded with `options_csv.py --record DIR` (or `python fixtures.py record DIR`) and
+replayed with `options_csv.py --replay DIR`, or served over HTTP by stub_server.py.
+`python fixtures.py synthetic DIR` writes synthetic chains of several sizes for the benchmarks.
+"""
+import os
+import gzip
+import json
+import datetime
+import logging
+
+log = logging.getLogger(__name__)
+
+FIXTURE_FILENAME_FORMAT = "{ticker}.html.gz"
+METADATA_FILENAME_FORMAT = "{ticker}.json"
+# (expirations, strikes per expiration) of the synthetic fixtures
+SYNTHETIC_SIZES = [(5, 50), (20, 100), (40, 200)]
+
+def fixture_path(fixture_dir, ticker):
+    """ Path of the fixture of one ticker """
+    return os.path.join(fixture_dir, FIXTURE_FILENAME_FORMAT.format(ticker=ticker.lower()))
+
+def save_fixture(fixture_dir, ticker, page, url=None, status=200, headers=None):
+    """ Saves a downloaded page as a fixture
+
+    Args:
+        fixture_dir (str): fixture directory, created if missing
+        ticker (str): ticker symbol of the page
+        page (bytes): body of the page
+        url (str): url the page was downloaded from
+        status (int): HTTP status of the response
+        headers (dict): response headers
+
+    Returns:
+        str: path of the fixture
+    """
+    os.makedirs(fixture_dir, exist_ok=True)
+    path = fixture_path(fixture_dir, ticker)
+    with gzip.open(path, "wb") as fobj:
+        fobj.write(page)
+    metadata = {"ticker": ticker.lower(), "url": url, "status": status,
+                "headers": dict(headers or {}), "bytes": len(page),
+                "recorded_at": datetime.datetime.now().isoformat(timespec="seconds")}
+    with open(os.path.join(fixture_dir, METADATA_FILENAME_FORMAT.format(ticker=ticker.lower())),
+              "w") as fobj:
+        json.dump(metadata, fobj, indent=2)
+    log.info("Recorded %s (%d bytes) to: %s", ticker, len(page), path)
+    return path
+
+def load_fixture(fixture_dir, ticker):
+    """ Reads back the page recorded for a ticker
+
+    Raises:
+        IOError: if there is no fixture for the ticker
+
+    Returns:
+        bytes: body of the page
+    """
+    path = fixture_path(fixture_dir, ticker)
+    if not os.path.isfile(path):
+        raise IOError("No fixture for '{}' in {}".format(ticker, fixture_dir))
+    with gzip.open(path, "rb") as fobj:
+        return fobj.read()
+
+def list_fixtures(fixture_dir):
+    """ Lists the tickers recorded in a fixture directory, sorted """
+    suffix = FIXTURE_FILENAME_FORMAT.format(ticker="")
+    return sorted(name[:-len(suffix)] for name in os.listdir(fixture_dir) if name.endswith(suffix))
+
+def record(tickers, fixture_dir, url_format=None):
+    """ Downloads the pages of several tickers and saves them as fixtures
+
+    Returns:
+        list: paths of the fixtures
+    """
+    import options_csv
+    url_format = url_format or options_csv.MARKETWATCH_URL_FORMAT
+    for ticker in tickers:
+        options_csv.download_page(ticker, url_format, record_dir=fixture_dir)
+    return [fixture_path(fixture_dir, ticker) for ticker in tickers]
+
+def write_synthetic(fixture_dir, sizes=SYNTHETIC_SIZES):
+    """ Saves synthetic chains of the given sizes as fixtures named
+    'synthetic{expirations}x{strikes}'
+
+    Returns:
+        list: paths of the fixtures
+    """
+    import bench
+    return [save_fixture(fixture_dir, "synthetic{}x{}".format(n_expirations, n_strikes),
+                         bench.make_chain_page(n_expirations, n_strikes).encode("utf-8"))
+            for n_expirations, n_strikes in sizes]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Records options pages as test fixtures.")
+    parser.add_argument("action", choices=["record", "synthetic"],
+        help="'record' downloads real pages, 'synthetic' writes generated chains of several sizes")
+    parser.add_argument("fixture_dir", help="Directory to save the fixtures in")
+    parser.add_argument("--symbols", default="spx,ndx,rut",
+        help="Comma-separated symbols to record.")
+    parser.add_argument("--url-format",
+        help="Options page url, formatted with the lowercase ticker.")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if args.action == "record":
+        paths = record([symbol.strip() for symbol in args.symbols.split(",") if symbol.strip()],
+                       args.fixture_dir, args.url_format)
+    else:
+        paths = write_synthetic(args.fixture_dir)
+    for path in paths:
+        print(path)
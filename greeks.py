@@ -0,0 +1,233 @@
+""" Vectorized implied volatility and Greeks for whole chain snapshots.
+
+Every function works on NumPy arrays, so a full snapshot (all strikes x expirations, calls and
+puts) is priced in a handful of array operations. Implied volatility is solved with a safeguarded
+Newton iteration: Newton steps on vega, falling back to bisection of the bracket wherever a step
+would leave it, run on all contracts at once until every one has converged.
+
+Prices use Black-Scholes for European options with a continuous dividend yield, which suits the
+cash-settled index options (SPX, NDX, RUT) this project captures.
+"""
+import math
+import datetime
+import numpy as np
+import pandas as pd
+
+import catalog
+
+# Bounds of the implied volatility search
+MIN_VOL = 1e-4
+MAX_VOL = 5.0
+# Columns added to each chain table by add_greeks
+GREEK_HEADERS = ["Mid", "IV", "Delta", "Gamma", "Theta", "Vega"]
+
+_SQRT_2PI = math.sqrt(2.0 * math.pi)
+
+try:
+    from scipy.special import ndtr as _norm_cdf
+except ImportError:
+    _erfc = np.frompyfunc(math.erfc, 1, 1)
+
+    def _norm_cdf(x):
+        """ Standard normal CDF from math.erfc, element by element, for when scipy isn't
+        installed """
+        return 0.5 * np.asarray(_erfc(np.asarray(x, dtype=np.float64) * -math.sqrt(0.5)),
+                                dtype=np.float64)
+
+def _norm_pdf(x):
+    return np.exp(-0.5 * x * x) / _SQRT_2PI
+
+def _d1_d2(spot, strike, t, rate, div, vol):
+    sqrt_t = np.sqrt(t)
+    d1 = (np.log(spot / strike) + (rate - div + 0.5 * vol * vol) * t) / (vol * sqrt_t)
+    return d1, d1 - vol * sqrt_t
+
+def bs_price(is_call, spot, strike, t, vol, rate=0.0, div=0.0):
+    """ Black-Scholes prices
+
+    Args:
+        is_call (ndarray): True for calls, False for puts
+        spot (ndarray): price of the underlying
+        strike (ndarray): strike prices
+        t (ndarray): time to expiration in years
+        vol (ndarray): volatilities
+        rate (float or ndarray): continuously compounded risk-free rate
+        div (float or ndarray): continuous dividend yield
+
+    Returns:
+        ndarray: option prices
+    """
+    d1, d2 = _d1_d2(spot, strike, t, rate, div, vol)
+    sign = np.where(is_call, 1.0, -1.0)
+    return sign * (spot * np.exp(-div * t) * _norm_cdf(sign * d1) -
+                   strike * np.exp(-rate * t) * _norm_cdf(sign * d2))
+
+def bs_vega(spot, strike, t, vol, rate=0.0, div=0.0):
+    """ Black-Scholes vega, per unit of volatility. See bs_price for the arguments. """
+    d1, _ = _d1_d2(spot, strike, t, rate, div, vol)
+    return spot * np.exp(-div * t) * _norm_pdf(d1) * np.sqrt(t)
+
+def implied_vol(price, is_call, spot, strike, t, rate=0.0, div=0.0, tol=1e-8, max_iter=100):
+    """ Solves for the volatilities reproducing the given prices, for all contracts at once.
+
+    Args:
+        price (ndarray): option prices
+        tol (float): volatility tolerance. A contract has converged once its Newton step is
+            smaller than this, or its price is matched to rounding.
+        max_iter (int): maximum number of iterations
+
+    See bs_price for the other arguments.
+
+    Returns:
+        ndarray: implied volatilities, NaN where the price is missing or outside the no-arbitrage
+            bounds
+    """
+    price, is_call, spot, strike, t = [np.ravel(a) for a in np.broadcast_arrays(
+        np.asarray(price, dtype=np.float64), is_call, spot, strike, t)]
+    low = np.full(price.shape, MIN_VOL)
+    high = np.full(price.shape, MAX_VOL)
+    valid = np.isfinite(price) & (t > 0) & (price > 0)
+    price_tol = 1e-12 * strike
+    # Expired contracts have no price bounds, and are left out by t > 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        valid &= price >= bs_price(is_call, spot, strike, t, low, rate, div) - price_tol
+        valid &= price <= bs_price(is_call, spot, strike, t, high, rate, div) + price_tol
+
+    vol = np.full(price.shape, 0.3)
+    active = valid.copy()
+    for _ in range(max_iter):
+        if not active.any():
+            break
+        idx = np.nonzero(active)[0]
+        args = (spot[idx], strike[idx], t[idx])
+        v = vol[idx]
+        diff = bs_price(is_call[idx], *args, v, rate, div) - price[idx]
+        vega = bs_vega(*args, v, rate, div)
+        converged = (np.abs(diff) < tol * vega) | (np.abs(diff) < price_tol[idx])
+        # Tighten the bracket around the root
+        lo, hi = low[idx], high[idx]
+        lo = np.where(diff < 0, v, lo)
+        hi = np.where(diff > 0, v, hi)
+        # Newton step, replaced by bisection where it leaves the bracket or vega vanishes
+        with np.errstate(divide="ignore", invalid="ignore"):
+            step = v - diff / vega
+        bisect = ~np.isfinite(step) | (step <= lo) | (step >= hi)
+        new_v = np.where(bisect, 0.5 * (lo + hi), step)
+        low[idx], high[idx] = lo, hi
+        vol[idx] = np.where(converged, v, new_v)
+        still_active = ~converged & ((hi - lo) > 1e-10)
+        active[idx] = still_active
+    vol[~valid] = np.nan
+    return vol
+
+def greeks(is_call, spot, strike, t, vol, rate=0.0, div=0.0):
+    """ Black-Scholes Greeks. See bs_price for the arguments.
+
+    Returns:
+        dict: 'Delta', 'Gamma', 'Theta' (per calendar day) and 'Vega' (per volatility point)
+    """
+    d1, d2 = _d1_d2(spot, strike, t, rate, div, vol)
+    sqrt_t = np.sqrt(t)
+    div_discount = np.exp(-div * t)
+    rate_discount = np.exp(-rate * t)
+    sign = np.where(is_call, 1.0, -1.0)
+    pdf_d1 = _norm_pdf(d1)
+    delta = sign * div_discount * _norm_cdf(sign * d1)
+    gamma = div_discount * pdf_d1 / (spot * vol * sqrt_t)
+    theta = (-spot * div_discount * pdf_d1 * vol / (2 * sqrt_t)
+             - sign * rate * strike * rate_discount * _norm_cdf(sign * d2)
+             + sign * div * spot * div_discount * _norm_cdf(sign * d1))
+    vega = spot * div_discount * pdf_d1 * sqrt_t
+    return {"Delta": delta, "Gamma": gamma, "Theta": theta / 365.0, "Vega": vega / 100.0}
+
+def mid_price(bid, ask, last):
+    """ Mid of the quote, falling back on the last price where the quote is one-sided """
+    bid = np.asarray(bid, dtype=np.float64)
+    ask = np.asarray(ask, dtype=np.float64)
+    mid = np.where((bid > 0) & (ask >= bid), 0.5 * (bid + ask), np.nan)
+    return np.where(np.isfinite(mid), mid, np.asarray(last, dtype=np.float64))
+
+def estimate_underlying(strikes, call_mid, put_mid):
+    """ Estimates the underlying price of one expiration from put-call parity at the strike
+    where calls and puts are closest in price (S ~ K + C - P, ignoring carry).
+
+    Returns:
+        float: estimated underlying price, NaN if no strike has both prices
+    """
+    diff = np.asarray(call_mid, dtype=np.float64) - np.asarray(put_mid, dtype=np.float64)
+    if not np.isfinite(diff).any():
+        return np.nan
+    i = np.nanargmin(np.abs(diff))
+    return float(strikes[i] + diff[i])
+
+def years_to_expiration(expiration, as_of):
+    """ Time in years from as_of to 4pm on the expiration date (an expiration heading or an ISO
+    date). NaN if the expiration can't be read. """
+    try:
+        expires = datetime.datetime.combine(
+            datetime.date.fromisoformat(catalog.expiration_key(expiration)), datetime.time(16))
+    except ValueError:
+        return np.nan
+    return max((expires - as_of).total_seconds(), 0.0) / (365.0 * 24 * 3600)
+
+def snapshot_greeks(frame, as_of=None, rate=0.0, div=0.0, underlying=None):
+    """ Computes mid, implied volatility and Greeks for every contract of a snapshot at once.
+
+    Args:
+        frame (DataFrame): long snapshot table with 'expiration' and 'strike' columns and numeric
+            call_/put_ Bid, Ask and Last columns, as made by store.chain_to_frame
+        as_of (datetime.datetime): capture time. Default is now.
+        rate (float): continuously compounded risk-free rate
+        div (float): continuous dividend yield
+        underlying (float or dict): underlying price, or expiration -> price. Default is
+            estimated per expiration with estimate_underlying.
+
+    Returns:
+        DataFrame: call_/put_ columns for each of GREEK_HEADERS, aligned with frame
+    """
+    as_of = as_of or datetime.datetime.now()
+    expirations = frame["expiration"].astype(str)
+    strikes = frame["strike"].to_numpy(dtype=np.float64)
+    mids = {otype: mid_price(frame[otype + "_Bid"], frame[otype + "_Ask"], frame[otype + "_Last"])
+            for otype in ["call", "put"]}
+
+    # One time to expiration and one underlying price per expiration, broadcast to its rows
+    codes, uniques = pd.factorize(expirations)
+    t = np.array([years_to_expiration(e, as_of) for e in uniques])[codes]
+    if underlying is None:
+        spots = np.array([estimate_underlying(strikes[codes == i], mids["call"][codes == i],
+                                              mids["put"][codes == i])
+                          for i in range(len(uniques))])
+    elif isinstance(underlying, dict):
+        spots = np.array([underlying.get(e, np.nan) for e in uniques])
+    else:
+        spots = np.full(len(uniques), float(underlying))
+    spot = spots[codes] if len(uniques) else np.array([])
+
+    # Calls and puts are solved together as one array of contracts
+    n = len(frame)
+    is_call = np.repeat([True, False], n)
+    price = np.concatenate([mids["call"], mids["put"]])
+    spot2, strike2, t2 = np.tile(spot, 2), np.tile(strikes, 2), np.tile(t, 2)
+    vol = implied_vol(price, is_call, spot2, strike2, t2, rate, div)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        values = greeks(is_call, spot2, strike2, t2, vol, rate, div)
+    values["Mid"] = price
+    values["IV"] = vol
+
+    result = pd.DataFrame(index=frame.index)
+    for otype, rows in [("call", slice(0, n)), ("put", slice(n, 2 * n))]:
+        for header in GREEK_HEADERS:
+            result["{}_{}".format(otype, header)] = values[header][rows]
+    return result
+
+def add_greeks(chain, as_of=None, rate=0.0, div=0.0, underlying=None):
+    """ Adds the GREEK_HEADERS columns to every table of a parsed chain. See snapshot_greeks.
+
+    Returns:
+        OrderedDict: expiration string -> table with the extra columns
+    """
+    import store
+    frame = store.chain_to_frame(chain)
+    frame = pd.concat([frame, snapshot_greeks(frame, as_of, rate, div, underlying)], axis=1)
+    return store.frame_to_chain(frame)
@@ -1,29 +1,44 @@
-import plotly.plotly as py
-import plotly.graph_objs as go
-from options_csv import OUTPUT_FILENAME_PREFIX_FORMAT
-import re
+import render
+from constants import OUTPUT_FILENAME_PREFIX_FORMAT
+import catalog
+import store
+from cube import OptionsCube
 import os
+import datetime
+import numpy as np
 import pandas as pd
+from collections import OrderedDict
 
-def build_heatmap(openInt_df):
-    trace = go.Heatmap(z=openInt_df.fillna(0).as_matrix(),
+def make_heatmap_figure(openInt_df):
+    """ Heatmap on a log colour scale: heatmaps have no z axis to make logarithmic, so the
+    colours are taken from log10(1 + value) and the colour bar is labelled in powers of ten. """
+    import plotly.graph_objs as go
+    values = openInt_df.fillna(0).clip(lower=0).to_numpy(dtype=float)
+    decades = np.arange(int(np.log10(1 + values.max())) + 1 if values.size else 1)
+    trace = go.Heatmap(z=np.log10(1 + values),
                        x=openInt_df.columns,
-                       y=openInt_df.index)
-    data=[trace]
-    layout = go.Layout(
-        zaxis=dict(
-            type='log',
-            autorange=True
-        )
-    )
-    fig = go.Figure(data=data, layout=layout)
-    py.plot(fig, filename='expiration-heatmap')
-
-def build_colorscale(openInt_df):
+                       y=openInt_df.index,
+                       customdata=values,
+                       hovertemplate='%{y} %{x}: %{customdata}<extra></extra>',
+                       colorbar=dict(tickmode='array', tickvals=decades,
+                                     ticktext=["{:g}".format(10 ** d if d else 0)
+                                               for d in decades]))
+    return go.Figure(data=[trace])
+
+def build_heatmap(openInt_df, filename=None):
+    """ Plots a heatmap, uploading it to the plotly cloud unless filename is given, in which
+    case it is rendered offline to that file (see render.render_figure). """
+    fig = make_heatmap_figure(openInt_df)
+    if filename:
+        return render.render_figure(fig, filename)
+    return render.cloud_plot(fig, filename='expiration-heatmap')
+
+def make_colorscale_figure(openInt_df):
+    import plotly.graph_objs as go
     data = [{
         'x': openInt_df.columns,
         'y': openInt_df.index,
-        'z': openInt_df.fillna(0).as_matrix(),
+        'z': openInt_df.fillna(0).to_numpy(),
         'type': 'heatmap',
         'colorscale': [
             # [0, 'rgb(250, 250, 250)'],        #0
@@ -48,38 +63,106 @@ def build_colorscale(openInt_df):
 
     layout = {'title': 'Log Colorscale'}
 
-    fig = {'data': data, 'layout': layout}
+    return go.Figure({'data': data, 'layout': layout})
 
-    py.plot(fig, filename='expiration-heatmap')                                                                                                                                                   
+def build_colorscale(openInt_df, filename=None):
+    """ Plots a log colorscale heatmap, uploading it to the plotly cloud unless filename is
+    given, in which case it is rendered offline to that file (see render.render_figure). """
+    fig = make_colorscale_figure(openInt_df)
+    if filename:
+        return render.render_figure(fig, filename)
+    return render.cloud_plot(fig, filename='expiration-heatmap')
 
-def get_combined_options_data(csv_date, symbol, indir):
-    expected_prefix = OUTPUT_FILENAME_PREFIX_FORMAT.format(date=csv_date, ticker=symbol)
-    options_tables = {}
-    for root, dirs, files in os.walk(indir):
-        for file in files:
-            if file.startswith(str(csv_date)) and file.endswith(".csv"):
-                expiration_with_ext = file.split("_")[-1]
-                expiration = expiration_with_ext.split(".")[0][3:]
-                filename = os.path.join(root, file)
-                options_table = pd.DataFrame.from_csv(filename)
-                options_tables[expiration] = options_table
-    return pd.Panel(options_tables)
+# Make a column name usable in a filename
+render_name = lambda s: "".join([c for c in s if c.isalnum() or c in "_-"])
 
+def render_colorscales(jobs, outdir, fmt="html"):
+    """ Renders log colorscale heatmaps offline, reusing one figure for all of them.
 
-if __name__ == "__main__":
-    import argparse
-    import datetime
-
-    parser = argparse.ArgumentParser(description="Makes a heatmap from a sequence of expirations")
-    parser.add_argument("--symbol", default="spx", help="Symbol in CSV files")
-    parser.add_argument("--indir", default=os.getcwd(), help="Directory to look for CSV files")
-    args = parser.parse_args()
-    # TODO: Add date selection (just use today for now...)
-    args.csv_date = datetime.date.today()
-
-    options_panel = get_combined_options_data(args.csv_date, args.symbol, args.indir)
-    print(options_panel)
-    call_openInt = options_panel.minor_xs('call_Open Int.')
-    print(call_openInt)
-    build_colorscale(call_openInt)
+    Args:
+        jobs (list): (openInt_df, name) tuples, name being the title and output filename
+        outdir (str): output directory
+        fmt (str): one of render.FORMATS
+
+    Returns:
+        list: filenames written
+    """
+    if not jobs:
+        return []
+    template = make_colorscale_figure(jobs[0][0])
+    return render.render_batch(template, [
+        (name, [{'x': df.columns, 'y': df.index, 'z': df.fillna(0).to_numpy()}],
+         {'title': name})
+        for df, name in jobs], outdir, fmt)
+
+def get_combined_options_data(csv_date, symbol, indir, fmt="csv", columns=None):
+    """ Loads every expiration of one day's capture of a symbol into an OptionsCube.
+
+    Args:
+        csv_date (datetime.date): capture date
+        symbol (str): ticker symbol of the option data
+        indir (str): output directory of options_csv
+        fmt (str): format the data was saved in, 'csv', 'delta', 'segment' or one of store.FORMATS
+        columns (list): chain columns to load. Default is all of them.
 
+    Returns:
+        OptionsCube: cube over (expiration, strike, field)
+    """
+    catalog_file = catalog.catalog_path(indir)
+    if os.path.exists(catalog_file):
+        with catalog.Catalog(catalog_file) as snapshots:
+            found = snapshots.find(symbol, capture_date=csv_date, fmt=fmt)
+    else:
+        found = None
+
+    if fmt == "delta":
+        # Delta captures: rebuild the chain as of the end of the day
+        import delta
+        frame = delta.read_frame_at(indir, symbol, datetime.datetime.combine(
+            csv_date, datetime.time.max))[1]
+        if frame is None:
+            raise IOError("No delta captures for '{}' on {} in {}".format(symbol, csv_date, indir))
+        return OptionsCube.from_frame(frame, columns)
+
+    if fmt == "segment":
+        # Segment: only the requested columns of the day's last capture
+        import segment
+        path = segment.segment_path(indir, symbol, csv_date)
+        if not os.path.exists(path):
+            raise IOError("No segment for '{}' on {} in {}".format(symbol, csv_date, indir))
+        with segment.Segment(path) as captures:
+            if not len(captures):
+                raise IOError("No captures in {}".format(path))
+            return OptionsCube.from_frame(captures.read_frame(columns=columns), columns)
+
+    if fmt != "csv":
+        # Columnar snapshots: load only the requested columns of the day's latest capture
+        paths = [snapshot.path for snapshot in found] if found is not None \
+            else store.find_snapshots(indir, symbol, csv_date)
+        if not paths:
+            raise IOError("No {} snapshots for '{}' on {} in {}".format(
+                fmt, symbol, csv_date, indir))
+        return OptionsCube.from_frame(store.read_snapshot(paths[-1], columns), columns)
+
+    options_tables = OrderedDict()
+    if found is not None:
+        # Later captures of the same day replace earlier ones
+        for snapshot in found:
+            options_tables[snapshot.expiration] = snapshot.path
+    else:
+        # No catalog: fall back to scanning the directory for this symbol's files
+        expected_prefix = OUTPUT_FILENAME_PREFIX_FORMAT.format(date=csv_date, ticker=symbol) + "_"
+        for root, dirs, files in os.walk(indir):
+            for file in files:
+                if file.startswith(expected_prefix) and file.endswith(".csv"):
+                    expiration_with_ext = file.split("_")[-1]
+                    expiration = catalog.expiration_key(expiration_with_ext.split(".")[0][3:])
+                    options_tables[expiration] = os.path.join(root, file)
+    for expiration, filename in options_tables.items():
+        options_table = pd.read_csv(filename, index_col=0)
+        options_tables[expiration] = options_table if columns is None else options_table[columns]
+    return OptionsCube.from_chain(options_tables, columns)
+
+if __name__ == "__main__":
+    import cli
+    raise SystemExit(cli.script_main("heatmap"))
@@ -82,6 +82,31 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/2.1/topics/cache/
+# The trades API caches query results here, keyed by a data generation kept in the database, so
+# imports from another process invalidate them too. A shared backend (e.g. FileBasedCache)
+# only improves the hit rate across server processes.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'trades',
+        'TIMEOUT': 300,
+    }
+}
+
+
+# Options capture archive
+# Legs are priced against the chains captured by options_csv (see trades/enrichment.py), whose
+# scripts are importable from the entry points (manage.py, wsgi.py, cli.py). OPTIONS_ARCHIVE_DIR
+# is their output directory and OPTIONS_CAPTURE_TIME_ZONE the time zone of the machine capturing
+# (None for this machine's).
+
+OPTIONS_ARCHIVE_DIR = os.environ.get('OPTIONS_ARCHIVE_DIR')
+OPTIONS_CAPTURE_TIME_ZONE = None
+
+
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
 
@@ -2,7 +2,11 @@
 import os
 import sys
 
+# The options_csv scripts, which trades.enrichment imports
+OPTIONS_CSV_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
 if __name__ == '__main__':
+    sys.path.append(OPTIONS_CSV_DIR)
     os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'journal.settings')
     try:
         from django.core.management import execute_from_command_line
@@ -0,0 +1,41 @@
+import hashlib
+
+from django.core.cache import cache
+from django.db.models import F
+
+from .models import DataGeneration
+
+def data_generation():
+    """ Current generation of the trades data, read from the database so every process agrees
+    on it. Cached results are keyed by it, so bumping it invalidates all of them at once. """
+    return DataGeneration.objects.filter(pk=1).values_list("value", flat=True).first() or 0
+
+def invalidate():
+    """ Invalidates every cached result and ETag, called by whatever changes the data. Inside
+    a transaction, the new generation is seen by other processes once it commits. """
+    DataGeneration.objects.filter(pk=1).update(value=F("value") + 1)
+
+def request_etag(request):
+    """ ETag of a read request: changes when the data or the query changes. Computed once per
+    request. """
+    if not hasattr(request, "_trades_etag"):
+        key = "{}:{}".format(data_generation(), request.get_full_path())
+        request._trades_etag = hashlib.sha1(key.encode("utf-8")).hexdigest()
+    return request._trades_etag
+
+def cached_result(request, compute):
+    """ Returns the cached result of a read request, computing and caching it on a miss.
+
+    Args:
+        request (HttpRequest): the request, whose full path identifies the query
+        compute (callable): computes the result when it isn't cached
+
+    Returns:
+        object: the result
+    """
+    key = "trades:result:{}".format(request_etag(request))
+    result = cache.get(key)
+    if result is None:
+        result = compute()
+        cache.set(key, result)
+    return result
@@ -0,0 +1,72 @@
+import logging
+from zoneinfo import ZoneInfo
+
+import asof
+import pandas as pd
+from django.conf import settings
+from django.utils import timezone
+
+from .caching import invalidate
+from .models import Leg
+
+logger = logging.getLogger(__name__)
+
+# Leg fields filled from the capture archive
+QUOTE_FIELDS = ["underlying_price", "mid_price", "implied_volatility", "quote_time"]
+
+def enrich_legs(archive_dir=None, legs=None, overwrite=False, max_age=None, batch_size=1000):
+    """ Fills the underlying price, quote mid and implied volatility of option legs from the
+    chains captured before their execution, with one as-of lookup for all of them (see asof.py).
+
+    Args:
+        archive_dir (str): output directory of options_csv. Default is
+            settings.OPTIONS_ARCHIVE_DIR.
+        legs (QuerySet): legs to enrich. Default is all of them.
+        overwrite (bool): also look up legs that already have an underlying price
+        max_age (datetime.timedelta): ignore captures older than this before an execution.
+            Default is asof.MAX_AGE.
+        batch_size (int): number of legs per UPDATE
+
+    Returns:
+        int: number of legs priced
+    """
+    archive_dir = archive_dir or settings.OPTIONS_ARCHIVE_DIR
+    legs = Leg.objects.all() if legs is None else legs
+    legs = legs.filter(instrument__in=["call", "put"], expiration_date__isnull=False,
+                       strike_price__isnull=False)
+    if not overwrite:
+        legs = legs.filter(underlying_price__isnull=True)
+    rows = list(legs.values_list("id", "symbol", "exec_date", "expiration_date", "strike_price",
+                                 "instrument"))
+    if not rows:
+        return 0
+    contracts = pd.DataFrame(rows, columns=["id", "ticker", "time", "expiration", "strike",
+                                            "instrument"])
+    contracts["time"] = asof.to_capture_clock(contracts["time"],
+                                              settings.OPTIONS_CAPTURE_TIME_ZONE)
+    quotes = asof.quotes_asof(archive_dir, contracts,
+                              asof.MAX_AGE if max_age is None else max_age)
+
+    priced = quotes["captured_at"].notna().to_numpy()
+    updated = []
+    for leg_id, captured_at, underlying, mid, iv in zip(
+            contracts["id"][priced], quotes["captured_at"][priced],
+            quotes["underlying"][priced], quotes["mid"][priced], quotes["iv"][priced]):
+        captured_at = captured_at.to_pydatetime()
+        # Capture times are naive, in the capture machine's clock
+        if settings.OPTIONS_CAPTURE_TIME_ZONE is None:
+            captured_at = captured_at.astimezone()
+        else:
+            captured_at = timezone.make_aware(
+                captured_at, ZoneInfo(settings.OPTIONS_CAPTURE_TIME_ZONE))
+        updated.append(Leg(id=int(leg_id), underlying_price=_or_none(underlying),
+                           mid_price=_or_none(mid), implied_volatility=_or_none(iv),
+                           quote_time=captured_at))
+    Leg.objects.bulk_update(updated, QUOTE_FIELDS, batch_size=batch_size)
+    if updated:
+        invalidate()
+    logger.info("Priced {} of {} legs from {}".format(len(updated), len(rows), archive_dir))
+    return len(updated)
+
+def _or_none(value):
+    return None if pd.isnull(value) else float(value)
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trades', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='leg',
+            name='fingerprint',
+            field=models.CharField(editable=False, max_length=40, null=True, unique=True),
+        ),
+    ]
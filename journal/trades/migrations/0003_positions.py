@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trades', '0002_leg_fingerprint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Position',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('symbol', models.CharField(max_length=16)),
+                ('instrument', models.CharField(choices=[('call', 'Call'), ('put', 'Put'), ('stock', 'Stock'), ('fut', 'Futures')], max_length=5)),
+                ('expiration_date', models.DateTimeField(null=True, verbose_name='expiration')),
+                ('strike_price', models.FloatField(null=True)),
+                ('quantity', models.IntegerField(default=0)),
+                ('opened_quantity', models.PositiveIntegerField(default=0)),
+                ('closed_quantity', models.PositiveIntegerField(default=0)),
+                ('open_value', models.FloatField(default=0)),
+                ('close_value', models.FloatField(default=0)),
+                ('fees', models.FloatField(default=0)),
+                ('leg_count', models.PositiveIntegerField(default=0)),
+                ('first_exec_date', models.DateTimeField(null=True)),
+                ('last_exec_date', models.DateTimeField(null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='leg',
+            name='strike_price',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddIndex(
+            model_name='leg',
+            index=models.Index(fields=['symbol', 'expiration_date', 'instrument'], name='trades_leg_symbol_f38c68_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='leg',
+            index=models.Index(fields=['exec_date'], name='trades_leg_exec_da_fc1307_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='position',
+            index=models.Index(fields=['symbol', 'expiration_date'], name='trades_posi_symbol_539764_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='position',
+            index=models.Index(fields=['last_exec_date'], name='trades_posi_last_ex_7b642c_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='position',
+            unique_together={('symbol', 'instrument', 'expiration_date', 'strike_price')},
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trades', '0003_positions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='leg',
+            name='implied_volatility',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='leg',
+            name='mid_price',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='leg',
+            name='quote_time',
+            field=models.DateTimeField(null=True, verbose_name='quote captured'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:16
+
+from django.db import migrations, models
+
+
+def create_generation(apps, schema_editor):
+    apps.get_model('trades', 'DataGeneration').objects.create(pk=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trades', '0004_leg_quote'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataGeneration',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.BigIntegerField(default=1)),
+            ],
+        ),
+        migrations.RunPython(create_generation, migrations.RunPython.noop),
+    ]
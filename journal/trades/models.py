@@ -27,9 +27,72 @@ class Leg(models.Model):
         choices=INSTRUMENT_CHOICES,
         default="call",
     )
+    strike_price = models.FloatField(null=True)
     quantity = models.PositiveIntegerField()
     execution_price = models.FloatField()
     execution_fees = models.FloatField(default=0)
     expiration_date = models.DateTimeField("expiration", null=True)
     margin = models.FloatField(null=True)
-    underlying_price = models.FloatField(null=True)
\ No newline at end of file
+    underlying_price = models.FloatField(null=True)
+    # Quote of the contract in the capture closest before execution, see enrichment.py
+    mid_price = models.FloatField(null=True)
+    implied_volatility = models.FloatField(null=True)
+    quote_time = models.DateTimeField("quote captured", null=True)
+    # Hash of the broker export row the leg was imported from, to skip it on re-import
+    fingerprint = models.CharField(max_length=40, unique=True, null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["symbol", "expiration_date", "instrument"]),
+            models.Index(fields=["exec_date"]),
+        ]
+
+# Fields identifying the contract a leg trades, and so the position it belongs to
+POSITION_KEY_FIELDS = ["symbol", "instrument", "expiration_date", "strike_price"]
+
+class Position(models.Model):
+    """ Running totals of the legs trading one contract, kept up to date on import (see
+    positions.add_legs) so position summaries don't have to pair up legs on every request. """
+    symbol = models.CharField(max_length=16)
+    instrument = models.CharField(max_length=5, choices=Leg.INSTRUMENT_CHOICES)
+    expiration_date = models.DateTimeField("expiration", null=True)
+    strike_price = models.FloatField(null=True)
+    # Net contracts held: bought minus sold
+    quantity = models.IntegerField(default=0)
+    opened_quantity = models.PositiveIntegerField(default=0)
+    closed_quantity = models.PositiveIntegerField(default=0)
+    # Cash flows of the opening and closing legs, negative when paid
+    open_value = models.FloatField(default=0)
+    close_value = models.FloatField(default=0)
+    fees = models.FloatField(default=0)
+    leg_count = models.PositiveIntegerField(default=0)
+    first_exec_date = models.DateTimeField(null=True)
+    last_exec_date = models.DateTimeField(null=True)
+
+    class Meta:
+        unique_together = [POSITION_KEY_FIELDS]
+        indexes = [
+            models.Index(fields=["symbol", "expiration_date"]),
+            models.Index(fields=["last_exec_date"]),
+        ]
+
+    @property
+    def is_open(self):
+        return self.quantity != 0
+
+    @property
+    def realized_pnl(self):
+        """ P&L of the closed contracts: closing cash flows plus the average opening cost of
+        the contracts closed, net of all fees paid so far. """
+        if not self.opened_quantity:
+            return self.close_value + self.fees
+        matched_cost = self.open_value * min(self.closed_quantity, self.opened_quantity) / \
+            self.opened_quantity
+        return self.close_value + matched_cost + self.fees
+
+
+class DataGeneration(models.Model):
+    """ Counter bumped by every change to the trades data. It lives in the database rather than
+    the cache so the server sees imports made by other processes; cached API results and ETags
+    are keyed by it (see caching.py). There is a single row, created by the migration. """
+    value = models.BigIntegerField(default=1)
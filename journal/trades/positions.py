@@ -0,0 +1,124 @@
+import logging
+
+from django.db import transaction
+from django.db.models import (
+    Case, Count, F, FloatField, IntegerField, Max, Min, Q, Sum, Value, When)
+from django.db.models.functions import Coalesce
+
+from .models import Leg, Position, POSITION_KEY_FIELDS
+
+logger = logging.getLogger(__name__)
+
+def _sum_when(expression, condition, output_field):
+    """ Database-side sum of expression over the legs matching condition, 0 if there are none """
+    return Coalesce(Sum(Case(When(condition, then=expression), default=Value(0),
+                             output_field=output_field)), Value(0), output_field=output_field)
+
+def aggregate_positions(legs):
+    """ Totals legs per contract in a single grouped query.
+
+    Args:
+        legs (QuerySet): legs to total
+
+    Returns:
+        QuerySet: one dict per contract with the fields of Position
+    """
+    quantity = F("quantity")
+    is_open = Q(open_or_close="open")
+    is_close = Q(open_or_close="close")
+    return legs.values(*POSITION_KEY_FIELDS).annotate(
+        quantity_bought=_sum_when(quantity, Q(buy_or_sell="buy"), IntegerField()),
+        quantity_sold=_sum_when(quantity, Q(buy_or_sell="sell"), IntegerField()),
+        opened_quantity=_sum_when(quantity, is_open, IntegerField()),
+        closed_quantity=_sum_when(quantity, is_close, IntegerField()),
+        open_value=_sum_when(F("margin"), is_open, FloatField()),
+        close_value=_sum_when(F("margin"), is_close, FloatField()),
+        fees=Coalesce(Sum("execution_fees"), Value(0.0), output_field=FloatField()),
+        leg_count=Count("id"),
+        first_exec_date=Min("exec_date"),
+        last_exec_date=Max("exec_date"),
+    ).order_by()
+
+# Position fields that are totals over legs, and so add up
+TOTAL_FIELDS = ["quantity", "opened_quantity", "closed_quantity", "open_value", "close_value",
+                "fees", "leg_count"]
+
+def _key(position):
+    return tuple(getattr(position, field) for field in POSITION_KEY_FIELDS)
+
+def _write_totals(legs, positions, add):
+    """ Writes the totals of legs to positions, updating existing rows in place so positions
+    keep their id (the cursor of the positions endpoint) and creating the missing ones.
+
+    Args:
+        legs (QuerySet): legs to total
+        positions (QuerySet): positions that may receive the totals
+        add (bool): add the totals to the existing ones, instead of replacing them
+
+    Returns:
+        tuple: (number of positions written, dict of the positions left untouched by key)
+    """
+    existing = {_key(position): position for position in positions.select_for_update()}
+    changed = []
+    created = []
+    for totals in aggregate_positions(legs):
+        totals["quantity"] = totals.pop("quantity_bought") - totals.pop("quantity_sold")
+        position = existing.pop(tuple(totals[field] for field in POSITION_KEY_FIELDS), None)
+        if position is None:
+            created.append(Position(**totals))
+            continue
+        if add:
+            for field in TOTAL_FIELDS:
+                totals[field] += getattr(position, field)
+            totals["first_exec_date"] = min(filter(None, [position.first_exec_date,
+                                                          totals["first_exec_date"]]))
+            totals["last_exec_date"] = max(filter(None, [position.last_exec_date,
+                                                         totals["last_exec_date"]]))
+        for field in TOTAL_FIELDS + ["first_exec_date", "last_exec_date"]:
+            setattr(position, field, totals[field])
+        changed.append(position)
+    Position.objects.bulk_update(changed, TOTAL_FIELDS + ["first_exec_date", "last_exec_date"])
+    Position.objects.bulk_create(created)
+    return len(changed) + len(created), existing
+
+def add_legs(legs):
+    """ Adds new legs to the positions of their contracts, in place. Importers call this with
+    each batch of legs they insert, so an import costs as much as its new legs rather than the
+    history of the underlyings it touched. Must run in the transaction saving the legs.
+
+    Args:
+        legs (QuerySet): legs not yet counted in any position
+
+    Returns:
+        int: number of positions written
+    """
+    symbols = set(legs.values_list("symbol", flat=True))
+    if not symbols:
+        return 0
+    with transaction.atomic():
+        written, _ = _write_totals(legs, Position.objects.filter(symbol__in=symbols), add=True)
+    return written
+
+def update_positions(symbols=None):
+    """ Recomputes the positions of the given underlyings from all their legs, e.g. after legs
+    were edited or deleted. Positions are updated in place, and the ones left without legs
+    deleted.
+
+    Args:
+        symbols (iterable): underlying symbols to update. Default is all of them.
+
+    Returns:
+        int: number of positions written
+    """
+    legs = Leg.objects.all()
+    positions = Position.objects.all()
+    if symbols is not None:
+        symbols = sorted(set(symbols))
+        legs = legs.filter(symbol__in=symbols)
+        positions = positions.filter(symbol__in=symbols)
+
+    with transaction.atomic():
+        written, orphans = _write_totals(legs, positions, add=False)
+        Position.objects.filter(pk__in=[position.pk for position in orphans.values()]).delete()
+    logger.info("Updated {} positions".format(written))
+    return written
@@ -1,12 +1,20 @@
 import pandas as pd
-import datetime
+import hashlib
 import logging
-from collections import OrderedDict
+import time
+from collections import Counter, OrderedDict
+
+from django.db import transaction
 
 from .models import Leg
+from .caching import invalidate
+from .positions import add_legs
 
 logger = logging.getLogger(__name__)
 
+# Rows of an export read and saved at a time
+CHUNK_SIZE = 50000
+
 def parse_float(value, error=True):
     try:
         s = value.replace(",", "")
@@ -22,63 +30,276 @@ def parse_float(value, error=True):
         else:
             return value
 
-def load_tastyworks_trades(filename):
-    df = pd.read_csv(filename)
-
-    for line_id in df.index:
-        row = df.loc[line_id]
-        # - Type
-        if row["Type"] != "Trade":
-            logger.info("Skipping entry with type '{}'".format(row["Type"]))
-            continue
-
-        kwargs = OrderedDict()
-        # - Date
-        kwargs["exec_date"] = row["Date"]
-        # - Action
-        action = row["Action"]
-        try:
-            buy_tx, open_tx = action.split("_TO_")
-        except ValueError:
-            buy_tx = action
-            open_tx = ""
-        kwargs["buy_or_sell"] = buy_tx.lower()
-        kwargs["open_or_close"] = open_tx.lower()
-        # - Symbol - not used
-        # - Instrument
-        # TODO: Process non-options
-        if "Option" not in row["Instrument Type"]:
-            logger.error("Skipping unimplemented instrument: '{}'".format(row["Instrument Type"]))
-            continue
-        kwargs["instrument"] = "option"
-        # - Description - not used
-        # - Value
-        kwargs["margin"] = parse_float(row["Value"])
-        # - Quantity
-        kwargs["quantity"] = int(row["Quantity"])
-        # - Average Price
-        avg_price = parse_float(row["Average Price"])
-        # - Comissions
-        # - Fees
-        comish = parse_float(row["Commissions"])
-        fees = parse_float(row["Fees"])
-        kwargs["execution_fees"] = comish + fees
-        # - Multiplier
-        multiplier = parse_float(row["Multiplier"])
-        kwargs["execution_price"] = avg_price / multiplier
-        # - Underlying Symbol
-        kwargs["symbol"] = row["Underlying Symbol"]
-        # - Expiration Date
-        exp_date = row["Expiration Date"]
-        if exp_date != "":
-            m, d, y = exp_date.split("/")
-            kwargs["expiration_date"] = datetime.date(year=int(y), month=int(m), day=int(d))
-
-        # TODO: Find a way to get underlying_price
+def parse_float_column(column):
+    """ Vectorized parse_float: converts a column of numbers written with thousands separators.
+    Cells that can't be parsed become NaN. """
+    if column.dtype == object or pd.api.types.is_string_dtype(column):
+        column = column.astype(str).str.replace(",", "", regex=False)
+    return pd.to_numeric(column, errors="coerce")
+
+def fingerprint_rows(df, seen=None):
+    """ Computes a stable fingerprint for each row of a broker export. Identical rows (e.g. two
+    fills of the same order at the same second) are told apart by their occurrence number, so
+    re-reading an overlapping export gives the same fingerprints for the rows they share.
+
+    Args:
+        df (DataFrame): rows as read from the export, ideally as text (dtype=str)
+        seen (Counter): occurrences of each row content seen so far, for exports read in
+            several pieces. Updated in place.
+
+    Returns:
+        Series: hex SHA-1 fingerprint of each row
+    """
+    seen = Counter() if seen is None else seen
+    content = df.fillna("").astype(str).agg("\x1f".join, axis=1)
+    occurrence = content.groupby(content, sort=False).cumcount()
+    fingerprints = []
+    for row, n in zip(content, occurrence):
+        n += seen[row]
+        fingerprints.append(hashlib.sha1("{}\x1e{}".format(row, n).encode("utf-8")).hexdigest())
+    seen.update(content)
+    return pd.Series(fingerprints, index=df.index)
+
+def parse_tastyworks_frame(df, seen=None, skipped=None):
+    """ Converts a Tastyworks history table into Leg fields, one column operation per field.
+
+    Args:
+        df (DataFrame): history as read from the Tastyworks CSV export
+        seen (Counter): see fingerprint_rows
+        skipped (Counter): if given, entries skipped are counted into it by (type, instrument)
+            instead of being logged, for exports read in several pieces. See log_skipped.
+
+    Returns:
+        DataFrame: one row per option leg, with one column per Leg field
+    """
+    fingerprints = fingerprint_rows(df, seen)
+    counts = Counter() if skipped is None else skipped
+
+    # - Type
+    is_trade = df["Type"] == "Trade"
+    counts.update((entry_type, None) for entry_type in df.loc[~is_trade, "Type"])
+    df = df[is_trade]
+
+    # - Instrument
+    # TODO: Process non-options
+    is_option = df["Instrument Type"].fillna("").str.contains("Option", regex=False)
+    counts.update(("Trade", instrument) for instrument in df.loc[~is_option, "Instrument Type"])
+    df = df[is_option]
+    if skipped is None:
+        log_skipped(counts)
+    if df.empty:
+        # A chunk of an export may have no option trades at all
+        return pd.DataFrame()
+
+    legs = pd.DataFrame(index=df.index)
+    # - Date
+    legs["exec_date"] = pd.to_datetime(df["Date"], utc=True)
+    # - Action
+    action = df["Action"].str.split("_TO_", n=1, expand=True).reindex(columns=[0, 1])
+    legs["buy_or_sell"] = action[0].str.lower()
+    legs["open_or_close"] = action[1].fillna("").str.lower()
+    # - Symbol - not used
+    # - Call or Put
+    legs["instrument"] = df["Call or Put"].str.lower()
+    # - Description - not used
+    # - Value
+    legs["margin"] = parse_float_column(df["Value"])
+    # - Quantity
+    legs["quantity"] = parse_float_column(df["Quantity"]).astype(int)
+    # - Comissions
+    # - Fees
+    legs["execution_fees"] = parse_float_column(df["Commissions"]) + parse_float_column(df["Fees"])
+    # - Average Price
+    # - Multiplier
+    legs["execution_price"] = (parse_float_column(df["Average Price"]) /
+                               parse_float_column(df["Multiplier"]))
+    # - Underlying Symbol
+    legs["symbol"] = df["Underlying Symbol"]
+    # - Expiration Date
+    legs["expiration_date"] = pd.to_datetime(
+        df["Expiration Date"], format="%m/%d/%y", errors="coerce").dt.date
+    # - Strike Price
+    legs["strike_price"] = parse_float_column(df["Strike Price"])
+
+    # - Underlying price: filled from the capture archive, see enrichment.enrich_legs
+
+    legs["fingerprint"] = fingerprints[legs.index]
+    return legs
+
+def log_skipped(skipped):
+    """ Logs the entries parse_tastyworks_frame skipped, see its skipped argument """
+    for (entry_type, instrument), count in skipped.items():
+        if instrument is None:
+            logger.info("Skipping {} entries with type '{}'".format(count, entry_type))
+        else:
+            logger.error("Skipping {} entries of unimplemented instrument: '{}'".format(
+                count, instrument))
 
+def _legs_from_frame(legs):
+    """ Yields an unsaved Leg per row of a table made by parse_tastyworks_frame """
+    if legs.empty:
+        return
+    columns = list(legs.columns)
+    exec_dates = legs["exec_date"].dt.to_pydatetime()
+    for exec_date, row in zip(exec_dates, legs.itertuples(index=False, name=None)):
+        kwargs = OrderedDict(zip(columns, row))
+        kwargs["exec_date"] = exec_date
+        for field in ["expiration_date", "strike_price"]:
+            if pd.isnull(kwargs[field]):
+                kwargs[field] = None
         yield Leg(**kwargs)
 
+def read_tastyworks_chunks(filename, chunksize=CHUNK_SIZE):
+    """ Reads a Tastyworks history export a chunk of rows at a time, every cell as its raw text
+    so fingerprints don't depend on dtype inference. Every column is kept, as all of them make
+    up the fingerprint of a row.
+
+    Args:
+        filename (str): path of the CSV export
+        chunksize (int): rows per chunk. None reads the whole export at once.
+
+    Yields:
+        DataFrame: rows of the export, with a running index
+    """
+    if chunksize is None:
+        yield pd.read_csv(filename, dtype=str, keep_default_na=False)
+        return
+    with pd.read_csv(filename, dtype=str, keep_default_na=False,
+                     chunksize=chunksize) as reader:
+        for chunk in reader:
+            yield chunk
+
+def _forget_earlier_rows(seen, df, order):
+    """ Drops the rows that can't occur again from the occurrence counts of fingerprint_rows.
+
+    Identical rows share their execution time, so once an export sorted by time has moved past
+    a time, rows of earlier times can't repeat and needn't be counted any more. This keeps the
+    counts (and memory) bounded by the rows of one time instead of growing with the export.
+    Exports that turn out not to be sorted keep counting every row.
+
+    Args:
+        seen (Counter): occurrence counts, updated in place
+        df (DataFrame): chunk just fingerprinted
+        order (dict): state carried between chunks: sort direction and last time
+
+    Returns:
+        bool: whether counts are still being dropped
+    """
+    if not order.get("sorted", True) or df.empty:
+        return order.get("sorted", True)
+    times = pd.to_datetime(df["Date"], utc=True, errors="coerce") \
+        if "Date" in df.columns else None
+    if times is None or times.isna().any():
+        order["sorted"] = False
+        return False
+    if "last" in order:
+        times = pd.concat([pd.Series([order["last"]]), times], ignore_index=True)
+    decreasing, increasing = times.is_monotonic_decreasing, times.is_monotonic_increasing
+    direction = order.get("direction")
+    if not (decreasing or increasing) or (direction == "descending" and not decreasing) or \
+            (direction == "ascending" and not increasing):
+        order["sorted"] = False
+        return False
+    if decreasing != increasing:
+        order["direction"] = "descending" if decreasing else "ascending"
+    order["last"] = times.iloc[-1]
+    # Counted rows are the cells of a row in column order, see fingerprint_rows
+    position = df.columns.get_loc("Date")
+    last_date = str(df["Date"].iloc[-1])
+    for row in [row for row in seen if row.split("\x1f")[position] != last_date]:
+        del seen[row]
+    return True
+
+def load_tastyworks_trades(filename, chunksize=CHUNK_SIZE):
+    """ Reads a Tastyworks history export, a chunk of rows at a time so memory stays flat
+    however large the export is. The rate is logged after each chunk, which includes saving
+    its legs when the caller saves them as they come (see save_new_legs).
+
+    Args:
+        filename (str): path of the CSV export
+        chunksize (int): rows read at a time. None reads the whole export at once.
+
+    Yields:
+        Leg: unsaved leg for each option trade
+    """
+    seen = Counter()
+    skipped = Counter()
+    order = {}
+    rows = 0
+    start = time.perf_counter()
+    for chunk in read_tastyworks_chunks(filename, chunksize):
+        legs = parse_tastyworks_frame(chunk, seen, skipped)
+        _forget_earlier_rows(seen, chunk, order)
+        for leg in _legs_from_frame(legs):
+            yield leg
+        rows += len(chunk)
+        elapsed = time.perf_counter() - start
+        logger.info("Read {} rows of {} ({:.0f} rows/s)".format(
+            rows, filename, rows / elapsed if elapsed else 0))
+    log_skipped(skipped)
+
+def save_new_legs(legs, batch_size=1000):
+    """ Saves the legs whose fingerprint isn't in the database yet, with batched inserts, and
+    adds each batch to the positions of its contracts. Legs inserted meanwhile by a concurrent
+    import are skipped by the insert itself, so they don't abort the import with an
+    IntegrityError, and are counted in the positions by that import only.
+
+    Args:
+        legs (iterable): unsaved Legs with fingerprints
+        batch_size (int): number of legs per INSERT
+
+    Returns:
+        tuple: (number of legs saved, set of their underlying symbols)
+    """
+    saved = 0
+    symbols = set()
+    legs = iter(legs)
+    while True:
+        batch = [leg for _, leg in zip(range(batch_size), legs)]
+        if not batch:
+            return saved, symbols
+        fingerprints = [leg.fingerprint for leg in batch]
+        existing = _saved_fingerprints(fingerprints)
+        Leg.objects.bulk_create([leg for leg in batch if leg.fingerprint not in existing],
+                                batch_size=batch_size, ignore_conflicts=True)
+        inserted = _saved_fingerprints(fingerprints) - existing
+        new_legs = [leg for leg in batch if leg.fingerprint in inserted]
+        if new_legs:
+            add_legs(Leg.objects.filter(fingerprint__in=inserted))
+        saved += len(new_legs)
+        symbols.update(leg.symbol for leg in new_legs)
+
+def _saved_fingerprints(fingerprints):
+    return set(Leg.objects.filter(fingerprint__in=fingerprints).values_list("fingerprint",
+                                                                            flat=True))
+
+def import_tastyworks_trades(filename, batch_size=1000, archive_dir=None, chunksize=CHUNK_SIZE):
+    """ Reads a Tastyworks history export a chunk at a time and saves its legs with batched
+    inserts as they are read, all in one transaction. Legs already imported from an earlier
+    (possibly overlapping) export are skipped, so re-running an import only costs as much as its
+    new rows. The new legs are added to their positions in the same transaction, and cached API
+    results are invalidated once it commits.
+
+    Args:
+        filename (str): path of the CSV export
+        batch_size (int): number of legs per INSERT
+        archive_dir (str): output directory of options_csv to price the new legs from, see
+            enrichment.enrich_legs. Default is not to price them.
+        chunksize (int): rows of the export read at a time, see load_tastyworks_trades
 
+    Returns:
+        int: number of legs saved
+    """
+    with transaction.atomic():
+        saved, symbols = save_new_legs(load_tastyworks_trades(filename, chunksize), batch_size)
+        if symbols:
+            if archive_dir:
+                from .enrichment import enrich_legs
+                enrich_legs(archive_dir, Leg.objects.filter(symbol__in=symbols),
+                            batch_size=batch_size)
+            invalidate()
+    logger.info("Imported {} new legs from {}".format(saved, filename))
+    return saved
 
 if __name__ == "__main__":
     import argparse
@@ -1,11 +1,24 @@
-from django.test import TestCase
+import datetime
+import tempfile
+from collections import Counter, OrderedDict
+from unittest import mock
 
-from .models import Leg
-from .tastyworks_trades import load_tastyworks_trades
+import pandas as pd
+from django.core.cache import cache
+from django.db.models import F
+from django.test import TestCase, override_settings
+
+from .enrichment import enrich_legs
+from .models import DataGeneration, Leg, Position
+from .positions import update_positions
+from . import tastyworks_trades
+from .tastyworks_trades import load_tastyworks_trades, import_tastyworks_trades
+
+SAMPLE_FILENAME = "../sample/tastyworks_sample.csv"
 
 class TradeLegTestCase(TestCase):
     def setUp(self):
-        for leg in load_tastyworks_trades("../sample/tastyworks_sample.csv"):
+        for leg in load_tastyworks_trades(SAMPLE_FILENAME):
             leg.save()
 
     def test_options_legs(self):
@@ -15,3 +28,283 @@ class TradeLegTestCase(TestCase):
             print(call)
 
         # put_options = Leg.objects.filter(instrument="put")
+
+
+class BulkImportTestCase(TestCase):
+    def test_bulk_import_matches_legs(self):
+        """ The bulk importer saves the same legs as loading them one by one """
+        expected = list(load_tastyworks_trades(SAMPLE_FILENAME))
+        self.assertEqual(import_tastyworks_trades(SAMPLE_FILENAME, batch_size=7), len(expected))
+        self.assertEqual(Leg.objects.count(), len(expected))
+
+        fields = ["symbol", "buy_or_sell", "open_or_close", "quantity", "execution_price"]
+        saved = Leg.objects.order_by("id").values_list(*fields)
+        self.assertEqual(list(saved), [tuple(getattr(leg, f) for f in fields) for leg in expected])
+
+    def test_chunked_read_matches_whole_file(self):
+        """ Reading the export in chunks, even one row at a time, gives the same legs and
+        fingerprints as reading it at once """
+        whole = [(leg.fingerprint, leg.symbol, leg.exec_date)
+                 for leg in load_tastyworks_trades(SAMPLE_FILENAME, chunksize=None)]
+        for chunksize in [1, 4]:
+            chunked = [(leg.fingerprint, leg.symbol, leg.exec_date)
+                       for leg in load_tastyworks_trades(SAMPLE_FILENAME, chunksize=chunksize)]
+            self.assertEqual(chunked, whole)
+        self.assertEqual(len(set(fingerprint for fingerprint, _, _ in whole)), len(whole))
+
+    def test_option_legs_only(self):
+        """ Only option trades are imported, with their actions split """
+        import_tastyworks_trades(SAMPLE_FILENAME)
+        self.assertEqual(Leg.objects.count(), 19)
+        self.assertEqual(Leg.objects.filter(buy_or_sell="sell", open_or_close="close").count(), 2)
+        leg = Leg.objects.filter(symbol="GLD").first()
+        self.assertEqual(leg.expiration_date.year, 2018)
+        self.assertAlmostEqual(leg.execution_fees, -11.34)
+
+    def test_reimport_skips_existing_legs(self):
+        """ Importing an export again, or an export overlapping it, adds no duplicate legs """
+        first = import_tastyworks_trades(SAMPLE_FILENAME)
+        self.assertEqual(import_tastyworks_trades(SAMPLE_FILENAME), 0)
+        self.assertEqual(Leg.objects.count(), first)
+        # Both identical LMT fills are kept
+        self.assertEqual(Leg.objects.filter(symbol="LMT", quantity=1).count(), 2)
+
+        with tempfile.NamedTemporaryFile("w", suffix=".csv") as overlap:
+            with open(SAMPLE_FILENAME) as sample:
+                lines = sample.readlines()
+            overlap.writelines(lines[:1] + lines[-10:])
+            overlap.flush()
+            self.assertEqual(import_tastyworks_trades(overlap.name), 0)
+        self.assertEqual(Leg.objects.count(), first)
+
+    def test_reimport_with_date_not_first(self):
+        """ Exports whose Date column isn't first have their counts dropped as they are read,
+        and an overlapping export read a row at a time still adds no duplicates """
+        with open(SAMPLE_FILENAME) as sample:
+            rows = pd.read_csv(sample, dtype=str, keep_default_na=False)
+        reordered = rows[list(rows.columns[1:]) + ["Date"]]
+        seen = Counter()
+        tastyworks_trades.fingerprint_rows(reordered, seen)
+        self.assertTrue(tastyworks_trades._forget_earlier_rows(seen, reordered, {}))
+        self.assertTrue(seen)
+        self.assertTrue(all(row.endswith("\x1f" + reordered["Date"].iloc[-1]) for row in seen))
+
+        with tempfile.NamedTemporaryFile("w", suffix=".csv") as export, \
+                tempfile.NamedTemporaryFile("w", suffix=".csv") as overlap:
+            reordered.to_csv(export, index=False)
+            export.flush()
+            reordered.iloc[-10:].to_csv(overlap, index=False)
+            overlap.flush()
+            first = import_tastyworks_trades(export.name, chunksize=1)
+            self.assertEqual(first, 19)
+            self.assertEqual(import_tastyworks_trades(overlap.name, chunksize=1), 0)
+        self.assertEqual(Leg.objects.count(), first)
+        self.assertEqual(Leg.objects.filter(symbol="LMT", quantity=1).count(), 2)
+
+    def test_concurrent_import_does_not_conflict(self):
+        """ Legs inserted by another import after the existing fingerprints were looked up are
+        skipped instead of failing the import """
+        legs = list(load_tastyworks_trades(SAMPLE_FILENAME))
+        Leg.objects.bulk_create(list(load_tastyworks_trades(SAMPLE_FILENAME))[:5])
+        lookups = [lambda fingerprints: set(), tastyworks_trades._saved_fingerprints]
+        # The first lookup misses the five legs, as if they were inserted right after it
+        with mock.patch.object(tastyworks_trades, "_saved_fingerprints",
+                               side_effect=lambda fingerprints: lookups.pop(0)(fingerprints)):
+            tastyworks_trades.save_new_legs(legs, batch_size=len(legs))
+        self.assertEqual(Leg.objects.count(), len(legs))
+        self.assertEqual(Leg.objects.values("fingerprint").distinct().count(), len(legs))
+
+
+class PositionTestCase(TestCase):
+    def setUp(self):
+        import_tastyworks_trades(SAMPLE_FILENAME)
+
+    def test_positions_match_legs(self):
+        """ Each contract traded gets one position totalling its legs """
+        contracts = Leg.objects.values_list(
+            "symbol", "instrument", "expiration_date", "strike_price").distinct()
+        self.assertEqual(Position.objects.count(), contracts.count())
+        position = Position.objects.get(symbol="LMT", strike_price=360.0)
+        self.assertEqual(position.instrument, "call")
+        self.assertEqual(position.quantity, 2)
+        self.assertEqual(position.leg_count, 2)
+        self.assertAlmostEqual(position.open_value, -520.0)
+        self.assertTrue(position.is_open)
+
+    def test_import_updates_positions_in_place(self):
+        """ Importing an export in two overlapping parts gives the positions of a full rebuild,
+        and keeps the ids of the positions that existed """
+        Leg.objects.all().delete()
+        Position.objects.all().delete()
+        with open(SAMPLE_FILENAME) as sample:
+            lines = sample.readlines()
+        with tempfile.NamedTemporaryFile("w", suffix=".csv") as older:
+            older.writelines(lines[:1] + lines[len(lines) // 2:])
+            older.flush()
+            import_tastyworks_trades(older.name, batch_size=3)
+        ids = dict(Position.objects.values_list("id", "leg_count"))
+        self.assertTrue(ids)
+        import_tastyworks_trades(SAMPLE_FILENAME, batch_size=3)
+
+        fields = ["id", "symbol", "instrument", "expiration_date", "strike_price", "quantity",
+                  "opened_quantity", "closed_quantity", "open_value", "close_value", "fees",
+                  "leg_count", "first_exec_date", "last_exec_date"]
+        incremental = list(Position.objects.order_by("id").values(*fields))
+        self.assertTrue(set(ids) <= set(row["id"] for row in incremental))
+        self.assertTrue(any(row["leg_count"] > ids[row["id"]] for row in incremental
+                            if row["id"] in ids))
+        update_positions()
+        rebuilt = list(Position.objects.order_by("id").values(*fields))
+        self.assertEqual(len(incremental), len(rebuilt))
+        for row, expected in zip(incremental, rebuilt):
+            for field in fields:
+                if isinstance(expected[field], float):
+                    self.assertAlmostEqual(row[field], expected[field], msg=field)
+                else:
+                    self.assertEqual(row[field], expected[field], msg=field)
+
+    def test_positions_view(self):
+        response = self.client.get("/trades/positions/", {"symbol": "lmt"})
+        self.assertEqual(response.status_code, 200)
+        positions = response.json()["positions"]
+        self.assertTrue(positions)
+        self.assertTrue(all(position["symbol"] == "LMT" for position in positions))
+
+
+class ApiTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        import_tastyworks_trades(SAMPLE_FILENAME)
+
+    def test_legs_pagination(self):
+        """ Following the 'next' cursor visits every leg once """
+        seen = []
+        params = {"limit": 5}
+        while True:
+            body = self.client.get("/trades/legs/", params).json()
+            seen += [leg["id"] for leg in body["legs"]]
+            if body["next"] is None:
+                break
+            params["after"] = body["next"]
+        self.assertEqual(seen, list(Leg.objects.order_by("id").values_list("id", flat=True)))
+
+    def test_positions_cursor_survives_import(self):
+        """ A page cursor of the positions endpoint stays valid when an import updates the
+        positions already listed """
+        first = self.client.get("/trades/positions/", {"limit": 3}).json()
+        with open(SAMPLE_FILENAME) as sample:
+            header = sample.readline()
+            row = sample.readline().split(",")
+        # One more fill of a contract already traded, a day later
+        row[0] = (pd.Timestamp(row[0]) + pd.Timedelta(days=1)).strftime("%Y-%m-%dT%H:%M:%S%z")
+        with tempfile.NamedTemporaryFile("w", suffix=".csv") as export:
+            export.writelines([header, ",".join(row)])
+            export.flush()
+            self.assertEqual(import_tastyworks_trades(export.name), 1)
+        rest = []
+        after = first["next"]
+        while after is not None:
+            page = self.client.get("/trades/positions/", {"limit": 3, "after": after}).json()
+            rest += page["positions"]
+            after = page["next"]
+        listed = [position["id"] for position in first["positions"] + rest]
+        self.assertEqual(listed, list(Position.objects.order_by("id").values_list("id",
+                                                                               flat=True)))
+
+    def test_legs_filters(self):
+        body = self.client.get("/trades/legs/", {"symbol": "gld", "start": "2018-08-27"}).json()
+        self.assertTrue(body["legs"])
+        self.assertTrue(all(leg["symbol"] == "GLD" for leg in body["legs"]))
+        response = self.client.get("/trades/legs/", {"start": "yesterday"})
+        self.assertEqual(response.status_code, 400)
+        for limit in [0, -1]:
+            response = self.client.get("/trades/legs/", {"limit": limit})
+            self.assertEqual(response.status_code, 400)
+
+    def test_pnl(self):
+        rows = {row["symbol"]: row for row in self.client.get("/trades/pnl/").json()["pnl"]}
+        self.assertAlmostEqual(rows["LMT"]["cash_flow"], -520.0)
+
+    def test_conditional_get(self):
+        """ Unchanged results answer 304 to a matching If-None-Match """
+        response = self.client.get("/trades/positions/")
+        etag = response["ETag"]
+        self.assertEqual(
+            self.client.get("/trades/positions/", HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertNotEqual(self.client.get("/trades/positions/", {"open": 1})["ETag"], etag)
+
+    def test_import_invalidates_cache(self):
+        """ Cached results are dropped once an import adds legs """
+        etag = self.client.get("/trades/legs/")["ETag"]
+        Leg.objects.all().delete()
+        # Still served from the cache until an import invalidates it
+        self.assertEqual(self.client.get("/trades/legs/")["ETag"], etag)
+        import_tastyworks_trades(SAMPLE_FILENAME)
+        response = self.client.get("/trades/legs/")
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(len(response.json()["legs"]), Leg.objects.count())
+
+    def test_generation_is_shared_through_the_database(self):
+        """ An import in another process, which can't reach this process's cache, still
+        changes the ETag here """
+        etag = self.client.get("/trades/legs/")["ETag"]
+        cache.clear()
+        self.assertEqual(self.client.get("/trades/legs/")["ETag"], etag)
+        DataGeneration.objects.filter(pk=1).update(value=F("value") + 1)
+        self.assertNotEqual(self.client.get("/trades/legs/")["ETag"], etag)
+
+
+@override_settings(OPTIONS_CAPTURE_TIME_ZONE="America/New_York")
+class EnrichmentTestCase(TestCase):
+    SPOT = 330.0
+
+    def setUp(self):
+        import_tastyworks_trades(SAMPLE_FILENAME)
+        self.archive = tempfile.TemporaryDirectory()
+        # Captures before and after the LMT trades (2018-08-27 15:27 New York time)
+        for hour in [15, 16]:
+            self.capture(datetime.datetime(2018, 8, 27, hour), self.SPOT + hour - 15)
+
+    def tearDown(self):
+        self.archive.cleanup()
+
+    def capture(self, captured_at, spot, underlying=None):
+        """ Saves an LMT chain priced so put-call parity gives spot at every strike, with the
+        price of its stock price row if given """
+        import catalog
+        import store
+        strikes = [320.0, 330.0, 340.0, 350.0, 360.0, 370.0]
+        table = pd.DataFrame(index=strikes)
+        for otype, intrinsic in [("call", [max(spot - k, 0) for k in strikes]),
+                                 ("put", [max(k - spot, 0) for k in strikes])]:
+            mid = pd.Series(intrinsic, index=strikes) + 2.0
+            table[otype + "_Last"] = mid
+            table[otype + "_Bid"] = mid - 0.1
+            table[otype + "_Ask"] = mid + 0.1
+        if underlying is not None:
+            table["underlying"] = underlying
+        chain = OrderedDict([("January 18, 2019", table)])
+        path = store.write_snapshot(chain, "lmt", self.archive.name, captured_at)
+        catalog.record_chain_files(self.archive.name, "lmt", path, chain, captured_at)
+
+    def test_legs_priced_asof_execution(self):
+        """ Legs get the quote of the last capture before their execution """
+        self.assertEqual(enrich_legs(self.archive.name), 2)
+        for leg in Leg.objects.filter(symbol="LMT"):
+            self.assertAlmostEqual(leg.underlying_price, self.SPOT)
+            self.assertAlmostEqual(leg.mid_price, 2.0, places=5)
+            self.assertGreater(leg.implied_volatility, 0)
+            self.assertEqual(leg.quote_time, datetime.datetime(
+                2018, 8, 27, 19, tzinfo=datetime.timezone.utc))
+        # Nothing was captured for the other underlyings
+        self.assertFalse(Leg.objects.exclude(symbol="LMT").filter(
+            underlying_price__isnull=False).exists())
+        # Legs already priced are skipped
+        self.assertEqual(enrich_legs(self.archive.name), 0)
+
+    def test_quoted_underlying_preferred_to_parity(self):
+        """ The underlying price of the capture's stock price row is used where it has one """
+        self.capture(datetime.datetime(2018, 8, 27, 15, 10), self.SPOT, self.SPOT + 1.25)
+        self.assertEqual(enrich_legs(self.archive.name), 2)
+        for leg in Leg.objects.filter(symbol="LMT"):
+            self.assertAlmostEqual(leg.underlying_price, self.SPOT + 1.25)
@@ -3,5 +3,7 @@ from django.urls import path
 from . import views
 
 urlpatterns = [
-    path('', views.index, name='index'),
+    path('legs/', views.legs, name='legs'),
+    path('positions/', views.positions, name='positions'),
+    path('pnl/', views.pnl, name='pnl'),
 ]
\ No newline at end of file
@@ -1,7 +1,101 @@
-from django.shortcuts import render
+from django.db.models import FloatField, Sum, Value
+from django.db.models.functions import Coalesce
+from django.http import HttpResponseBadRequest, JsonResponse
+from django.utils.dateparse import parse_date, parse_datetime
+from django.views.decorators.http import condition, require_GET
 
-# Create your views here.
-from django.http import HttpResponse
+from .caching import cached_result, request_etag
+from .models import Leg, Position
 
-def index(request):
-    return HttpResponse("Hello, world. You're at the polls index.")
\ No newline at end of file
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+LEG_FIELDS = ["id", "symbol", "exec_date", "buy_or_sell", "open_or_close", "instrument",
+              "expiration_date", "strike_price", "quantity", "execution_price", "execution_fees",
+              "margin", "underlying_price", "mid_price", "implied_volatility", "quote_time"]
+POSITION_FIELDS = ["id", "symbol", "instrument", "expiration_date", "strike_price", "quantity",
+                   "opened_quantity", "closed_quantity", "open_value", "close_value", "fees",
+                   "leg_count", "first_exec_date", "last_exec_date"]
+
+class BadQuery(ValueError):
+    """ Raised for query parameters that can't be used """
+
+def _parse_when(value, name):
+    """ Parses a date or datetime query parameter """
+    if value is None:
+        return None
+    when = parse_datetime(value) or parse_date(value)
+    if when is None:
+        raise BadQuery("Invalid {}: '{}'".format(name, value))
+    return when
+
+def _filtered(queryset, params, date_field):
+    """ Applies the symbol and date range parameters shared by the endpoints """
+    if "symbol" in params:
+        queryset = queryset.filter(symbol=params["symbol"].upper())
+    start = _parse_when(params.get("start"), "start")
+    if start is not None:
+        queryset = queryset.filter(**{date_field + "__gte": start})
+    end = _parse_when(params.get("end"), "end")
+    if end is not None:
+        queryset = queryset.filter(**{date_field + "__lte": end})
+    return queryset
+
+def _page(queryset, params, fields):
+    """ Keyset pagination on id: returns the rows after the 'after' id and the next cursor. Ids
+    are stable, as imports update positions in place (see positions.add_legs). """
+    try:
+        limit = min(int(params.get("limit", DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE)
+        after = int(params.get("after", 0))
+    except ValueError:
+        raise BadQuery("limit and after must be integers")
+    if limit < 1:
+        raise BadQuery("limit must be at least 1")
+    rows = list(queryset.filter(id__gt=after).order_by("id").values(*fields)[:limit + 1])
+    next_after = rows[limit - 1]["id"] if len(rows) > limit else None
+    return rows[:limit], next_after
+
+def _api_view(compute):
+    """ Wraps a read endpoint with ETag/conditional GET support and the result cache. The
+    endpoint computes a JSON-serializable result from the query parameters. """
+    @require_GET
+    @condition(etag_func=lambda request: request_etag(request))
+    def view(request):
+        try:
+            result = cached_result(request, lambda: compute(request.GET))
+        except BadQuery as e:
+            return HttpResponseBadRequest(str(e))
+        return JsonResponse(result)
+    view.__name__ = compute.__name__
+    view.__doc__ = compute.__doc__
+    return view
+
+@_api_view
+def legs(params):
+    """ Legs by symbol and execution date range, paginated """
+    queryset = _filtered(Leg.objects.all(), params, "exec_date")
+    rows, next_after = _page(queryset, params, LEG_FIELDS)
+    return {"legs": rows, "next": next_after}
+
+@_api_view
+def positions(params):
+    """ Positions by symbol and last execution date range, optionally only open ones,
+    paginated """
+    queryset = _filtered(Position.objects.all(), params, "last_exec_date")
+    if params.get("open"):
+        queryset = queryset.exclude(quantity=0)
+    rows, next_after = _page(queryset, params, POSITION_FIELDS)
+    for row in rows:
+        row["realized_pnl"] = Position(**row).realized_pnl
+    return {"positions": rows, "next": next_after}
+
+@_api_view
+def pnl(params):
+    """ Cash flow P&L per symbol of the legs executed in a date range """
+    queryset = _filtered(Leg.objects.all(), params, "exec_date")
+    zero = Value(0.0)
+    rows = queryset.values("symbol").annotate(
+        cash_flow=Coalesce(Sum("margin"), zero, output_field=FloatField()),
+        fees=Coalesce(Sum("execution_fees"), zero, output_field=FloatField()),
+    ).order_by("symbol")
+    return {"pnl": [dict(row, net=row["cash_flow"] + row["fees"]) for row in rows]}
@@ -0,0 +1,160 @@
+""" Timing and count metrics of the capture pipeline.
+
+The pipeline records into a process-wide registry as it runs: download size and time, soup
+build time, rows parsed, parse time and write time per file. The registry can be written
+out as a Prometheus text file (for the node_exporter textfile collector), served over HTTP at
+/metrics, or dumped as a JSON summary of the run:
+
+    python options_csv.py --symbols spx,ndx --metrics-file capture.prom --summary run.json
+
+Timers are kept as Prometheus summaries (count and sum, plus the max in the JSON summary), so
+the cost of recording is a dictionary update whatever the number of observations.
+"""
+import os
+import json
+import time
+import threading
+import logging
+from collections import OrderedDict
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+# Prefix of every metric name
+NAMESPACE = "options_csv"
+
+def _label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+def _format_labels(key):
+    if not key:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(name, value.replace("\\", "\\\\").replace('"', '\\"'))
+                          for name, value in key) + "}"
+
+class Metrics(object):
+    """ Thread-safe registry of counters and timers, keyed by name and labels. """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = OrderedDict()
+        self._timers = OrderedDict()
+        self.started_at = time.time()
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._timers.clear()
+            self.started_at = time.time()
+
+    def inc(self, name, value=1, **labels):
+        """ Adds value to a counter, e.g. inc('download_bytes', 1024, ticker='spx') """
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        """ Records one duration of a timer """
+        key = (name, _label_key(labels))
+        with self._lock:
+            count, total, longest = self._timers.get(key, (0, 0.0, 0.0))
+            self._timers[key] = (count + 1, total + seconds, max(longest, seconds))
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """ Times the body of a with statement into a timer """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def to_prometheus(self):
+        """ Renders the registry in the Prometheus text exposition format
+
+        Returns:
+            str: metrics text
+        """
+        lines = []
+        with self._lock:
+            counters = list(self._counters.items())
+            timers = list(self._timers.items())
+        declared = set()
+        for (name, key), value in counters:
+            metric = "{}_{}_total".format(NAMESPACE, name)
+            if metric not in declared:
+                declared.add(metric)
+                lines.append("# TYPE {} counter".format(metric))
+            lines.append("{}{} {}".format(metric, _format_labels(key), value))
+        for (name, key), (count, total, _) in timers:
+            metric = "{}_{}_seconds".format(NAMESPACE, name)
+            if metric not in declared:
+                declared.add(metric)
+                lines.append("# TYPE {} summary".format(metric))
+            lines.append("{}_count{} {}".format(metric, _format_labels(key), count))
+            lines.append("{}_sum{} {:.6f}".format(metric, _format_labels(key), total))
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """ Summarises the registry for a JSON run report
+
+        Returns:
+            dict: 'counters' and 'timers' lists, one entry per name and labels
+        """
+        with self._lock:
+            counters = [OrderedDict([("name", name), ("labels", dict(key)), ("value", value)])
+                        for (name, key), value in self._counters.items()]
+            timers = [OrderedDict([("name", name), ("labels", dict(key)), ("count", count),
+                                   ("total_seconds", total), ("max_seconds", longest),
+                                   ("mean_seconds", total / count)])
+                      for (name, key), (count, total, longest) in self._timers.items()]
+        return OrderedDict([("started_at", self.started_at),
+                            ("elapsed_seconds", time.time() - self.started_at),
+                            ("counters", counters), ("timers", timers)])
+
+    def write_prometheus(self, path):
+        """ Writes the Prometheus text to a file, replacing it atomically so a collector never
+        reads half of it """
+        with open(path + ".tmp", "w") as fobj:
+            fobj.write(self.to_prometheus())
+        os.replace(path + ".tmp", path)
+
+    def write_summary(self, path):
+        """ Writes the JSON summary to a file """
+        with open(path, "w") as fobj:
+            json.dump(self.summary(), fobj, indent=2)
+
+    def serve(self, port, host="127.0.0.1"):
+        """ Serves the Prometheus text at http://host:port/metrics from a background thread
+
+        Returns:
+            http.server.ThreadingHTTPServer: the server, to shut down when done
+        """
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        registry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.to_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                log.debug(format, *args)
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        log.info("Serving metrics at http://%s:%d/metrics", host, server.server_address[1])
+        return server
+
+# Registry the pipeline records into
+REGISTRY = Metrics()
+inc = REGISTRY.inc
+observe = REGISTRY.observe
+timer = REGISTRY.timer
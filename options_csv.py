@@ -1,22 +1,18 @@
 import pandas as pd
-import pickle
-from urllib.request import urlopen
-from bs4 import BeautifulSoup
 from collections import OrderedDict
 import logging
 import datetime
+import re
+import os
 
-log = logging.getLogger(__name__)
-
-# Make a publicly available filename output format
-OUTPUT_FILENAME_PREFIX_FORMAT = "{date}_{ticker}"
-OUTPUT_FILENAME_SUFFIX_FORMAT = "_exp{expiration}.{extension}"
-OUTPUT_FILENAME_FORMAT = OUTPUT_FILENAME_PREFIX_FORMAT + "_" + OUTPUT_FILENAME_SUFFIX_FORMAT
+import metrics
+import schema
+# bs4, urllib and the process pool are imported where they are used, so that importing this
+# module for its parser or constants stays cheap
+from constants import (OUTPUT_FILENAME_FORMAT, MARKETWATCH_URL_FORMAT, clean_filename,
+                       data_header, text_clean, OPTION_ORDER, UNDERLYING_COLUMN)
 
-# Make a string clean for use a as a filename
-clean_filename = lambda s: "".join([c for c in s if c.isalpha() or c.isdigit() or c==' ']).rstrip()
-# Common helper for creating a data header
-data_header = lambda prefix, header: prefix + "_" + header
+log = logging.getLogger(__name__)
 
 def secure_filename(ticker, expiration, extension="csv"):
     """ Create a usable filename to write an options data file
@@ -34,136 +30,518 @@ def secure_filename(ticker, expiration, extension="csv"):
     return OUTPUT_FILENAME_FORMAT.format(
         date=today, ticker=ticker, expiration=clean_exp, extension=extension)
 
-def load_symbol(ticker):
+def download_page(ticker, url_format=MARKETWATCH_URL_FORMAT, replay_dir=None, record_dir=None):
+    """ Downloads the raw options chain page for the index with the given symbol
+
+    Args:
+        ticker (str): ticker symbol of the option data
+        url_format (str): url of the options page, formatted with the lowercase ticker
+        replay_dir (str): read the page recorded in this fixture directory instead of
+            downloading it, see fixtures.py
+        record_dir (str): also save the downloaded page as a fixture in this directory
+
+    Returns:
+        bytes: body of the options page
+    """
+    if replay_dir:
+        import fixtures
+        log.info("Replaying %s from: %s", ticker, replay_dir)
+        return fixtures.load_fixture(replay_dir, ticker)
+    url = url_format.format(ticker=ticker.lower())
+    log.info("Loading webpage: %s", url)
+    from urllib.request import urlopen
+    with metrics.timer("download", ticker=ticker.lower()), urlopen(url) as urlobj:
+        page = urlobj.read()
+    metrics.inc("download_bytes", len(page), ticker=ticker.lower())
+    if record_dir:
+        import fixtures
+        fixtures.save_fixture(record_dir, ticker, page, url, urlobj.status, dict(urlobj.headers))
+    return page
+
+def load_symbol(ticker, replay_dir=None):
     """ Loads the options chain for the index with the given symbol
 
     Args:
         ticker (str): ticker symbol of the option data
+        replay_dir (str): read the page from this fixture directory instead of downloading it
 
     Returns:
         BeautifulSoup: soup object containing options table
     """
-    url = "http://www.marketwatch.com/investing/index/{}/options".format(ticker.lower())
-    log.info("Loading webpage: {}".format(url))
-    with urlopen(url) as urlobj:
-        soup = BeautifulSoup(urlobj.read(), "html.parser")
-    return soup
+    from bs4 import BeautifulSoup
+    page = download_page(ticker, replay_dir=replay_dir)
+    with metrics.timer("soup_build"):
+        return BeautifulSoup(page, "html.parser")
 
 def _checkItemWasFound(item_to_check, item_name, parent_name="webpage"):
     """ Checks if item_to_check is None, and if it is then throws an Exception. """
     if item_to_check is None:
         raise Exception("Failed to find item '{}' in '{}'".format(item_name, parent_name))
     else:
-        log.debug("Found item '{}' in '{}'".format(item_name, parent_name))
+        log.debug("Found item '%s' in '%s'", item_name, parent_name)
 
-def parse_options(soup, symbol):
-    """ Parses the given marketwatch soup for an options table. Saves the extracted options table
-    to a file.
+def extract_rows_soup(page):
+    """ Extracts the chain rows of the options table using BeautifulSoup. This is the reference
+    extraction backend.
 
     Args:
-        soup (BeautifulSoup): soup object containing data table
-        symbol (str): ticker symbol to use for labeling
+        page (BeautifulSoup, bytes or str): soup or raw html of the options page
 
+    Yields:
+        tuple: (row_classes, row_text, cells) for each 'chainrow' row, where cells is a list of
+            (cell_classes, cell_text) for each td in the row
     """
-    # Helper lambda functions
-    text_clean = lambda s: s.strip().replace(",","")
-    unpack_cols = lambda cols: [ text_clean(td.text) for td in cols ]
-
-    # First find the options table to parse
+    from bs4 import BeautifulSoup
+    if isinstance(page, BeautifulSoup):
+        soup = page
+    else:
+        with metrics.timer("soup_build"):
+            soup = BeautifulSoup(page, "html.parser")
     options = soup.find('div', {'id':'options'})
     _checkItemWasFound(options, 'options_table')
+    for row in options.findAll('tr', {'class': 'chainrow'}):
+        cells = [(td.get('class', []), td.text) for td in row.findAll('td')]
+        yield row['class'], row.text, cells
+
+# Compiled lookups for the lxml backend
+_LXML_TD = None
+
+def extract_rows_lxml(page):
+    """ Extracts the chain rows of the options table using lxml. The page is parsed
+    incrementally: everything before the options table is discarded as it streams past,
+    rows are released once they have been yielded and parsing stops at the end of the table.
+
+    Args:
+        page (BeautifulSoup, bytes or str): soup or raw html of the options page
+
+    Yields:
+        tuple: (row_classes, row_text, cells) as for extract_rows_soup
+    """
+    global _LXML_TD
+    from io import BytesIO
+    from lxml import etree
+    if _LXML_TD is None:
+        _LXML_TD = etree.XPath(".//td")
+    if not isinstance(page, (bytes, str)):
+        # A soup
+        page = str(page)
+    if isinstance(page, str):
+        page = page.encode("utf-8")
+
+    options = None
+    for event, elem in etree.iterparse(BytesIO(page), events=("start", "end"), html=True,
+                                       encoding="utf-8"):
+        if options is None:
+            if event == "start" and elem.tag == "div" and elem.get("id") == "options":
+                options = elem
+            elif event == "end" and elem.tag != "html":
+                elem.clear()
+            continue
+        if event != "end":
+            continue
+        if elem is options:
+            break
+        if elem.tag == "tr":
+            row_classes = elem.get("class", "").split()
+            if "chainrow" in row_classes:
+                cells = [(td.get("class", "").split(), td.xpath("string()"))
+                         for td in _LXML_TD(elem)]
+                yield row_classes, elem.xpath("string()"), cells
+            elem.clear()
+    _checkItemWasFound(options, 'options_table')
+
+# Available row extraction backends, by name
+EXTRACTORS = OrderedDict([
+    ("soup", extract_rows_soup),
+    ("lxml", extract_rows_lxml),
+])
+# Version of the parsed chain layout, part of the parse cache key (see parse_cache.py). Bump it
+# whenever a parser change alters the tables built from the same page.
+PARSER_VERSION = 2
+
+# Last number of a stock price row, e.g. 'Current price as of 4:00 PM: 2,700.00'
+_STOCK_PRICE_PATTERN = re.compile(r"(\d[\d,]*(?:\.\d+)?)\D*$")
+
+def _iter_rows(rows, prices=None):
+    """ Turns extracted chain rows into strike records. See iter_chain_rows.
+
+    Every header row sets the layout of the rows that follow it, so expiration blocks with
+    different columns are each read with their own headers. Layouts are cached by header
+    signature: blocks with identical header rows share one main_headers list.
+
+    Args:
+        rows (iterable): rows as yielded by one of the EXTRACTORS
+        prices (dict): if given, filled with expiration -> price of its stock price row
 
-    # Find the first header row in the table
-    header_rows = options.select('tr.chainrow.understated')
-    header_row = header_rows[0] # TODO: Iterate over all headers to find all tables!
-    _checkItemWasFound(header_row, 'header_row', 'options_table')
-    # Parse the header row into fields
-    headers = unpack_cols(header_row.findAll('td'))
-    header_half_len = int(len(headers)/2)
-    strike_header = headers[header_half_len]
-    main_headers = headers[:header_half_len]
-    option_order = ["call", "put"]
-    data_headers = lambda option_type: [data_header(option_type, header) for header in main_headers]
-    log.info("Found main headers: {}".format(main_headers))
-
-    # Now process all of the rows and extract the pricing information from them
-    rows = options.findAll('tr', {'class': 'chainrow'})
-    log.debug("Found {} rows in options table.".format(len(rows)))
+    Yields:
+        tuple: (expiration, strike, values, main_headers) for each option row
+    """
+    layouts = {}
+    main_headers = None
     calls_are_itm = True
     current_expiration = None
-    data_columns = [header for option_type in option_order for header in data_headers(option_type)]
-    current_table = None
-    for row in rows:
-        if "heading" in row["class"] and "Expires" in row.text:
-            # Extract the expiration date
-            this_expiration = row.text.strip().replace("Expires ", "")
-
-            if current_expiration is not None and this_expiration != current_expiration:
-                # We need to close the old file and start a new one
-                out_file = secure_filename(symbol, current_expiration)
-                current_table.to_csv(out_file)
-                log.info("Finshed expiration '{}'; Saved to: {}".format(
-                    current_expiration, out_file))
-
-            log.debug("Starting new expiration: {}".format(this_expiration))
-            current_expiration = this_expiration
-            current_table = pd.DataFrame(columns=(data_columns))
-
-        elif "aright" in row['class']:
+    for row_class, row_text, cells in rows:
+        if "understated" in row_class:
+            # Parse the header row into fields, unless an identical one was seen before
+            signature = tuple(text_clean(text) for _, text in cells)
+            main_headers = layouts.get(signature)
+            if main_headers is None:
+                main_headers = layouts[signature] = list(signature[:len(signature) // 2])
+                log.info("Found main headers: %s", main_headers)
+
+        elif "heading" in row_class and "Expires" in row_text:
+            # Extract the expiration date. Each expiration has its own stock price row, so
+            # calls start out in the money again.
+            current_expiration = row_text.strip().replace("Expires ", "")
+            calls_are_itm = True
+            log.debug("Starting new expiration: %s", current_expiration)
+
+        elif "aright" in row_class:
+            _checkItemWasFound(main_headers, 'header_row', 'options_table')
+            n_headers = len(main_headers)
             # this is a row containing option data. get the strike column first.
-            strike_col = text_clean(row.find('td', {'class': 'strike-col'}).text)
-            log.debug("Processing row with strike: {}".format(strike_col))
-
-            results = OrderedDict()
-
-            # add a prefix as a call or put depending on whether we know (by tracking our progress)
-            # whether calls are itm yet or not
-            extract_order = ["inthemoney", ""] if calls_are_itm else ["", "inthemoney"]
-            for option_type, extract in zip(option_order, extract_order):
-                cols = unpack_cols(row.findAll('td', {'class': extract}))
-                if len(cols) < len(main_headers):
-                    cols += [None] * (len(headers) - len(cols))
-                cols = cols[:len(headers)]
-                entry = [(header, col) for header, col in zip(data_headers(option_type), cols)]
-                results.update(entry)
-
-            # add this row to the running table
-            strike_value = float(strike_col.replace(",", ""))
-            log.debug("Processed option row for strike: {}".format(strike_value))
-            current_table.loc[strike_value] = results
-
-        elif "stockprice" in row['class']:
+            strike_col = next(text_clean(text) for classes, text in cells
+                              if 'strike-col' in classes)
+
+            # pull the call and put halves depending on whether we know (by tracking our
+            # progress) whether calls are itm yet or not
+            itm = [text_clean(text) for classes, text in cells if 'inthemoney' in classes]
+            otm = [text_clean(text) for classes, text in cells if not classes]
+            values = []
+            for cols in ([itm, otm] if calls_are_itm else [otm, itm]):
+                cols = cols[:n_headers]
+                cols += [None] * (n_headers - len(cols))
+                values += cols
+
+            yield current_expiration, float(strike_col), values, main_headers
+
+        elif "stockprice" in row_class:
             # We have reached the stock price in the table, so we know calls are no longer itm
-            # (and we skip this row)
+            # (and only the price is kept of this row)
             log.debug("Processed current stock price.")
             calls_are_itm = False
+            price = _STOCK_PRICE_PATTERN.search(row_text)
+            if prices is not None and price:
+                prices[current_expiration] = float(text_clean(price.group(1)))
 
         else:
             # We don't know or care how to process this row.
             pass
 
+    _checkItemWasFound(main_headers, 'header_row', 'options_table')
 
-if __name__ == "__main__":
-    import os
-    import argparse
-
-    parser = argparse.ArgumentParser(
-        description="Parses a MarketWatch options chain into a CSV made by pandas.")
-    parser.add_argument("--symbol", default="spx", help="Symbol to look up.")
-    parser.add_argument("--out", default=os.getcwd(),
-        help="Output directory. Default is current dir.")
-    parser.add_argument("--info", action="store_true", help="Print additional information")
-    parser.add_argument("--verbose", action="store_true", help="Print debug information")
-
-    args=parser.parse_args()
-    if args.verbose:
-        logging.basicConfig(level=logging.DEBUG)
-    elif args.info:
-        logging.basicConfig(level=logging.INFO)
+def iter_chain_rows(page, backend="soup"):
+    """ Walks the marketwatch options table once, yielding one record per strike row.
+
+    Args:
+        page (BeautifulSoup, bytes or str): soup or raw html of the options page
+        backend (str): name of the row extraction backend, see EXTRACTORS
+
+    Yields:
+        tuple: (expiration, strike, values) where values holds the call columns followed by the
+            put columns, in the order given by chain_columns
+    """
+    for expiration, strike, values, _ in _iter_rows(EXTRACTORS[backend](page)):
+        yield expiration, strike, values
+
+def chain_columns(main_headers):
+    """ Builds the prefixed call/put column names for a chain table
+
+    Args:
+        main_headers (list): per-option-type headers, e.g. ['Symbol', 'Last', ...]
+
+    Returns:
+        list: column names, calls first then puts
+    """
+    return [data_header(option_type, header)
+            for option_type in OPTION_ORDER for header in main_headers]
+
+def parse_chain(page, backend="soup"):
+    """ Parses the given marketwatch page into one table per expiration. Each table is built
+    in a single step once all of its rows have been collected.
+
+    Args:
+        page (BeautifulSoup, bytes or str): soup or raw html of the options page
+        backend (str): name of the row extraction backend, see EXTRACTORS
+
+    Returns:
+        OrderedDict: expiration string -> DataFrame indexed by strike
+    """
+    with metrics.timer("parse", backend=backend):
+        chain = chain_from_rows(EXTRACTORS[backend](page))
+    metrics.inc("rows", _count_rows(chain), backend=backend)
+    return chain
+
+def _count_rows(chain):
+    return sum(len(table) for table in chain.values())
+
+def chain_from_rows(rows):
+    """ Builds the expiration tables from extracted chain rows, with the column types of
+    schema.py. See parse_chain. Each table ends with UNDERLYING_COLUMN, the price of its
+    expiration's stock price row (missing if it has none).
+
+    Args:
+        rows (iterable): rows as yielded by one of the EXTRACTORS
+
+    Returns:
+        OrderedDict: expiration string -> DataFrame indexed by strike
+    """
+    columns = OrderedDict()
+    layouts = OrderedDict()
+    strikes = OrderedDict()
+    values = OrderedDict()
+    prices = {}
+    for expiration, strike, row, main_headers in _iter_rows(rows, prices):
+        if expiration not in values:
+            columns[expiration] = chain_columns(main_headers)
+            layouts[expiration] = main_headers
+            strikes[expiration] = []
+            values[expiration] = []
+        elif main_headers is not layouts[expiration]:
+            # The expiration continues under another header row: line the row up with the
+            # columns its table started with
+            by_column = dict(zip(chain_columns(main_headers), row))
+            row = [by_column.get(column) for column in columns[expiration]]
+        strikes[expiration].append(strike)
+        values[expiration].append(row)
+
+    chain = OrderedDict()
+    for expiration in values:
+        chain[expiration] = schema.typed_table(
+            values[expiration], pd.Index(strikes[expiration]), columns[expiration])
+        chain[expiration][UNDERLYING_COLUMN] = schema.convert_column(
+            [prices.get(expiration)] * len(strikes[expiration]), UNDERLYING_COLUMN)
+        log.debug("Built expiration '%s' with %d strikes", expiration, len(strikes[expiration]))
+    return chain
+
+# Raw html patterns used to split a page into expiration sections without parsing it
+_OPTIONS_DIV_PATTERN = re.compile(r"""<div\b[^>]*\bid\s*=\s*["']?options\b[^>]*>""", re.I)
+_HEADING_ROW_PATTERN = re.compile(
+    r"""<tr\b[^>]*\bclass\s*=\s*["'][^"']*\bheading\b[^"']*["'][^>]*>(?P<text>.*?)</tr>""",
+    re.I | re.S)
+_HEADER_ROW_PATTERN = re.compile(
+    r"""<tr\b[^>]*\bclass\s*=\s*["'][^"']*\bunderstated\b[^"']*["'][^>]*>.*?</tr>""",
+    re.I | re.S)
+_TAG_PATTERN = re.compile(r"<[^>]*>")
+
+def split_sections(page):
+    """ Splits the raw html of an options page into one self-contained chunk per expiration,
+    without parsing it. Each chunk holds the start of the options table, then the last header
+    row before the expiration's heading (the one its rows are laid out by, see _iter_rows) and
+    the rows of the expiration, so it can be parsed on its own.
+
+    Args:
+        page (bytes or str): raw html of the options page
+
+    Returns:
+        OrderedDict: expiration string -> html chunk (str). Empty if the page could not be split.
+    """
+    if isinstance(page, bytes):
+        page = page.decode("utf-8", errors="replace")
+    options = _OPTIONS_DIV_PATTERN.search(page)
+    if options is None:
+        return OrderedDict()
+    headings = [match for match in _HEADING_ROW_PATTERN.finditer(page, options.start())
+                if "Expires" in match.group("text")]
+    if not headings:
+        return OrderedDict()
+
+    prefix = page[options.start():headings[0].start()]
+    header_rows = list(_HEADER_ROW_PATTERN.finditer(page, options.start()))
+    ends = [match.start() for match in headings[1:]] + [len(page)]
+    sections = OrderedDict()
+    header = 0
+    for match, end in zip(headings, ends):
+        text = _TAG_PATTERN.sub("", match.group("text")).strip().replace("Expires ", "")
+        # Blocks may put their own header row before their heading
+        while header < len(header_rows) and header_rows[header].start() < match.start():
+            header += 1
+        layout = header_rows[header - 1].group(0) if header else ""
+        # Repeated headings for one expiration are kept together in a single chunk
+        sections.setdefault(text, [prefix]).append(layout + page[match.start():end])
+    return OrderedDict((text, "".join(parts)) for text, parts in sections.items())
+
+def _parse_section(chunk, symbol, backend, outdir, with_greeks=False):
+    """ Parses one expiration chunk in a worker process, saving it to CSV if outdir is given.
+    Returns the chain and the files written. """
+    chain = parse_chain(chunk, backend)
+    if outdir is None:
+        return chain, OrderedDict()
+    if with_greeks:
+        import greeks
+        return chain, write_chain(greeks.add_greeks(chain), symbol, outdir)
+    return chain, write_chain(chain, symbol, outdir)
+
+def parse_options_parallel(page, symbol, backend="soup", workers=None, outdir=None, fmt="csv",
+                           cache=None, with_greeks=False):
+    """ Parses and saves an options page with one task per expiration, spread over a process
+    pool. Falls back to parsing the page as a whole if it can't be split into expirations. CSV
+    files are written by the workers; columnar snapshots hold the whole chain so they are written
+    once all expirations are in.
+
+    Metrics recorded in the workers stay in their processes, so the parent records the wall time
+    of the pool ('parse_parallel', including the CSV writes of the workers) and the rows of the
+    chains they return.
+
+    Args:
+        page (bytes or str): raw html of the options page
+        symbol (str): ticker symbol to use for labeling
+        backend (str): name of the row extraction backend, see EXTRACTORS
+        workers (int): number of worker processes. Default is one per CPU.
+        outdir (str): output directory. Default is the current directory.
+        fmt (str): output format, 'csv', 'delta', 'segment' or one of store.FORMATS
+        cache (parse_cache.ParseCache): cache of chains already parsed and saved, see
+            parse_options
+        with_greeks (bool): see save_chain
+
+    Returns:
+        OrderedDict: expiration string -> DataFrame indexed by strike
+    """
+    key, target, chain, unchanged = _lookup_cache(cache, page, symbol, backend, outdir, fmt)
+    if chain is not None:
+        _save_parsed(chain, symbol, outdir, fmt, cache, key, target, unchanged, with_greeks)
+        return chain
+    sections = split_sections(page)
+    if not sections:
+        log.warning("Could not split the page into expirations, parsing it as a whole.")
+        chain = parse_chain(page, backend)
+        _save_parsed(chain, symbol, outdir, fmt, cache, key, target, unchanged, with_greeks)
+        return chain
+    log.info("Parsing %d expirations in parallel", len(sections))
+
+    chain = OrderedDict()
+    written = OrderedDict()
+    csv_outdir = (outdir or os.getcwd()) if fmt == "csv" else None
+    from concurrent.futures import ProcessPoolExecutor
+    with metrics.timer("parse_parallel", backend=backend), ProcessPoolExecutor(workers) as executor:
+        futures = [executor.submit(_parse_section, chunk, symbol, backend, csv_outdir,
+                                   with_greeks)
+                   for chunk in sections.values()]
+        for future in futures:
+            section_chain, section_written = future.result()
+            chain.update(section_chain)
+            written.update(section_written)
+    metrics.inc("rows", _count_rows(chain), backend=backend)
+    if fmt != "csv":
+        save_chain(chain, symbol, outdir, fmt, with_greeks=with_greeks)
     else:
-        logging.basicConfig(level=logging.WARNING)
-    # first lets get this output file straight
-    if args.out is None:
-        args.out = ".".join([args.symbol, "csv"])
-    soup = load_symbol(args.symbol)
-    df = parse_options(soup, args.symbol)
\ No newline at end of file
+        import catalog
+        catalog.record_chain_files(outdir, symbol, written, chain)
+    if key:
+        cache.saved(key, chain, symbol, target)
+    return chain
+
+def write_chain(chain, symbol, outdir=None):
+    """ Saves each expiration table of a parsed chain to its own CSV file.
+
+    Args:
+        chain (OrderedDict): expiration string -> DataFrame, as returned by parse_chain
+        symbol (str): ticker symbol to use for labeling
+        outdir (str): output directory. Default is the current directory.
+
+    Returns:
+        OrderedDict: expiration string -> filename written
+    """
+    if outdir:
+        os.makedirs(outdir, exist_ok=True)
+    written = OrderedDict()
+    for expiration, table in chain.items():
+        out_file = os.path.join(outdir or "", secure_filename(symbol, expiration))
+        with metrics.timer("write", format="csv"):
+            table.to_csv(out_file)
+        log.info("Finshed expiration '%s'; Saved to: %s", expiration, out_file)
+        written[expiration] = out_file
+    return written
+
+def save_chain(chain, symbol, outdir=None, fmt="csv", captured_at=None, with_greeks=False):
+    """ Saves a parsed chain, either as one CSV per expiration or as a single columnar
+    snapshot in the store rooted at outdir (see store.py), and records the files written in the
+    catalog of outdir (see catalog.py).
+
+    Args:
+        chain (OrderedDict): expiration string -> DataFrame, as returned by parse_chain
+        symbol (str): ticker symbol to use for labeling
+        outdir (str): output directory. Default is the current directory.
+        fmt (str): output format, 'csv', 'delta' (see delta.py), 'segment' (see segment.py) or
+            one of store.FORMATS
+        captured_at (datetime.datetime): capture time recorded in the catalog. Default is now.
+        with_greeks (bool): also save mid, implied volatility and Greeks as of captured_at, the
+            greeks.GREEK_HEADERS columns of each option type (see greeks.add_greeks)
+
+    Returns:
+        OrderedDict or str: filenames written per expiration for CSV, else the snapshot path
+    """
+    import catalog
+    captured_at = captured_at or datetime.datetime.now()
+    if with_greeks:
+        import greeks
+        chain = greeks.add_greeks(chain, captured_at)
+    if fmt == "delta":
+        import delta
+        return delta.write_delta(chain, symbol, outdir or os.getcwd(), captured_at)
+    if fmt == "segment":
+        import segment
+        return segment.write_segment(chain, symbol, outdir or os.getcwd(), captured_at)
+    if fmt == "csv":
+        written = write_chain(chain, symbol, outdir)
+    else:
+        import store
+        written = store.write_snapshot(chain, symbol, outdir or os.getcwd(), captured_at, fmt)
+    catalog.record_chain_files(outdir, symbol, written, chain, captured_at)
+    return written
+
+def parse_options(soup, symbol, backend="soup", outdir=None, fmt="csv", cache=None,
+                  with_greeks=False):
+    """ Parses the given marketwatch soup for an options table. Saves the extracted options table
+    to a file per expiration.
+
+    Args:
+        soup (BeautifulSoup, bytes or str): soup or raw html of the options page
+        symbol (str): ticker symbol to use for labeling
+        backend (str): name of the row extraction backend, see EXTRACTORS
+        outdir (str): output directory. Default is the current directory.
+        fmt (str): output format, 'csv', 'delta', 'segment' or one of store.FORMATS
+        cache (parse_cache.ParseCache): cache of chains already parsed. A page found in it is
+            not parsed again, nor saved again if it is the page last saved to the same outdir
+            and fmt.
+        with_greeks (bool): see save_chain
+
+    Returns:
+        OrderedDict: expiration string -> DataFrame indexed by strike
+    """
+    key, target, chain, unchanged = _lookup_cache(cache, soup, symbol, backend, outdir, fmt)
+    if chain is None:
+        chain = parse_chain(soup, backend)
+    _save_parsed(chain, symbol, outdir, fmt, cache, key, target, unchanged, with_greeks)
+    return chain
+
+def _lookup_cache(cache, page, symbol, backend, outdir, fmt):
+    """ Looks a raw page up in the parse cache, see parse_cache.ParseCache.unchanged
+
+    Returns:
+        tuple: (key, target, chain, unchanged) with the cache key of the page, the destination
+            name of outdir and fmt, the cached chain (None on a miss) and whether the page is
+            the one last saved there. key is None without a cache or for a soup.
+    """
+    if cache is None or not isinstance(page, (bytes, str)):
+        return None, None, None, False
+    import parse_cache
+    key = parse_cache.cache_key(page, backend)
+    target = parse_cache.destination(outdir, fmt)
+    return (key, target) + cache.unchanged(key, symbol, target)
+
+def _save_parsed(chain, symbol, outdir, fmt, cache, key, target, unchanged, with_greeks=False):
+    """ Saves a chain unless it is the one last saved to the same destination, then records it
+    in the parse cache. See _lookup_cache for the cache arguments and save_chain for
+    with_greeks. """
+    if unchanged:
+        log.info("%s unchanged since it was last saved, skipping", symbol)
+        metrics.inc("captures_skipped", ticker=symbol.lower(), reason="cached")
+        return
+    save_chain(chain, symbol, outdir, fmt, with_greeks=with_greeks)
+    if key:
+        cache.saved(key, chain, symbol, target)
+
+if __name__ == "__main__":
+    import cli
+    raise SystemExit(cli.script_main("fetch"))
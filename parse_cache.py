@@ -0,0 +1,221 @@
+""" Persistent cache of parsed options chains, keyed by the content of the page.
+
+Between updates the options page is often byte-identical to the previous download. The cache
+maps a hash of the page body, the parser version and the extraction backend to the chain parsed
+from it, so an identical page is never parsed twice:
+
+    {cache_dir}/3f1c...e9.chain.z
+    {cache_dir}/saved.json
+
+Entries are the pickled chain tables compressed with zlib (a 40 x 200 chain is under 100 KiB).
+A hit refreshes the entry's modification time, and once the cache is over its size or entry
+limit the least recently used entries are evicted. Bumping options_csv.PARSER_VERSION makes
+every existing entry a miss; they then age out like any other.
+
+saved.json remembers the key of the page last saved for each ticker and destination (output
+directory, format and capture date, see destination), so a page identical to the last one saved
+there need not be saved again. A page that changes and then changes back is saved both times.
+"""
+import os
+import json
+import zlib
+import pickle
+import hashlib
+import logging
+import datetime
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+ENTRY_SUFFIX = ".chain.z"
+SAVED_FILENAME = "saved.json"
+# Default limits of a cache directory
+MAX_BYTES = 256 * 1024 * 1024
+MAX_ENTRIES = 1000
+
+def cache_key(page, backend="soup", version=None):
+    """ Cache key of a page: sha256 of the parser version, the backend and the page body
+
+    Args:
+        page (bytes or str): raw html of the options page
+        backend (str): name of the row extraction backend, see options_csv.EXTRACTORS
+        version (int): parser version. Default is options_csv.PARSER_VERSION.
+
+    Returns:
+        str: hex digest
+    """
+    if version is None:
+        import options_csv
+        version = options_csv.PARSER_VERSION
+    if isinstance(page, str):
+        page = page.encode("utf-8")
+    digest = hashlib.sha256("{}\x1e{}\x1e".format(version, backend).encode("utf-8"))
+    digest.update(page)
+    return digest.hexdigest()
+
+def destination(outdir, fmt, date=None):
+    """ Names where chains are saved. Every output format is partitioned by capture date (CSV
+    filenames, the date= directories of snapshots, delta captures and segments), so output on
+    another day is another destination and the first page of a day is always saved.
+
+    Args:
+        outdir (str): output directory. Default is the current directory.
+        fmt (str): output format, see options_csv.save_chain
+        date (datetime.date): capture date. Default is today.
+
+    Returns:
+        str: destination name
+    """
+    return "{}:{}:{}".format(fmt, os.path.abspath(outdir or os.getcwd()),
+                             date or datetime.date.today())
+
+class ParseCache(object):
+    """ Directory of parsed chains with least-recently-used eviction.
+
+    Args:
+        directory (str): cache directory, created if missing
+        max_bytes (int): evict entries once they take more than this many bytes
+        max_entries (int): evict entries once there are more than this many
+    """
+    def __init__(self, directory, max_bytes=MAX_BYTES, max_entries=MAX_ENTRIES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ENTRY_SUFFIX)
+
+    def __contains__(self, key):
+        return os.path.isfile(self.path(key))
+
+    def get(self, key):
+        """ Loads a cached chain, or None on a miss (or an unreadable entry, which is dropped) """
+        path = self.path(key)
+        try:
+            with open(path, "rb") as fobj:
+                blob = fobj.read()
+        except FileNotFoundError:
+            metrics.inc("parse_cache", result="miss")
+            return None
+        try:
+            chain = pickle.loads(zlib.decompress(blob))
+        except Exception as exc:
+            log.warning("Dropping unreadable parse cache entry %s: %s", path, exc)
+            self._remove(path)
+            metrics.inc("parse_cache", result="miss")
+            return None
+        # Marks the entry as recently used
+        os.utime(path)
+        metrics.inc("parse_cache", result="hit")
+        return chain
+
+    def put(self, key, chain):
+        """ Stores a parsed chain, then evicts old entries if the cache is over its limits
+
+        Returns:
+            str: path of the entry
+        """
+        path = self.path(key)
+        blob = zlib.compress(pickle.dumps(chain, pickle.HIGHEST_PROTOCOL))
+        # Written under a temporary name so a concurrent reader never sees half an entry
+        with open(path + ".tmp", "wb") as fobj:
+            fobj.write(blob)
+        os.replace(path + ".tmp", path)
+        metrics.inc("parse_cache_bytes", len(blob))
+        self.evict()
+        return path
+
+    def _read_saved(self):
+        try:
+            with open(os.path.join(self.directory, SAVED_FILENAME)) as fobj:
+                return json.load(fobj)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _write_saved(self, saved):
+        path = os.path.join(self.directory, SAVED_FILENAME)
+        with open(path + ".tmp", "w") as fobj:
+            json.dump(saved, fobj, indent=0, sort_keys=True)
+        os.replace(path + ".tmp", path)
+
+    def last_saved(self, ticker, where):
+        """ Key of the page last saved for a ticker to a destination, or None """
+        return self._read_saved().get("{}|{}".format(where, ticker.lower()))
+
+    def mark_saved(self, ticker, where, key):
+        """ Records the page just saved for a ticker to a destination """
+        saved = self._read_saved()
+        saved["{}|{}".format(where, ticker.lower())] = key
+        self._write_saved(saved)
+
+    def entries(self):
+        """ Lists the entries, least recently used first
+
+        Returns:
+            list: (mtime, size, path) of each entry
+        """
+        entries = []
+        with os.scandir(self.directory) as scan:
+            for entry in scan:
+                if entry.name.endswith(ENTRY_SUFFIX):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return sorted(entries)
+
+    def evict(self):
+        """ Removes the least recently used entries until the cache is within its limits, along
+        with the saved marks of pages no longer in it
+
+        Returns:
+            int: number of entries removed
+        """
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in entries:
+            if total <= self.max_bytes and len(entries) - removed <= self.max_entries:
+                break
+            self._remove(path)
+            total -= size
+            removed += 1
+        if removed:
+            log.debug("Evicted %d parse cache entries", removed)
+            metrics.inc("parse_cache_evictions", removed)
+            saved = self._read_saved()
+            kept = {name: key for name, key in saved.items() if key in self}
+            if len(kept) < len(saved):
+                self._write_saved(kept)
+        return removed
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def unchanged(self, key, ticker, where):
+        """ Looks up a page that is about to be saved.
+
+        Args:
+            key (str): cache key of the page, see cache_key
+            ticker (str): ticker symbol of the page
+            where (str): destination it is saved to, see destination
+
+        Returns:
+            tuple: (chain, unchanged) with the cached chain (None on a miss) and whether it is
+                the page last saved for the ticker to that destination, so needn't be saved
+        """
+        chain = self.get(key)
+        return chain, chain is not None and self.last_saved(ticker, where) == key
+
+    def saved(self, key, chain, ticker, where):
+        """ Records a chain that was just saved: stores it (unless cached already) and marks it
+        as the page last saved for the ticker to the destination """
+        if key not in self:
+            self.put(key, chain)
+        self.mark_saved(ticker, where, key)
@@ -1,40 +1,57 @@
-import pandas as pd
-import numpy as np
-import plotly.plotly as py
-import plotly.graph_objs as go
-import argparse
+import render
+from constants import clean_filename
 
-# Make a string clean for use a as a filename
-clean_filename = lambda s: "".join([c for c in s if c.isalpha() or c.isdigit() or c==' ']).rstrip()
+OPTION_COLORS = [("call", "green"), ("put", "red")]
 
-def make_hbar_plot(options_table, symbol, parameter):
+def _hbar_traces(options_table, parameter):
+    """ Trace properties of the call and put bars of one parameter """
+    return [{"x": options_table['{}_{}'.format(otype, parameter)], "y": options_table.index}
+            for otype, _ in OPTION_COLORS]
+
+def make_hbar_figure(options_table, symbol, parameter):
+    import plotly.graph_objs as go
     data = [
         go.Bar(
             name=otype,
-            x=options_table['{}_{}'.format(otype, parameter)],
-            y=options_table.index,
             orientation='h',
             marker={
                 "color": color,
             },
+            **trace
         )
-        for otype, color in [("call", "green"), ("put", "red")]
+        for (otype, color), trace in zip(OPTION_COLORS, _hbar_traces(options_table, parameter))
     ]
 
     layout = go.Layout(
         title="{} - {}".format(symbol, parameter),
         barmode='stack'
     )
-    fig = go.Figure(data=data, layout=layout)
-    return py.plot(fig, filename=clean_filename("{}_{}".format(symbol, parameter)))
+    return go.Figure(data=data, layout=layout)
+
+def make_hbar_plot(options_table, symbol, parameter):
+    fig = make_hbar_figure(options_table, symbol, parameter)
+    return render.cloud_plot(fig, filename=clean_filename("{}_{}".format(symbol, parameter)))
+
+def render_hbar_plots(jobs, outdir, fmt="html"):
+    """ Renders bar plots offline, reusing one figure for all of them.
+
+    Args:
+        jobs (list): (options_table, symbol, parameter) tuples
+        outdir (str): output directory
+        fmt (str): one of render.FORMATS
+
+    Returns:
+        list: filenames written
+    """
+    if not jobs:
+        return []
+    template = make_hbar_figure(*jobs[0])
+    return render.render_batch(template, [
+        (clean_filename("{}_{}".format(symbol, parameter)).replace(" ", "_"),
+         _hbar_traces(options_table, parameter),
+         {"title": "{} - {}".format(symbol, parameter)})
+        for options_table, symbol, parameter in jobs], outdir, fmt)
 
 if __name__ == "__main__":
-    typical_params = ["Ask", "Bid", "Change", "Last", "Open Int.", "Symbol", "Vol"]
-    parser = argparse.ArgumentParser(description="Plots a parameter from an options CSV")
-    parser.add_argument("--csv", default="spx.csv", help="CSV file to pull parameter from")
-    parser.add_argument("--param", default="Open Int.",
-        help="Parameter to pull and plot. Typical params are {} ".format(typical_params))
-
-    args = parser.parse_args()
-    options_table = pd.DataFrame.from_csv(args.csv)
-    url = make_hbar_plot(options_table, args.csv.split(".")[0], args.param)
+    import cli
+    raise SystemExit(cli.script_main("plot"))
@@ -0,0 +1,80 @@
+""" Offline rendering of plotly figures to local files.
+
+Figures are written as HTML (or as PNG/SVG/PDF when kaleido is installed) instead of being
+uploaded to the plotly cloud, so charts render on machines without network access and without
+a round trip per chart. When many HTML charts go to one directory, plotly.js is written to that
+directory once and shared by every chart instead of being embedded in each file.
+"""
+import os
+import logging
+
+log = logging.getLogger(__name__)
+
+# Formats written by render_figure; anything but html needs the kaleido package
+FORMATS = ["html", "png", "svg", "pdf"]
+
+def cloud_plot(fig, filename):
+    """ Uploads a figure to the plotly cloud service, the way the scripts always have.
+
+    Returns:
+        str: url of the uploaded figure
+    """
+    try:
+        import chart_studio.plotly as py
+    except ImportError:
+        import plotly.plotly as py
+    return py.plot(fig, filename=filename)
+
+def render_figure(fig, filename, fmt=None, shared_js=False):
+    """ Writes a figure to a local file.
+
+    Args:
+        fig (plotly.graph_objs.Figure or dict): figure to render
+        filename (str): output file
+        fmt (str): one of FORMATS. Default is taken from the filename extension.
+        shared_js (bool): for html, load plotly.js from a plotly.min.js file next to the chart
+            (written by plotly once per directory) instead of embedding it, which keeps each
+            file small
+
+    Returns:
+        str: filename written
+    """
+    import plotly.graph_objs as go
+    if not isinstance(fig, go.Figure):
+        fig = go.Figure(fig)
+    fmt = fmt or os.path.splitext(filename)[1].lstrip(".") or "html"
+    outdir = os.path.dirname(filename)
+    if outdir:
+        os.makedirs(outdir, exist_ok=True)
+    if fmt == "html":
+        fig.write_html(filename, include_plotlyjs="directory" if shared_js else True,
+                       auto_open=False)
+    else:
+        fig.write_image(filename, format=fmt)
+    log.info("Rendered: %s", filename)
+    return filename
+
+def render_batch(template, jobs, outdir, fmt="html", shared_js=True):
+    """ Renders many charts of the same kind by refilling one template figure, instead of
+    building a new figure (and re-validating its layout) for each chart.
+
+    Args:
+        template (plotly.graph_objs.Figure): figure whose traces and layout are updated in turn
+        jobs (iterable): (name, trace_updates, layout_updates) tuples, where trace_updates is a
+            list of property dicts applied to the template traces in order, layout_updates a
+            property dict applied to the layout and name the output filename without extension
+        outdir (str): output directory
+        fmt (str): one of FORMATS
+        shared_js (bool): for html, share one plotly.js file between all charts
+
+    Returns:
+        list: filenames written
+    """
+    written = []
+    for name, trace_updates, layout_updates in jobs:
+        for trace, update in zip(template.data, trace_updates):
+            trace.update(update)
+        template.update_layout(layout_updates)
+        filename = os.path.join(outdir, "{}.{}".format(name, fmt))
+        written.append(render_figure(template, filename, fmt, shared_js))
+    return written
@@ -0,0 +1,97 @@
+""" Column types of parsed options chains.
+
+Chain tables are typed once, when they are built: prices are float32, volume and open interest
+nullable Int32, the option symbol categorical, and cells holding no value (blank, '—', '-')
+are missing rather than strings. Everything downstream (the store, cubes, plots, Greeks) then
+works on native arrays instead of re-parsing text.
+
+    column          dtype
+    {type}_Symbol   category
+    {type}_Vol      Int32
+    {type}_Open Int. Int32
+    anything else   float32 (prices, including the underlying column)
+"""
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+PRICE_DTYPE = "float32"
+COUNT_DTYPE = "Int32"
+TEXT_DTYPE = "category"
+# Chain headers that are text or counts, everything else is a price
+TEXT_HEADERS = ["Symbol"]
+COUNT_HEADERS = ["Vol", "Open Int."]
+
+def header_of(column):
+    """ Strips the call/put prefix from a chain column name """
+    return column.split("_", 1)[-1]
+
+def column_dtype(column):
+    """ dtype of a chain column, e.g. 'float32' for 'call_Last' """
+    header = header_of(column)
+    if header in TEXT_HEADERS:
+        return TEXT_DTYPE
+    if header in COUNT_HEADERS:
+        return COUNT_DTYPE
+    return PRICE_DTYPE
+
+def convert_column(values, column):
+    """ Converts the cell values of one chain column to the column's dtype. Values that aren't
+    numbers ('—', blanks, None) in a numeric column become missing.
+
+    Args:
+        values (array-like): cell values, as text or already numeric
+        column (str): chain column name
+
+    Returns:
+        pandas array or Categorical of the column's dtype
+    """
+    dtype = column_dtype(column)
+    values = pd.Series(values)
+    if dtype == TEXT_DTYPE:
+        blank = values.isna() | (values.astype(str).str.strip() == "")
+        return pd.Categorical(values.astype(object).where(~blank))
+    if str(values.dtype) == dtype:
+        return values.array
+    numbers = pd.to_numeric(values, errors="coerce")
+    if dtype == COUNT_DTYPE:
+        return numbers.round().astype(COUNT_DTYPE).array
+    return numbers.to_numpy(dtype=PRICE_DTYPE)
+
+def typed_table(rows, index, columns):
+    """ Builds a typed chain table from rows of cell text, converting each column in one
+    vectorized step.
+
+    Args:
+        rows (list): one list of cell values per strike, in the order of columns
+        index (pandas.Index): strikes
+        columns (list): chain column names
+
+    Returns:
+        DataFrame: table indexed by strike, with the dtypes of column_dtype
+    """
+    cells = np.empty((len(rows), len(columns)), dtype=object)
+    if rows:
+        cells[:] = rows
+    return pd.DataFrame(OrderedDict((column, convert_column(cells[:, i], column))
+                                    for i, column in enumerate(columns)), index=index)
+
+def apply_schema(frame, columns=None):
+    """ Converts chain columns of a table to their dtypes, for tables that weren't built typed
+    (say read back from CSV). Columns that already have their dtype are left alone.
+
+    Args:
+        frame (DataFrame): table to convert, modified in place
+        columns (list): chain columns to convert. Default is every column.
+
+    Returns:
+        DataFrame: frame
+    """
+    for column in frame.columns if columns is None else columns:
+        dtype = column_dtype(column)
+        if dtype == TEXT_DTYPE and isinstance(frame[column].dtype, pd.CategoricalDtype):
+            continue
+        if str(frame[column].dtype) != dtype:
+            frame[column] = convert_column(frame[column].to_numpy(), column)
+    return frame
@@ -0,0 +1,448 @@
+""" Append-only segment files holding all captures of one ticker on one day.
+
+Instead of a handful of CSVs (or one snapshot file) per capture, every capture of a day is
+appended to a single file next to the columnar snapshots of store:
+
+    {root}/date=2018-03-16/ticker=spx/segment.seg
+
+Each capture is one frame: a fixed-size header, a small JSON index of the frame, and one block of
+fixed-width numpy records per expiration, sorted by strike. Prices are float32 (NaN when
+missing), volume and open interest int32 (COUNT_MISSING when missing) and option symbols fixed
+width bytes, so a block is read back with np.frombuffer, without parsing any text:
+
+    frame header    magic, capture time (epoch seconds), index length, payload length
+    index           JSON: record dtype, and per expiration its rows, codec and byte range
+    payload         the blocks
+
+Captures are appended uncompressed through the day. Closing a segment (once the day is over)
+compresses every block on its own, with zstd when the zstandard package is installed and zlib
+otherwise, so the file shrinks but a block can still be read without touching the others.
+Readers memory-map the file and only walk the frame headers, so loading one capture, or one
+expiration or strike range of it, reads and decompresses just the blocks needed, not the day.
+"""
+import os
+import json
+import mmap
+import zlib
+import struct
+import datetime
+import logging
+from collections import namedtuple, OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import catalog
+import metrics
+import schema
+import store
+
+log = logging.getLogger(__name__)
+
+SEGMENT_FILENAME = "segment.seg"
+# Catalog format of segment files, one record per file
+CATALOG_FORMAT = "segment"
+FRAME_MAGIC = b"SEGF"
+# Magic, capture time in seconds since the epoch, index length, payload length
+FRAME_HEADER = struct.Struct("<4sqIQ")
+# Count columns are int32 with this value for missing cells
+COUNT_MISSING = np.iinfo(np.int32).min
+# Block codecs: uncompressed, and what close_segment compresses blocks with
+RAW = "raw"
+ZSTD = "zstd"
+ZLIB = "zlib"
+ZSTD_LEVEL = 9
+ZLIB_LEVEL = 6
+
+# One capture in a segment: where its payload starts, its record dtype and its blocks
+Frame = namedtuple("Frame", ["captured_at", "offset", "length", "dtype", "blocks"])
+# One expiration of a capture: 'offset' is relative to the frame payload
+Block = namedtuple("Block", ["expiration", "rows", "codec", "offset", "length"])
+
+def segment_path(root, ticker, date):
+    """ Path of the segment file of one ticker on one day """
+    directory = store.SNAPSHOT_DIR_FORMAT.format(date=date, ticker=ticker.lower())
+    return os.path.join(root, directory, SEGMENT_FILENAME)
+
+def _zstd():
+    """ The zstandard module, or None if it isn't installed """
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return zstandard
+
+def compress(data, codec):
+    if codec == ZSTD:
+        return _zstd().ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    if codec == ZLIB:
+        return zlib.compress(data, ZLIB_LEVEL)
+    return data
+
+def decompress(data, codec, size):
+    """ Decompresses a block of size bytes """
+    if codec == ZSTD:
+        zstandard = _zstd()
+        if zstandard is None:
+            raise ImportError("zstandard is needed to read zstd compressed segments")
+        return zstandard.ZstdDecompressor().decompress(data, max_output_size=size)
+    if codec == ZLIB:
+        return zlib.decompress(data)
+    return data
+
+def default_codec():
+    """ Codec close_segment compresses with: zstd if available, else zlib """
+    return ZSTD if _zstd() is not None else ZLIB
+
+def _epoch(captured_at):
+    return int(np.datetime64(captured_at, "s").astype(np.int64))
+
+def _from_epoch(seconds):
+    return np.datetime64(seconds, "s").astype(datetime.datetime)
+
+def record_dtype(frame):
+    """ Fixed-width record dtype of the chain columns of a snapshot table: the strike as float64,
+    counts as int32, text as bytes as wide as the longest value and prices as float32.
+
+    Args:
+        frame (DataFrame): snapshot table, see store.chain_to_frame
+
+    Returns:
+        numpy.dtype: structured dtype
+    """
+    fields = [("strike", "<f8")]
+    for column in frame.columns[len(store.KEY_COLUMNS):]:
+        dtype = schema.column_dtype(column)
+        if dtype == schema.TEXT_DTYPE:
+            values = frame[column].astype(object)
+            width = values[values.notna()].astype(str).str.encode("utf-8").str.len().max()
+            fields.append((column, "S{}".format(int(width) if width == width else 1)))
+        elif dtype == schema.COUNT_DTYPE:
+            fields.append((column, "<i4"))
+        else:
+            fields.append((column, "<f4"))
+    return np.dtype(fields)
+
+def to_records(frame, dtype):
+    """ Converts the rows of a snapshot table to fixed-width records of dtype """
+    records = np.zeros(len(frame), dtype=dtype)
+    records["strike"] = frame["strike"].to_numpy(dtype=np.float64)
+    for column in dtype.names[1:]:
+        kind = dtype[column].kind
+        if kind == "S":
+            values = frame[column].astype(object)
+            records[column] = values.where(values.notna(), "").astype(str).str.encode(
+                "utf-8").to_numpy()
+        elif kind == "i":
+            values = pd.to_numeric(frame[column], errors="coerce").round().astype("Int32")
+            records[column] = values.fillna(COUNT_MISSING).to_numpy(dtype=np.int32)
+        else:
+            records[column] = pd.to_numeric(frame[column], errors="coerce").to_numpy(
+                dtype=np.float32, na_value=np.nan)
+    return records
+
+def from_records(records, column):
+    """ Converts one field of fixed-width records back to the chain column's dtype """
+    values = records[column]
+    if values.dtype.kind == "S":
+        return schema.convert_column(np.char.decode(values, "utf-8").astype(object), column)
+    if values.dtype.kind == "i":
+        return pd.arrays.IntegerArray(values.copy(), values == COUNT_MISSING)
+    return values.copy()
+
+def encode_frame(frame, captured_at, codec=RAW):
+    """ Encodes one capture as a segment frame
+
+    Args:
+        frame (DataFrame): snapshot table, see store.chain_to_frame
+        captured_at (datetime.datetime): capture time
+        codec (str): codec of the blocks
+
+    Returns:
+        bytes: the frame
+    """
+    dtype = record_dtype(frame)
+    expirations = frame["expiration"].astype(str)
+    blocks, payload, offset = [], [], 0
+    for expiration in pd.unique(expirations):
+        table = frame[(expirations == expiration).to_numpy()]
+        records = to_records(table, dtype)
+        records.sort(order="strike", kind="stable")
+        data = compress(records.tobytes(), codec)
+        blocks.append([expiration, len(records), codec, offset, len(data)])
+        payload.append(data)
+        offset += len(data)
+    return _pack_frame(captured_at, dtype, blocks, payload)
+
+def _pack_frame(captured_at, dtype, blocks, payload):
+    index = json.dumps({"dtype": dtype.descr, "blocks": blocks}).encode("utf-8")
+    length = sum(len(data) for data in payload)
+    return b"".join([FRAME_HEADER.pack(FRAME_MAGIC, _epoch(captured_at), len(index), length),
+                     index] + payload)
+
+def _descr(fields):
+    """ dtype from the descr stored in a frame index (lists instead of tuples) """
+    return np.dtype([tuple(field) for field in fields])
+
+def scan_frames(buffer):
+    """ Walks the frame headers of a segment.
+
+    Args:
+        buffer (bytes-like): contents of the segment, usually memory-mapped
+
+    Returns:
+        tuple: (list of Frame, end of the last complete frame). A frame cut short (by a crash
+            during an append) ends the scan.
+    """
+    frames, position, size = [], 0, len(buffer)
+    while position + FRAME_HEADER.size <= size:
+        magic, seconds, index_length, length = FRAME_HEADER.unpack_from(buffer, position)
+        start = position + FRAME_HEADER.size + index_length
+        if magic != FRAME_MAGIC or start + length > size:
+            break
+        index = json.loads(bytes(buffer[position + FRAME_HEADER.size:start]).decode("utf-8"))
+        frames.append(Frame(_from_epoch(seconds), start, length, _descr(index["dtype"]),
+                            [Block(*block) for block in index["blocks"]]))
+        position = start + length
+    if position != size:
+        log.warning("Ignoring %d bytes after the last complete capture", size - position)
+    return frames, position
+
+class Segment(object):
+    """ Memory-mapped reader of a segment file.
+
+    Args:
+        path (str): path of the segment file
+    """
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        # An empty file can't be mapped
+        self._buffer = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size \
+            else b""
+        self.frames = scan_frames(self._buffer)[0]
+        self.times = np.array([frame.captured_at for frame in self.frames],
+                              dtype="datetime64[s]")
+
+    def close(self):
+        if isinstance(self._buffer, mmap.mmap):
+            self._buffer.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return len(self.frames)
+
+    @property
+    def rows(self):
+        """ Number of rows over all captures """
+        return sum(block.rows for frame in self.frames for block in frame.blocks)
+
+    def locate(self, when):
+        """ Finds the last capture at or before a time
+
+        Returns:
+            int: position of the capture, -1 if there is none
+        """
+        return int(np.searchsorted(self.times, np.datetime64(when, "s"), side="right")) - 1
+
+    def _block_records(self, frame, block):
+        start = frame.offset + block.offset
+        if block.codec == RAW:
+            return np.frombuffer(self._buffer, dtype=frame.dtype, count=block.rows, offset=start)
+        data = decompress(self._buffer[start:start + block.length], block.codec,
+                          block.rows * frame.dtype.itemsize)
+        return np.frombuffer(data, dtype=frame.dtype, count=block.rows)
+
+    def read_frame(self, position=-1, expirations=None, strikes=None, columns=None):
+        """ Reads one capture, or part of it, as a snapshot table. Only the blocks of the
+        expirations asked for are read (and decompressed).
+
+        Args:
+            position (int): position of the capture, as for a list. Default is the last one.
+            expirations (list): only these expirations, in any form accepted by
+                catalog.expiration_key. Default is all of them.
+            strikes (tuple): only strikes in this (low, high) range, inclusive
+            columns (list): chain columns to load besides the keys. Default is all of them.
+
+        Returns:
+            DataFrame: one row per (expiration, strike), see store.chain_to_frame
+        """
+        frame = self.frames[position]
+        names = [name for name in frame.dtype.names[1:] if columns is None or name in columns]
+        wanted = None if expirations is None else \
+            set(catalog.expiration_key(expiration) for expiration in expirations)
+        keys, parts = [], []
+        with metrics.timer("read", format=CATALOG_FORMAT):
+            for block in frame.blocks:
+                if wanted is not None and catalog.expiration_key(block.expiration) not in wanted:
+                    continue
+                records = self._block_records(frame, block)
+                if strikes is not None:
+                    low = np.searchsorted(records["strike"], strikes[0], side="left")
+                    high = np.searchsorted(records["strike"], strikes[1], side="right")
+                    records = records[low:high]
+                keys.append(block.expiration)
+                parts.append(records)
+        records = np.concatenate(parts) if parts else np.zeros(0, dtype=frame.dtype)
+        table = OrderedDict([
+            ("expiration", pd.Categorical.from_codes(
+                np.repeat(np.arange(len(keys)), [len(part) for part in parts]), categories=keys)
+                if keys else pd.Categorical([])),
+            ("strike", records["strike"].copy()),
+        ])
+        for name in names:
+            table[name] = from_records(records, name)
+        return pd.DataFrame(table)
+
+    def read_chain(self, position=-1, expirations=None, strikes=None, columns=None):
+        """ Reads one capture back into one table per expiration. See read_frame. """
+        return store.frame_to_chain(self.read_frame(position, expirations, strikes, columns))
+
+def read_frame_at(path, when, columns=None):
+    """ Reads the last capture of a segment at or before a given time
+
+    Returns:
+        tuple: (captured_at, DataFrame) of the capture, or (None, None) if there is none
+    """
+    with Segment(path) as segment:
+        position = segment.locate(when)
+        if position < 0:
+            return None, None
+        return segment.frames[position].captured_at, segment.read_frame(position,
+                                                                        columns=columns)
+
+def append_capture(path, chain, captured_at=None):
+    """ Appends one capture, uncompressed, to a segment file, creating it if missing. Anything
+    after the last complete capture (left by a crash during an earlier append) is dropped first.
+
+    Args:
+        path (str): path of the segment file
+        chain (OrderedDict): expiration string -> DataFrame indexed by strike
+        captured_at (datetime.datetime): capture time. Default is now.
+
+    Returns:
+        tuple: (rows written, rows in the segment, captures in the segment)
+    """
+    captured_at = captured_at or datetime.datetime.now()
+    frame = store.chain_to_frame(chain)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with metrics.timer("write", format=CATALOG_FORMAT):
+        data = encode_frame(frame, captured_at)
+        with open(path, "ab+") as fobj:
+            frames, end = [], 0
+            if os.fstat(fobj.fileno()).st_size:
+                with mmap.mmap(fobj.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                    frames, end = scan_frames(buffer)
+            fobj.truncate(end)
+            fobj.write(data)
+    rows = sum(block.rows for existing in frames for block in existing.blocks) + len(frame)
+    return len(frame), rows, len(frames) + 1
+
+def write_segment(chain, ticker, root, captured_at=None):
+    """ Appends one capture to the day's segment of a ticker and records the segment in the
+    catalog of root.
+
+    Args:
+        chain (OrderedDict): expiration string -> DataFrame indexed by strike
+        ticker (str): ticker symbol of the option data
+        root (str): root directory of the store
+        captured_at (datetime.datetime): capture time. Default is now.
+
+    Returns:
+        str: path of the segment file
+    """
+    captured_at = captured_at or datetime.datetime.now()
+    path = segment_path(root, ticker, captured_at.date())
+    written, rows, captures = append_capture(path, chain, captured_at)
+    with catalog.Catalog(catalog.catalog_path(root)) as snapshots:
+        snapshots.add(ticker, catalog.ALL_EXPIRATIONS, path, rows, captured_at, CATALOG_FORMAT)
+    metrics.inc("segment_rows", written, ticker=ticker)
+    log.info("Appended %d rows of %s to: %s (%d captures)", written, ticker, path, captures)
+    return path
+
+def close_segment(path, codec=None):
+    """ Compresses the uncompressed blocks of a segment, block by block, and replaces the file.
+    Meant for segments of days that are over: a capture appended while it runs is lost.
+
+    Args:
+        path (str): path of the segment file
+        codec (str): ZSTD or ZLIB. Default is default_codec().
+
+    Returns:
+        tuple: (size before, size after) in bytes
+    """
+    codec = codec or default_codec()
+    before = os.path.getsize(path)
+    with Segment(path) as segment:
+        if all(block.codec != RAW for frame in segment.frames for block in frame.blocks):
+            return before, before
+        with open(path + ".tmp", "wb") as fobj:
+            for frame in segment.frames:
+                blocks, payload, offset = [], [], 0
+                for block in frame.blocks:
+                    start = frame.offset + block.offset
+                    data = segment._buffer[start:start + block.length]
+                    if block.codec == RAW:
+                        data, block = compress(data, codec), block._replace(codec=codec)
+                    blocks.append(list(block._replace(offset=offset, length=len(data))))
+                    payload.append(data)
+                    offset += len(data)
+                fobj.write(_pack_frame(frame.captured_at, frame.dtype, blocks, payload))
+    os.replace(path + ".tmp", path)
+    after = os.path.getsize(path)
+    log.info("Closed %s: %d -> %d bytes", path, before, after)
+    return before, after
+
+def close_segments(root, tickers=None, since=None, until=None, codec=None):
+    """ Closes the segments in the catalog of root over a range of days, and updates their
+    catalog records.
+
+    Args:
+        root (str): root directory of the store
+        tickers (list): only the segments of these tickers. Default is all of them.
+        since (datetime.date or str): first day to close
+        until (datetime.date or str): last day to close. Default is yesterday.
+        codec (str): see close_segment
+
+    Returns:
+        list: paths of the segments closed
+    """
+    until = until or datetime.date.today() - datetime.timedelta(days=1)
+    closed = []
+    with catalog.Catalog(catalog.catalog_path(root)) as snapshots:
+        if tickers is None:
+            tickers = [ticker for (ticker,) in snapshots.conn.execute(
+                "SELECT DISTINCT ticker FROM snapshots WHERE format = ?", (CATALOG_FORMAT,))]
+        for ticker in tickers:
+            for record in snapshots.find(ticker, since=since, until=until, fmt=CATALOG_FORMAT):
+                if not os.path.exists(record.path):
+                    continue
+                before, after = close_segment(record.path, codec)
+                if before != after:
+                    snapshots.add(ticker, catalog.ALL_EXPIRATIONS, record.path, record.rows,
+                                  datetime.datetime.fromisoformat(record.captured_at),
+                                  CATALOG_FORMAT)
+                    closed.append(record.path)
+    return closed
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Compresses the segment files of days that are over")
+    parser.add_argument("outdir", help="Output directory of options_csv")
+    parser.add_argument("--until", help="Last day to close, as YYYY-MM-DD. Default is yesterday.")
+    parser.add_argument("--codec", choices=[ZSTD, ZLIB],
+        help="Compression of the blocks. Default is zstd if installed, else zlib.")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    closed = close_segments(args.outdir, until=args.until, codec=args.codec)
+    print("Closed {} segments".format(len(closed)))
@@ -0,0 +1,158 @@
+""" Columnar snapshot store for parsed options chains.
+
+Every capture of a ticker is written as a single Parquet (or Feather/Arrow IPC) file holding all
+of its expirations in long format, one row per (expiration, strike), with numeric columns stored
+as numbers. Files are partitioned by capture date and ticker:
+
+    {root}/date=2018-03-16/ticker=spx/snapshot-153000.parquet
+
+so a reader can find a day's snapshots without listing the whole archive, and load just the
+columns it needs (say 'call_Open Int.') without parsing the rest.
+"""
+import os
+import datetime
+import logging
+from collections import OrderedDict
+
+import pandas as pd
+
+import metrics
+import schema
+
+log = logging.getLogger(__name__)
+
+# Supported file formats -> filename extension
+FORMATS = OrderedDict([
+    ("parquet", "parquet"),
+    ("feather", "feather"),
+])
+SNAPSHOT_DIR_FORMAT = os.path.join("date={date}", "ticker={ticker}")
+SNAPSHOT_FILENAME_FORMAT = "snapshot-{time}.{extension}"
+# Key columns of a snapshot file, ahead of the chain columns
+KEY_COLUMNS = ["expiration", "strike"]
+
+def chain_to_frame(chain):
+    """ Flattens a parsed chain into one long table keyed by expiration and strike, with the
+    column types of schema.py (chains read back from CSV are converted from their text form).
+
+    Args:
+        chain (OrderedDict): expiration string -> DataFrame indexed by strike
+
+    Returns:
+        DataFrame: one row per (expiration, strike) with a default index
+    """
+    if not chain:
+        return pd.DataFrame(columns=KEY_COLUMNS)
+    frame = pd.concat(list(chain.values()), keys=list(chain.keys()), names=KEY_COLUMNS, sort=False)
+    frame = frame.reset_index()
+    frame["expiration"] = pd.Categorical(frame["expiration"], categories=list(chain.keys()))
+    frame["strike"] = frame["strike"].astype("float64")
+    # Symbol categories differ between expirations, so concat leaves them as objects
+    return schema.apply_schema(frame, frame.columns[len(KEY_COLUMNS):])
+
+def frame_to_chain(frame):
+    """ Splits a snapshot table back into one table per expiration, the inverse of
+    chain_to_frame.
+
+    Args:
+        frame (DataFrame): snapshot table as returned by read_snapshot
+
+    Returns:
+        OrderedDict: expiration string -> DataFrame indexed by strike
+    """
+    chain = OrderedDict()
+    for expiration, table in frame.groupby("expiration", sort=False, observed=True):
+        chain[str(expiration)] = table.drop(columns=KEY_COLUMNS).set_index(
+            pd.Index(table["strike"].values))
+    return chain
+
+def snapshot_path(root, ticker, captured_at, fmt="parquet"):
+    """ Builds the path of a snapshot file
+
+    Args:
+        root (str): root directory of the store
+        ticker (str): ticker symbol of the option data
+        captured_at (datetime.datetime): capture time of the snapshot
+        fmt (str): file format, see FORMATS
+
+    Returns:
+        str: path of the snapshot file
+    """
+    directory = SNAPSHOT_DIR_FORMAT.format(date=captured_at.date(), ticker=ticker.lower())
+    filename = SNAPSHOT_FILENAME_FORMAT.format(
+        time=captured_at.strftime("%H%M%S"), extension=FORMATS[fmt])
+    return os.path.join(root, directory, filename)
+
+def write_snapshot(chain, ticker, root, captured_at=None, fmt="parquet"):
+    """ Writes a parsed chain to the store as a single file
+
+    Args:
+        chain (OrderedDict): expiration string -> DataFrame indexed by strike
+        ticker (str): ticker symbol of the option data
+        root (str): root directory of the store
+        captured_at (datetime.datetime): capture time of the snapshot. Default is now.
+        fmt (str): file format, see FORMATS
+
+    Returns:
+        str: path of the file written
+    """
+    captured_at = captured_at or datetime.datetime.now()
+    path = snapshot_path(root, ticker, captured_at, fmt)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    frame = chain_to_frame(chain)
+    with metrics.timer("write", format=fmt):
+        if fmt == "parquet":
+            frame.to_parquet(path, index=False)
+        else:
+            frame.to_feather(path)
+    log.info("Saved %d rows of %s to: %s", len(frame), ticker, path)
+    return path
+
+def find_snapshots(root, ticker, date):
+    """ Lists the snapshot files of one ticker on one day, oldest first
+
+    Args:
+        root (str): root directory of the store
+        ticker (str): ticker symbol of the option data
+        date (datetime.date or str): capture date
+
+    Returns:
+        list: paths of the snapshot files
+    """
+    directory = os.path.join(root, SNAPSHOT_DIR_FORMAT.format(date=date, ticker=ticker.lower()))
+    if not os.path.isdir(directory):
+        return []
+    extensions = tuple("." + extension for extension in FORMATS.values())
+    prefix = SNAPSHOT_FILENAME_FORMAT.split("{")[0]
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                  if name.startswith(prefix) and name.endswith(extensions))
+
+def read_snapshot(path, columns=None):
+    """ Reads a snapshot file, optionally only some of its columns
+
+    Args:
+        path (str): path of the snapshot file
+        columns (list): chain columns to load, e.g. ['call_Open Int.']. The key columns are
+            always loaded. Default is all columns.
+
+    Returns:
+        DataFrame: one row per (expiration, strike)
+    """
+    if columns is not None:
+        columns = KEY_COLUMNS + [column for column in columns if column not in KEY_COLUMNS]
+    if path.endswith("." + FORMATS["feather"]):
+        return pd.read_feather(path, columns=columns)
+    return pd.read_parquet(path, columns=columns)
+
+def snapshot_columns(path):
+    """ Names of the columns of a snapshot file, read from its schema without loading data """
+    if path.endswith("." + FORMATS["feather"]):
+        import pyarrow
+        with pyarrow.memory_map(path) as source:
+            return pyarrow.ipc.open_file(source).schema.names
+    import pyarrow.parquet
+    return pyarrow.parquet.read_schema(path).names
+
+def read_chain(path, columns=None):
+    """ Reads a snapshot file back into one table per expiration. See read_snapshot. """
+    return frame_to_chain(read_snapshot(path, columns))
@@ -0,0 +1,132 @@
+""" A local stand-in for MarketWatch that serves recorded options pages.
+
+Pages are read from a directory holding one '{ticker}.html' file per ticker (or a gzipped
+'{ticker}.html.gz' fixture, see fixtures.py), and served at the
+same path as the real site so that only the host of the url format needs to change, e.g.
+
+    python stub_server.py pages/ --port 8000
+    python options_csv.py --symbols spx,ndx --url-format \
+        "http://localhost:8000/investing/index/{ticker}/options"
+"""
+import os
+import re
+import gzip
+import hashlib
+import threading
+import logging
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+log = logging.getLogger(__name__)
+
+PAGE_PATH_PATTERN = re.compile(r"^/investing/index/(?P<ticker>[\w.-]+)/options/?$")
+
+class StubHandler(BaseHTTPRequestHandler):
+    """ Serves '{ticker}.html' from the server's page directory, with keep-alive. Pages carry an
+    ETag and a Last-Modified header, and conditional requests for an unchanged page get a 304. """
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.requests += 1
+        match = PAGE_PATH_PATTERN.match(self.path)
+        filename = match and os.path.join(self.server.page_dir, match.group("ticker") + ".html")
+        if filename and not os.path.isfile(filename) and os.path.isfile(filename + ".gz"):
+            filename += ".gz"
+        if self.server.failures > 0:
+            self.server.failures -= 1
+            self._send(503, b"try again")
+        elif filename and os.path.isfile(filename):
+            with (gzip.open if filename.endswith(".gz") else open)(filename, "rb") as fobj:
+                body = fobj.read()
+            mtime = os.path.getmtime(filename)
+            headers = {"ETag": '"{}"'.format(hashlib.sha1(body).hexdigest()),
+                       "Last-Modified": formatdate(mtime, usegmt=True)}
+            if self._not_modified(headers["ETag"], mtime):
+                self.server.not_modified += 1
+                self._send(304, b"", headers=headers)
+            else:
+                self._send(200, body, "text/html; charset=utf-8", headers)
+        else:
+            self._send(404, b"not found")
+
+    def _not_modified(self, etag, mtime):
+        """ Whether the request's validators match the current page """
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match is not None:
+            return etag in [tag.strip() for tag in if_none_match.split(",")]
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_modified_since is not None:
+            try:
+                return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def _send(self, status, body, content_type="text/plain", headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if status != 304:
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        log.debug(format, *args)
+
+class StubServer(ThreadingHTTPServer):
+    """ Threaded stub server for recorded pages. Usable as a context manager, in which case it
+    serves from a background thread on a free local port.
+
+    Args:
+        page_dir (str): directory holding the '{ticker}.html' pages
+        port (int): port to listen on. Default picks a free port.
+        failures (int): number of requests to answer with a 503 before serving normally, to
+            exercise retries
+    """
+    daemon_threads = True
+
+    def __init__(self, page_dir, port=0, failures=0):
+        super().__init__(("127.0.0.1", port), StubHandler)
+        self.page_dir = page_dir
+        self.failures = failures
+        self.requests = 0
+        self.not_modified = 0
+        self.connections = 0
+        self._thread = None
+
+    def process_request(self, request, client_address):
+        self.connections += 1
+        super().process_request(request, client_address)
+
+    @property
+    def url_format(self):
+        """ str: url format to pass to the fetch functions to hit this server """
+        return "http://127.0.0.1:{}/investing/index/{{ticker}}/options".format(
+            self.server_address[1])
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serves recorded MarketWatch options pages.")
+    parser.add_argument("page_dir",
+        help="Directory holding '{ticker}.html' pages or '{ticker}.html.gz' fixtures")
+    parser.add_argument("--port", type=int, default=8000, help="Port to listen on")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG)
+    server = StubServer(args.page_dir, args.port)
+    print("Serving {} at {}".format(args.page_dir, server.url_format))
+    server.serve_forever()
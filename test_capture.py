@@ -0,0 +1,108 @@
+""" End-to-end tests of the capture service against the stub server:
+
+    python -m unittest test_capture
+"""
+import os
+import shutil
+import datetime
+import tempfile
+import unittest
+
+import bench
+import capture
+import segment
+from stub_server import StubServer
+
+BAD_PAGE = b"<html><body>Service unavailable</body></html>"
+
+class CaptureDaemonTestCase(unittest.TestCase):
+    def setUp(self):
+        self.pages = tempfile.mkdtemp()
+        self.out = tempfile.mkdtemp()
+        self.good_page = bench.make_chain_page(2, 10).encode("utf-8")
+
+    def tearDown(self):
+        shutil.rmtree(self.pages)
+        shutil.rmtree(self.out)
+
+    def serve(self, page):
+        with open(os.path.join(self.pages, "spx.html"), "wb") as fobj:
+            fobj.write(page)
+
+    def daemon(self, server, fmt="csv"):
+        return capture.CaptureDaemon([capture.Schedule("spx", 60.0, None, None)], self.out,
+                                     fmt=fmt, url_format=server.url_format, backend="lxml",
+                                     retries=0)
+
+    def quarantined(self):
+        directory = os.path.join(self.out, capture.PENDING_DIRNAME, capture.QUARANTINE_DIRNAME)
+        return os.listdir(directory) if os.path.isdir(directory) else []
+
+    def saved(self):
+        return [name for name in os.listdir(self.out) if name.endswith(".csv")]
+
+    def test_bad_pending_page_does_not_block_start(self):
+        # A bad page left in the buffer by a crash, followed by a good one
+        buffer = capture.WriteAheadBuffer(os.path.join(self.out, capture.PENDING_DIRNAME))
+        buffer.put("spx", datetime.datetime(2018, 3, 16, 9, 30), BAD_PAGE)
+        buffer.put("spx", datetime.datetime(2018, 3, 16, 9, 35), self.good_page)
+        self.serve(self.good_page)
+        with StubServer(self.pages) as server:
+            with self.assertLogs("capture", "ERROR"):
+                stats = self.daemon(server).run(duration=1.0)
+        self.assertEqual(stats["failed"], 1)
+        self.assertEqual(stats["captured"], 2)
+        self.assertEqual(buffer.pending(), [])
+        self.assertEqual(len(self.quarantined()), 1)
+        self.assertTrue(self.saved())
+
+        # The bad page is not replayed on the next start
+        with StubServer(self.pages) as server:
+            self.assertEqual(self.daemon(server).recover(), 0)
+        self.assertEqual(len(self.quarantined()), 1)
+
+    def test_bad_page_is_quarantined_and_retried(self):
+        self.serve(BAD_PAGE)
+        with StubServer(self.pages) as server:
+            daemon = self.daemon(server)
+            with self.assertLogs("capture", "ERROR"):
+                self.assertFalse(daemon.capture("spx"))
+            self.assertEqual(daemon.stats["failed"], 1)
+            self.assertEqual(daemon.buffer.pending(), [])
+            self.assertEqual(len(self.quarantined()), 1)
+            self.assertFalse(self.saved())
+
+            # Not remembered as captured, so the fixed page is saved next time
+            self.serve(self.good_page)
+            self.assertTrue(daemon.capture("spx"))
+            daemon.pool.close()
+        self.assertTrue(self.saved())
+
+    def assertClosed(self, date, closed=True):
+        with segment.Segment(segment.segment_path(self.out, "spx", date)) as day:
+            codecs = {block.codec for frame in day.frames for block in frame.blocks}
+        self.assertEqual(segment.RAW not in codecs, closed)
+
+    def test_unchanged_page_after_midnight_starts_a_new_day(self):
+        day = datetime.datetime(2018, 3, 16, 23, 55)
+        self.serve(self.good_page)
+        with StubServer(self.pages) as server:
+            daemon = self.daemon(server, "segment")
+            self.assertTrue(daemon.capture("spx", day))
+            self.assertFalse(daemon.capture("spx", day + datetime.timedelta(minutes=1)))
+            self.assertTrue(daemon.capture("spx", day + datetime.timedelta(minutes=10)))
+            daemon.pool.close()
+        self.assertClosed(day.date())
+        self.assertClosed(day.date() + datetime.timedelta(days=1), closed=False)
+
+        # A restart closes the days the previous run left open
+        with StubServer(self.pages) as server:
+            daemon = self.daemon(server, "segment")
+            self.assertTrue(daemon.capture("spx", day + datetime.timedelta(days=2)))
+            daemon.pool.close()
+        self.assertClosed(day.date() + datetime.timedelta(days=1))
+        self.assertClosed(day.date() + datetime.timedelta(days=2), closed=False)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+""" Tests of the snapshot catalog:
+
+    python -m unittest test_catalog
+"""
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+import bench
+import catalog
+import options_csv
+import store
+
+CAPTURED_AT = datetime.datetime(2018, 3, 16, 15, 30)
+
+class CatalogTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.chain = options_csv.parse_chain(bench.make_chain_page(2, 10), "lxml")
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def write(self, ticker, captured_at):
+        path = store.write_snapshot(self.chain, ticker, self.root, captured_at)
+        catalog.record_chain_files(self.root, ticker, path, self.chain, captured_at)
+        return path
+
+    def test_expiration_key(self):
+        for expiration in ["March 16, 2018", "March-16-2018", "Mar 16, 2018",
+                           datetime.date(2018, 3, 16)]:
+            self.assertEqual(catalog.expiration_key(expiration), "2018-03-16")
+        self.assertEqual(catalog.expiration_key("weekly"), "weekly")
+
+    def test_find(self):
+        days = [CAPTURED_AT + datetime.timedelta(days=n) for n in range(3)]
+        paths = [self.write("spx", day) for day in days]
+        self.write("ndx", CAPTURED_AT)
+        written = options_csv.write_chain(self.chain, "spx", self.root)
+        catalog.record_chain_files(self.root, "spx", written, self.chain, days[1])
+
+        with catalog.Catalog(catalog.catalog_path(self.root)) as snapshots:
+            found = snapshots.find("SPX", fmt="parquet")
+            self.assertEqual([record.path for record in found], paths)
+            self.assertEqual(found[0].rows, 20)
+            self.assertEqual(found[0].captured_at, "2018-03-16T15:30:00")
+            self.assertEqual(len(snapshots.find("spx", capture_date=days[1].date())), 3)
+            self.assertEqual(len(snapshots.find("spx", since=days[1].date(),
+                                                until=days[1].date(), fmt="csv")), 2)
+            # Whole-chain snapshots hold every expiration
+            found = snapshots.find("spx", expiration="March 23, 2018")
+            self.assertEqual([record.expiration for record in found],
+                             ["", "", "2018-03-23", ""])
+            self.assertEqual(len(snapshots.find("rut")), 0)
+
+    def test_archive_can_move_and_prune(self):
+        path = self.write("spx", CAPTURED_AT)
+        parent = tempfile.mkdtemp()
+        moved = os.path.join(parent, "archive")
+        shutil.move(self.root, moved)
+        moved_path = os.path.join(moved, os.path.relpath(path, self.root))
+        self.root = parent
+        with catalog.Catalog(catalog.catalog_path(moved)) as snapshots:
+            found = snapshots.find("spx")
+            self.assertEqual([record.path for record in found], [moved_path])
+            self.assertTrue(os.path.exists(moved_path))
+            os.remove(found[0].path)
+            self.assertEqual(snapshots.prune(), 1)
+            self.assertEqual(snapshots.find("spx"), [])
+
+    def test_index_directory(self):
+        """ Files written without a catalog are found by indexing the directory """
+        path = store.write_snapshot(self.chain, "spx", self.root, CAPTURED_AT)
+        written = options_csv.write_chain(self.chain, "ndx", self.root)
+        self.assertEqual(catalog.index_directory(self.root), 1 + len(written))
+        with catalog.Catalog(catalog.catalog_path(self.root)) as snapshots:
+            found = snapshots.find("spx")
+            self.assertEqual([(record.path, record.captured_at, record.rows) for record in found],
+                             [(path, "2018-03-16T15:30:00", 20)])
+            self.assertEqual(sorted(record.path for record in snapshots.find("ndx")),
+                             sorted(written.values()))
+
+
+if __name__ == "__main__":
+    unittest.main()
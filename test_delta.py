@@ -0,0 +1,82 @@
+""" Round-trip tests of delta captures:
+
+    python -m unittest test_delta
+"""
+import datetime
+import shutil
+import tempfile
+import unittest
+from collections import OrderedDict
+
+import pandas as pd
+
+import bench
+import delta
+import options_csv
+import store
+
+START = datetime.datetime(2018, 3, 16, 9, 30)
+
+def make_chain(n_strikes=10, dropped=None, spot=2700.0):
+    page = bench.make_chain_page(2, n_strikes, spot=spot, dropped=dropped)
+    return options_csv.parse_chain(page, "lxml")
+
+def edited(chain, expiration, strike, column, value):
+    chain = OrderedDict((key, table.copy()) for key, table in chain.items())
+    chain[expiration].loc[strike, column] = value
+    return chain
+
+class DeltaTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def captures(self):
+        """ Successive chains: a first one, a changed quote, a strike added and one removed,
+        a column dropped, then a column added back """
+        first = make_chain()
+        expiration = list(first)[0]
+        changed = edited(first, expiration, 2700.0, "call_Bid", 9.5)
+        moved = OrderedDict((key, table.iloc[1:]) for key, table in make_chain(11).items())
+        dropped = make_chain(11, dropped={0: ["Change"], 1: ["Change"]})
+        return [first, changed, moved, dropped, make_chain(11)]
+
+    def test_diff_and_apply_round_trip(self):
+        chains = self.captures()
+        for previous, current in zip(chains, chains[1:]):
+            previous, current = store.chain_to_frame(previous), store.chain_to_frame(current)
+            changes = delta.diff_frames(previous, current)
+            pd.testing.assert_frame_equal(delta.apply_delta(previous, changes), current)
+
+    def test_only_changed_rows_are_written(self):
+        first, changed = self.captures()[:2]
+        changes = delta.diff_frames(store.chain_to_frame(first), store.chain_to_frame(changed))
+        self.assertEqual(len(changes), 1)
+        self.assertEqual(changes["strike"].tolist(), [2700.0])
+        self.assertFalse(changes[delta.REMOVED_COLUMN].any())
+
+        shorter = OrderedDict((key, table.iloc[1:]) for key, table in first.items())
+        changes = delta.diff_frames(store.chain_to_frame(first), store.chain_to_frame(shorter))
+        self.assertEqual(len(changes), len(first))
+        self.assertTrue(changes[delta.REMOVED_COLUMN].all())
+
+    def test_captures_rebuilt_from_disk(self):
+        chains = self.captures()
+        times = [START + datetime.timedelta(minutes=5 * i) for i in range(len(chains))]
+        for chain, captured_at in zip(chains, times):
+            # A fresh writer per capture, as in a cron run
+            delta.write_delta(chain, "spx", self.root, captured_at)
+        kinds = [kind for _, kind, _ in delta.find_captures(self.root, "spx", START.date())]
+        self.assertEqual(kinds, [delta.KEYFRAME_PREFIX] + [delta.DELTA_PREFIX] * 4)
+        for chain, captured_at in zip(chains, times):
+            captured, frame = delta.read_frame_at(self.root, "spx", captured_at)
+            self.assertEqual(captured, captured_at)
+            # Symbols read back from disk have string categories
+            pd.testing.assert_frame_equal(frame, store.chain_to_frame(chain),
+                                          check_categorical=False)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+""" Tests of the vectorized implied volatility and Greeks against the scalar reference of bench:
+
+    python -m unittest test_greeks
+"""
+import datetime
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import bench
+import greeks
+import options_csv
+import store
+
+SPOT, RATE, DIV = 2700.0, 0.02, 0.01
+
+class GreeksTestCase(unittest.TestCase):
+    def setUp(self):
+        self.price, self.is_call, self.strike, self.t, self.vol = bench.make_contracts(
+            200, SPOT, RATE, DIV, seed=1)
+
+    def scalar_price(self, spot=SPOT, vol=None):
+        vol = self.vol if vol is None else vol
+        return np.array([bench._scalar_price(c, spot, k, t, v, RATE, DIV)
+                         for c, k, t, v in zip(self.is_call, self.strike, self.t, vol)])
+
+    def test_implied_vol_round_trip(self):
+        """ The solver recovers the volatilities the contracts were priced with, like the scalar
+        bisection does """
+        identified = greeks.bs_vega(SPOT, self.strike, self.t, self.vol, RATE, DIV) > 1e-2
+        iv = greeks.implied_vol(self.price, self.is_call, SPOT, self.strike, self.t, RATE, DIV)
+        np.testing.assert_allclose(iv[identified], self.vol[identified], atol=1e-6)
+        scalar_iv = np.array([bench.scalar_implied_vol(p, c, SPOT, k, t, RATE, DIV)
+                              for p, c, k, t in zip(self.price[:20], self.is_call[:20],
+                                                    self.strike[:20], self.t[:20])])
+        np.testing.assert_allclose(iv[:20][identified[:20]], scalar_iv[identified[:20]],
+                                   atol=1e-6)
+
+    def test_delta_and_vega_match_the_scalar_prices(self):
+        """ Delta and vega are the slopes of the scalar reference price in spot and volatility """
+        values = greeks.greeks(self.is_call, SPOT, self.strike, self.t, self.vol, RATE, DIV)
+        h = 1e-5
+        delta = (self.scalar_price(SPOT + h) - self.scalar_price(SPOT - h)) / (2 * h)
+        np.testing.assert_allclose(values["Delta"], delta, atol=1e-5)
+        # Vega is per volatility point
+        vega = (self.scalar_price(vol=self.vol + h) - self.scalar_price(vol=self.vol - h)) / \
+            (2 * h) / 100.0
+        np.testing.assert_allclose(values["Vega"], vega, rtol=1e-5, atol=1e-6)
+
+
+class SaveGreeksTestCase(unittest.TestCase):
+    def setUp(self):
+        self.out = tempfile.mkdtemp()
+        self.chain = options_csv.parse_chain(bench.make_chain_page(2, 10), "lxml")
+
+    def tearDown(self):
+        shutil.rmtree(self.out)
+
+    def test_save_chain_with_greeks(self):
+        captured_at = datetime.datetime(2018, 3, 16, 10)
+        path = options_csv.save_chain(self.chain, "spx", self.out, "parquet", captured_at,
+                                      with_greeks=True)
+        frame = store.read_snapshot(path)
+        for otype in ["call", "put"]:
+            for header in greeks.GREEK_HEADERS:
+                self.assertIn("{}_{}".format(otype, header), frame.columns)
+        self.assertTrue(np.isfinite(frame["call_IV"]).any())
+
+        written = options_csv.save_chain(self.chain, "spx", self.out, "csv", captured_at)
+        self.assertNotIn("call_IV", open(next(iter(written.values()))).readline())
+
+
+if __name__ == "__main__":
+    unittest.main()
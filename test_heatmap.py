@@ -0,0 +1,38 @@
+""" Smoke tests of the offline heatmap charts:
+
+    python -m unittest test_heatmap
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+import heatmap
+
+class HeatmapTestCase(unittest.TestCase):
+    def setUp(self):
+        self.out = tempfile.mkdtemp()
+        self.openInt_df = pd.DataFrame([[0, 10, 1000], [np.nan, 50000, 3]],
+                                       index=[2600.0, 2650.0],
+                                       columns=["March 23, 2018", "April 20, 2018",
+                                                "June 15, 2018"])
+
+    def tearDown(self):
+        shutil.rmtree(self.out)
+
+    def test_build_heatmap_renders_offline(self):
+        filename = os.path.join(self.out, "heatmap.html")
+        heatmap.build_heatmap(self.openInt_df, filename)
+        self.assertGreater(os.path.getsize(filename), 0)
+
+    def test_render_colorscales(self):
+        written = heatmap.render_colorscales([(self.openInt_df, "spx_call_Open_Int")], self.out)
+        self.assertEqual(len(written), 1)
+        self.assertTrue(all(os.path.exists(filename) for filename in written))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,114 @@
+""" Tests of the options page parser:
+
+    python -m unittest test_options_csv
+"""
+import os
+import re
+import shutil
+import tempfile
+import unittest
+
+import pandas as pd
+
+import bench
+import catalog
+import options_csv
+import store
+
+# Blocks laid out differently from the first one
+DROPPED = {1: ["Vol", "Symbol"], 3: ["Change"]}
+
+class ParseChainTestCase(unittest.TestCase):
+    def test_underlying_from_stock_price_row(self):
+        for backend in options_csv.EXTRACTORS:
+            chain = options_csv.parse_chain(bench.make_chain_page(2, 6, spot=2702.5), backend)
+            for table in chain.values():
+                self.assertEqual(table[options_csv.UNDERLYING_COLUMN].tolist(), [2702.5] * 6)
+        # A block without its stock price row has no underlying price
+        page = re.sub(r'<tr class="chainrow stockprice">.*?</tr>', "",
+                      bench.make_chain_page(1, 6))
+        chain = options_csv.parse_chain(page, "lxml")
+        self.assertTrue(next(iter(chain.values()))[options_csv.UNDERLYING_COLUMN].isna().all())
+
+
+class BackendTestCase(unittest.TestCase):
+    def test_backends_agree(self):
+        """ Every extraction backend builds the tables of the soup backend """
+        for page in [bench.make_chain_page(3, 20),
+                     bench.make_chain_page(4, 12, dropped=DROPPED),
+                     bench.make_chain_page(4, 12, dropped=DROPPED, header_first=True)]:
+            bench.check_backends(page)
+            bench.check_backends(page.encode("utf-8"))
+
+    def test_calls_and_puts_either_side_of_the_price(self):
+        """ The in-the-money cells are the calls' below the stock price row and the puts'
+        above it """
+        for backend in options_csv.EXTRACTORS:
+            table = options_csv.parse_chain(bench.make_chain_page(1, 10), backend)[
+                "March 16, 2018"]
+            self.assertEqual(table.loc[2690.0, "call_Symbol"], "SPX0C2690")
+            self.assertEqual(table.loc[2710.0, "call_Symbol"], "SPX0C2710")
+            self.assertEqual(table.loc[2710.0, "put_Symbol"], "SPX0P2710")
+            self.assertAlmostEqual(table.loc[2710.0, "put_Bid"], 7.25)
+            self.assertEqual(table.loc[2710.0, "put_Open Int."], 7000)
+
+
+class ParallelParseTestCase(unittest.TestCase):
+    def setUp(self):
+        self.out = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.out)
+
+    def assertChainsEqual(self, chain, expected):
+        self.assertEqual(list(chain), list(expected))
+        for expiration, table in expected.items():
+            pd.testing.assert_frame_equal(chain[expiration], table)
+
+    def test_mixed_layouts_parse_the_same_in_parallel(self):
+        """ Each expiration chunk is read with the header row of its own block, wherever that
+        row sits """
+        for header_first in [False, True]:
+            page = bench.make_chain_page(4, 12, dropped=DROPPED, header_first=header_first)
+            serial = options_csv.parse_chain(page, "lxml")
+            # Call and put halves of six headers, and the underlying
+            self.assertEqual(len(serial["April 06, 2018"].columns), 13)
+            self.assertNotIn("call_Vol", serial["March 23, 2018"].columns)
+            parallel = options_csv.parse_options_parallel(page, "spx", "lxml", 2, self.out,
+                                                          "parquet")
+            self.assertChainsEqual(parallel, serial)
+
+    def test_parallel_saves_what_serial_saves(self):
+        page = bench.make_chain_page(4, 12, dropped=DROPPED)
+        for fmt in ["csv", "parquet"]:
+            serial_out, parallel_out = [os.path.join(self.out, fmt, name)
+                                        for name in ["serial", "parallel"]]
+            options_csv.parse_options(page, "spx", "lxml", serial_out, fmt)
+            options_csv.parse_options_parallel(page, "spx", "lxml", 2, parallel_out, fmt)
+            if fmt == "csv":
+                self.assertEqual(sorted(os.listdir(parallel_out)), sorted(os.listdir(serial_out)))
+                for name in os.listdir(serial_out):
+                    if name.endswith(".csv"):
+                        with open(os.path.join(serial_out, name)) as serial, \
+                                open(os.path.join(parallel_out, name)) as parallel:
+                            self.assertEqual(parallel.read(), serial.read(), name)
+            with catalog.Catalog(catalog.catalog_path(serial_out)) as serial, \
+                    catalog.Catalog(catalog.catalog_path(parallel_out)) as parallel:
+                self.assertEqual(
+                    [(record.expiration, record.rows) for record in parallel.find("spx")],
+                    [(record.expiration, record.rows) for record in serial.find("spx")])
+                if fmt != "csv":
+                    pd.testing.assert_frame_equal(
+                        store.read_snapshot(parallel.find("spx")[-1].path),
+                        store.read_snapshot(serial.find("spx")[-1].path))
+
+    def test_split_sections_carry_their_header(self):
+        page = bench.make_chain_page(4, 3, dropped=DROPPED, header_first=True)
+        whole = options_csv.parse_chain(page, "soup")
+        for expiration, chunk in options_csv.split_sections(page).items():
+            self.assertChainsEqual(options_csv.parse_chain(chunk, "soup"),
+                                   {expiration: whole[expiration]})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+""" Tests of the parse cache:
+
+    python -m unittest test_parse_cache
+"""
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+import bench
+import options_csv
+import parse_cache
+
+class ParseCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.cache = parse_cache.ParseCache(os.path.join(self.dir, "cache"))
+        self.out = os.path.join(self.dir, "out")
+        self.page = bench.make_chain_page(2, 10)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_cache_key(self):
+        key = parse_cache.cache_key(self.page, "lxml")
+        self.assertEqual(parse_cache.cache_key(self.page.encode("utf-8"), "lxml"), key)
+        self.assertNotEqual(parse_cache.cache_key(self.page, "soup"), key)
+        self.assertNotEqual(parse_cache.cache_key(self.page, "lxml", version=0), key)
+        self.assertNotEqual(parse_cache.cache_key(self.page + " ", "lxml"), key)
+
+    def test_destination_is_dated(self):
+        day = datetime.date(2018, 3, 16)
+        self.assertNotEqual(parse_cache.destination(self.out, "csv", day),
+                            parse_cache.destination(self.out, "csv", day.replace(day=17)))
+        self.assertEqual(parse_cache.destination(self.out, "csv"),
+                         parse_cache.destination(self.out, "csv", datetime.date.today()))
+
+    def test_round_trip_and_unreadable_entry(self):
+        chain = options_csv.parse_chain(self.page, "lxml")
+        key = parse_cache.cache_key(self.page, "lxml")
+        self.assertIsNone(self.cache.get(key))
+        self.cache.put(key, chain)
+        cached = self.cache.get(key)
+        self.assertEqual(list(cached), list(chain))
+        for expiration, table in chain.items():
+            pd.testing.assert_frame_equal(cached[expiration], table)
+
+        with open(self.cache.path(key), "wb") as fobj:
+            fobj.write(b"not a chain")
+        with self.assertLogs("parse_cache", "WARNING"):
+            self.assertIsNone(self.cache.get(key))
+        self.assertNotIn(key, self.cache)
+
+    def test_least_recently_used_evicted(self):
+        cache = parse_cache.ParseCache(os.path.join(self.dir, "small"), max_entries=2)
+        for n, key in enumerate(["a", "b"]):
+            cache.put(key, {})
+            os.utime(cache.path(key), (n, n))
+        cache.mark_saved("spx", "here", "a")
+        # Reading "a" makes "b" the least recently used
+        cache.get("a")
+        cache.put("c", {})
+        self.assertEqual([key in cache for key in "abc"], [True, False, True])
+        self.assertEqual(cache.last_saved("spx", "here"), "a")
+
+    def test_unchanged_page_neither_parsed_nor_saved(self):
+        options_csv.parse_options(self.page, "spx", "lxml", self.out, "parquet", self.cache)
+        saved = sorted(os.listdir(self.out))
+        with mock.patch.object(options_csv, "parse_chain", side_effect=AssertionError), \
+                mock.patch.object(options_csv, "save_chain", side_effect=AssertionError):
+            chain = options_csv.parse_options(self.page, "spx", "lxml", self.out, "parquet",
+                                              self.cache)
+        self.assertEqual(list(chain), ["March 16, 2018", "March 23, 2018"])
+        self.assertEqual(sorted(os.listdir(self.out)), saved)
+
+        # A cached page is still saved to another destination, without parsing it again
+        with mock.patch.object(options_csv, "parse_chain", side_effect=AssertionError):
+            options_csv.parse_options(self.page, "spx", "lxml", self.out, "csv", self.cache)
+        self.assertTrue(any(name.endswith(".csv") for name in os.listdir(self.out)))
+
+
+if __name__ == "__main__":
+    unittest.main()
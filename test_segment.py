@@ -0,0 +1,96 @@
+""" Round-trip tests of segment files:
+
+    python -m unittest test_segment
+"""
+import datetime
+import shutil
+import tempfile
+import unittest
+from collections import OrderedDict
+
+import pandas as pd
+
+import bench
+import options_csv
+import segment
+import store
+
+START = datetime.datetime(2018, 3, 16, 9, 30)
+
+def make_chain(n_strikes=10, dropped=None):
+    return options_csv.parse_chain(bench.make_chain_page(2, n_strikes, dropped=dropped), "lxml")
+
+class SegmentTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.path = segment.segment_path(self.root, "spx", START.date())
+        # A first capture, a changed quote, a strike added and one removed, a column dropped,
+        # then a column added back
+        first = make_chain()
+        changed = OrderedDict((key, table.copy()) for key, table in first.items())
+        changed[list(changed)[0]].loc[2700.0, "call_Bid"] = 9.5
+        moved = OrderedDict((key, table.iloc[1:]) for key, table in make_chain(11).items())
+        dropped = make_chain(11, dropped={0: ["Change"], 1: ["Change"]})
+        self.chains = [first, changed, moved, dropped, make_chain(11)]
+        self.times = [START + datetime.timedelta(minutes=5 * i) for i in range(len(self.chains))]
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def write_all(self):
+        for chain, captured_at in zip(self.chains, self.times):
+            self.assertEqual(segment.write_segment(chain, "spx", self.root, captured_at),
+                             self.path)
+
+    def assertCapturesEqual(self):
+        with segment.Segment(self.path) as captures:
+            self.assertEqual(len(captures), len(self.chains))
+            for position, chain in enumerate(self.chains):
+                self.assertEqual(captures.frames[position].captured_at, self.times[position])
+                pd.testing.assert_frame_equal(captures.read_frame(position),
+                                              store.chain_to_frame(chain),
+                                              check_categorical=False)
+
+    def test_captures_round_trip_before_and_after_closing(self):
+        self.write_all()
+        self.assertCapturesEqual()
+        before, after = segment.close_segment(self.path, segment.ZLIB)
+        self.assertLess(after, before)
+        self.assertCapturesEqual()
+        # Closing again leaves the file alone
+        self.assertEqual(segment.close_segment(self.path, segment.ZLIB), (after, after))
+
+    def test_partial_reads(self):
+        self.write_all()
+        with segment.Segment(self.path) as captures:
+            frame = captures.read_frame(0, expirations=["2018-03-23"], strikes=(2690.0, 2700.0),
+                                        columns=["call_Bid"])
+        self.assertEqual(list(frame.columns), store.KEY_COLUMNS + ["call_Bid"])
+        self.assertEqual(frame["expiration"].astype(str).unique().tolist(), ["March 23, 2018"])
+        self.assertEqual(frame["strike"].tolist(), [2690.0, 2695.0, 2700.0])
+
+        when = self.times[1] + datetime.timedelta(minutes=1)
+        captured_at, frame = segment.read_frame_at(self.path, when)
+        self.assertEqual(captured_at, self.times[1])
+        self.assertEqual(frame.loc[frame["strike"] == 2700.0, "call_Bid"].iloc[0], 9.5)
+        self.assertEqual(segment.read_frame_at(self.path, START - datetime.timedelta(1)),
+                         (None, None))
+
+    def test_torn_tail_dropped_on_append(self):
+        segment.append_capture(self.path, self.chains[0], self.times[0])
+        with open(self.path, "ab") as fobj:
+            fobj.write(segment.FRAME_MAGIC + b"\0" * 7)
+        written, rows, captures = segment.append_capture(self.path, self.chains[1], self.times[1])
+        self.assertEqual((written, rows, captures), (20, 40, 2))
+        with segment.Segment(self.path) as segment_file:
+            self.assertEqual(len(segment_file), 2)
+
+    def test_close_segments_updates_the_catalog(self):
+        self.write_all()
+        closed = segment.close_segments(self.root, until=START.date(), codec=segment.ZLIB)
+        self.assertEqual(closed, [self.path])
+        self.assertEqual(segment.close_segments(self.root, until=START.date()), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+""" Round-trip tests of the columnar snapshot store:
+
+    python -m unittest test_store
+"""
+import datetime
+import shutil
+import tempfile
+import unittest
+
+import pandas as pd
+
+import bench
+import options_csv
+import schema
+import store
+
+CAPTURED_AT = datetime.datetime(2018, 3, 16, 15, 30)
+
+class StoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.chain = options_csv.parse_chain(bench.make_chain_page(3, 10, dropped={1: ["Vol"]}),
+                                             "lxml")
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def assertChainsEqual(self, chain, expected):
+        self.assertEqual(list(chain), list(expected))
+        for expiration, table in expected.items():
+            # Columns a block doesn't have are missing from its rows of the long table
+            table = table.reindex(columns=chain[expiration].columns)
+            pd.testing.assert_frame_equal(chain[expiration], table, check_dtype=False,
+                                          check_categorical=False)
+            for column, dtype in chain[expiration].dtypes.items():
+                self.assertEqual(str(dtype), schema.column_dtype(column), column)
+
+    def test_frame_round_trip(self):
+        frame = store.chain_to_frame(self.chain)
+        self.assertEqual(list(frame.columns[:2]), store.KEY_COLUMNS)
+        self.assertEqual(len(frame), 30)
+        self.assertChainsEqual(store.frame_to_chain(frame), self.chain)
+
+    def test_snapshot_round_trip(self):
+        for fmt in store.FORMATS:
+            path = store.write_snapshot(self.chain, "SPX", self.root, CAPTURED_AT, fmt)
+            self.assertEqual(path, store.snapshot_path(self.root, "spx", CAPTURED_AT, fmt))
+            self.assertChainsEqual(store.read_chain(path), self.chain)
+            self.assertIn("call_Vol", store.snapshot_columns(path))
+
+            partial = store.read_snapshot(path, columns=["call_Open Int."])
+            self.assertEqual(list(partial.columns), store.KEY_COLUMNS + ["call_Open Int."])
+            self.assertEqual(partial["call_Open Int."].dtype, "Int32")
+
+    def test_find_snapshots(self):
+        later = CAPTURED_AT + datetime.timedelta(minutes=5)
+        paths = [store.write_snapshot(self.chain, "spx", self.root, when)
+                 for when in [later, CAPTURED_AT]]
+        self.assertEqual(store.find_snapshots(self.root, "SPX", CAPTURED_AT.date()),
+                         sorted(paths))
+        self.assertEqual(store.find_snapshots(self.root, "ndx", CAPTURED_AT.date()), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
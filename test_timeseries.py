@@ -0,0 +1,69 @@
+""" Tests of the open interest history builder:
+
+    python -m unittest test_timeseries
+"""
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+import bench
+import options_csv
+import timeseries
+
+DAY = datetime.datetime(2018, 3, 16, 15, 30)
+
+class TimeSeriesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.out = tempfile.mkdtemp()
+        self.root = os.path.join(self.out, "timeseries")
+
+    def tearDown(self):
+        shutil.rmtree(self.out)
+
+    def capture(self, captured_at, n_strikes=10, fmt="parquet"):
+        chain = options_csv.parse_chain(bench.make_chain_page(2, n_strikes), "lxml")
+        options_csv.save_chain(chain, "spx", self.out, fmt, captured_at)
+
+    def test_build_and_read(self):
+        self.capture(DAY)
+        self.capture(DAY + datetime.timedelta(days=1), fmt="segment")
+        written = timeseries.build_series(self.out, "spx")
+        self.assertEqual(len(written), 2)
+        self.assertEqual(timeseries.series_dates(self.root, "spx"), ["2018-03-16", "2018-03-17"])
+
+        series = timeseries.read_series(self.root, "spx")
+        self.assertEqual(list(series.columns), timeseries.SERIES_COLUMNS)
+        self.assertEqual(len(series), 2 * 2 * 10)
+        # Open interest of strike row s of expiration e is s * 1000 + e, see bench
+        row = series[(series["strike"] == 2700.0) & (series["date"] == "2018-03-17")]
+        self.assertEqual(row["expiration"].dt.strftime("%Y-%m-%d").tolist(),
+                         ["2018-03-16", "2018-03-23"])
+        self.assertEqual(row["call_oi"].tolist(), [5000, 5001])
+        self.assertEqual(str(series["call_oi"].dtype).lower(), "int32")
+
+        part = timeseries.read_series(self.root, "spx", expiration="March 23, 2018",
+                                      strikes=(2690.0, 2700.0), since="2018-03-17",
+                                      columns=["put_oi"])
+        self.assertEqual(list(part.columns), timeseries.SERIES_COLUMNS[:3] + ["put_oi"])
+        self.assertEqual(part["strike"].tolist(), [2690.0, 2695.0, 2700.0])
+        self.assertEqual(timeseries.strike_history(series).shape, (2, 20))
+
+    def test_rerun_adds_new_days_and_rebuilds_the_latest(self):
+        self.capture(DAY)
+        self.capture(DAY + datetime.timedelta(days=1))
+        timeseries.build_series(self.out, "spx")
+
+        # Captured again later that day, then the next day
+        self.capture(DAY + datetime.timedelta(days=1, hours=1), n_strikes=12)
+        self.capture(DAY + datetime.timedelta(days=2))
+        written = timeseries.build_series(self.out, "spx")
+        self.assertEqual([os.path.basename(path) for path in written],
+                         ["date=2018-03-17.parquet", "date=2018-03-18.parquet"])
+        series = timeseries.read_series(self.root, "spx", since="2018-03-17", until="2018-03-17")
+        self.assertEqual(len(series), 2 * 12)
+
+
+if __name__ == "__main__":
+    unittest.main()
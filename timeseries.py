@@ -0,0 +1,244 @@
+""" Open interest and volume history per (ticker, expiration, strike).
+
+Builds a compact time series store out of the snapshot archive, one day at a time: the catalog
+is walked in date order, the last capture of each day is loaded (only the open interest and
+volume columns), and that day is appended to the store as its own Parquet file:
+
+    {root}/ticker=spx/date=2018-03-16.parquet
+
+Only one day is held in memory at any time, so memory stays flat however long the history is.
+Days already in the store are skipped, except the latest one, which is rebuilt: it may have been
+stored during the session, before its last capture. So rerunning after new captures arrive only
+adds the new days and refreshes the last one. Rows hold the capture date, the expiration (as a
+date), the strike and typed counts:
+
+    date, expiration, strike (float32), call_oi, put_oi, call_vol, put_vol (int32, nullable)
+
+read_series loads a slice back (one expiration, a strike range, a date range) with the filters
+pushed down to the Parquet reader, so a query reads only the row groups it needs.
+"""
+import os
+import datetime
+import logging
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import catalog
+import store
+
+log = logging.getLogger(__name__)
+
+SERIES_DIR_FORMAT = "ticker={ticker}"
+SERIES_FILENAME_FORMAT = "date={date}.parquet"
+# Series column -> chain column it is taken from
+SERIES_FIELDS = OrderedDict([
+    ("call_oi", "call_Open Int."),
+    ("put_oi", "put_Open Int."),
+    ("call_vol", "call_Vol"),
+    ("put_vol", "put_Vol"),
+])
+SERIES_COLUMNS = ["date", "expiration", "strike"] + list(SERIES_FIELDS)
+
+def series_path(root, ticker, date):
+    """ Path of the series file of one ticker on one day """
+    return os.path.join(root, SERIES_DIR_FORMAT.format(ticker=ticker.lower()),
+                        SERIES_FILENAME_FORMAT.format(date=date))
+
+def series_dates(root, ticker):
+    """ Lists the days already in the store for a ticker
+
+    Returns:
+        list: ISO dates, oldest first
+    """
+    directory = os.path.join(root, SERIES_DIR_FORMAT.format(ticker=ticker.lower()))
+    if not os.path.isdir(directory):
+        return []
+    prefix, suffix = SERIES_FILENAME_FORMAT.split("{date}")
+    return sorted(name[len(prefix):-len(suffix)] for name in os.listdir(directory)
+                  if name.startswith(prefix) and name.endswith(suffix))
+
+def daily_captures(snapshots):
+    """ Picks the files holding the last capture of each day out of catalog records.
+
+    Args:
+        snapshots (list): catalog.Snapshot records of one ticker, oldest first
+
+    Returns:
+        OrderedDict: capture date -> list of Snapshot records making up that day's last
+            capture, in date order
+    """
+    days = OrderedDict()
+    for snapshot in snapshots:
+        days.setdefault(snapshot.capture_date, []).append(snapshot)
+    for date, records in days.items():
+        whole = [record for record in records if record.expiration == catalog.ALL_EXPIRATIONS]
+        if whole:
+            # A columnar snapshot, delta capture or segment holds every expiration
+            days[date] = [whole[-1]]
+        else:
+            # One CSV per expiration: later captures of an expiration replace earlier ones
+            days[date] = list(OrderedDict(
+                (record.expiration, record) for record in records).values())
+    return days
+
+def load_day(records, ticker, outdir):
+    """ Loads the open interest and volume columns of one day's capture.
+
+    Args:
+        records (list): Snapshot records of the capture, see daily_captures
+        ticker (str): ticker symbol of the option data
+        outdir (str): output directory of options_csv holding the files
+
+    Returns:
+        DataFrame: snapshot table with 'expiration', 'strike' and the SERIES_FIELDS columns
+            that the capture has
+    """
+    fields = list(SERIES_FIELDS.values())
+    first = records[0]
+    if first.format == "delta":
+        import delta
+        when = datetime.datetime.fromisoformat(first.captured_at)
+        return delta.read_frame_at(outdir, ticker, when)[1]
+    if first.format == "segment":
+        import segment
+        with segment.Segment(first.path) as captures:
+            return captures.read_frame(columns=fields) if len(captures) else None
+    if first.expiration == catalog.ALL_EXPIRATIONS:
+        frame = store.read_snapshot(first.path)
+        return frame[store.KEY_COLUMNS + [field for field in fields if field in frame.columns]]
+
+    tables = OrderedDict()
+    for record in records:
+        # The strike index is the unnamed first column
+        tables[record.expiration] = pd.read_csv(
+            record.path, index_col=0,
+            usecols=lambda column: column in fields or column.startswith("Unnamed"))
+    return store.chain_to_frame(tables)
+
+def to_series(frame, date):
+    """ Converts one day's snapshot table to series rows with compact types
+
+    Args:
+        frame (DataFrame): snapshot table, see load_day
+        date (str): ISO capture date
+
+    Returns:
+        DataFrame: rows with the SERIES_COLUMNS
+    """
+    series = pd.DataFrame({
+        "date": np.full(len(frame), np.datetime64(date, "s")),
+        "expiration": pd.to_datetime(
+            frame["expiration"].astype(str).map(catalog.expiration_key), errors="coerce"
+        ).astype("datetime64[s]").to_numpy(),
+        "strike": frame["strike"].to_numpy(dtype=np.float32),
+    })
+    for column, field in SERIES_FIELDS.items():
+        values = pd.to_numeric(frame[field], errors="coerce") if field in frame.columns \
+            else pd.Series(np.nan, index=frame.index)
+        series[column] = values.round().astype("Int32").to_numpy()
+    return series
+
+def build_series(outdir, ticker, root=None, since=None, until=None):
+    """ Adds the days captured in outdir that the store doesn't have yet, one at a time, and
+    rebuilds the latest day it has, which may have been added before that day's last capture.
+
+    Args:
+        outdir (str): output directory of options_csv, with its catalog (built with
+            catalog.index_directory if missing)
+        ticker (str): ticker symbol of the option data
+        root (str): root directory of the series store. Default is '{outdir}/timeseries'.
+        since (datetime.date or str): only days on or after this one
+        until (datetime.date or str): only days on or before this one
+
+    Returns:
+        list: paths of the series files written
+    """
+    root = root or os.path.join(outdir, "timeseries")
+    catalog_file = catalog.catalog_path(outdir)
+    if not os.path.exists(catalog_file):
+        catalog.index_directory(outdir)
+    with catalog.Catalog(catalog_file) as snapshots:
+        found = snapshots.find(ticker, since=since, until=until)
+    # The latest stored day is rebuilt in case it was captured again since
+    done = set(series_dates(root, ticker)[:-1])
+
+    written = []
+    for date, records in daily_captures(found).items():
+        if date in done:
+            continue
+        frame = load_day(records, ticker, outdir)
+        if frame is None or not len(frame):
+            continue
+        path = series_path(root, ticker, date)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        series = to_series(frame, date)
+        # Written under a temporary name so an interrupted run doesn't leave a partial day
+        series.to_parquet(path + ".tmp", index=False)
+        os.replace(path + ".tmp", path)
+        log.info("Added %d rows of %s on %s", len(series), ticker, date)
+        written.append(path)
+    return written
+
+def read_series(root, ticker, expiration=None, strikes=None, since=None, until=None,
+                columns=None):
+    """ Reads a slice of the series of one ticker.
+
+    Args:
+        root (str): root directory of the series store
+        ticker (str): ticker symbol of the option data
+        expiration (str or datetime.date): only this expiration, in any form accepted by
+            catalog.expiration_key
+        strikes (tuple): only strikes in this (low, high) range, inclusive
+        since (datetime.date or str): only days on or after this one
+        until (datetime.date or str): only days on or before this one
+        columns (list): series columns to load besides the keys. Default is all of them.
+
+    Returns:
+        DataFrame: series rows sorted by expiration, strike and date
+    """
+    directory = os.path.join(root, SERIES_DIR_FORMAT.format(ticker=ticker.lower()))
+    dates = [date for date in series_dates(root, ticker)
+             if (since is None or date >= str(since)) and (until is None or date <= str(until))]
+    if not dates:
+        return pd.DataFrame(columns=SERIES_COLUMNS)
+    filters = []
+    if expiration is not None:
+        filters.append(("expiration", "==", pd.Timestamp(catalog.expiration_key(expiration))))
+    if strikes is not None:
+        filters += [("strike", ">=", strikes[0]), ("strike", "<=", strikes[1])]
+    columns = SERIES_COLUMNS if columns is None else \
+        SERIES_COLUMNS[:3] + [column for column in columns if column in SERIES_FIELDS]
+    frame = pd.read_parquet([os.path.join(directory, SERIES_FILENAME_FORMAT.format(date=date))
+                             for date in dates], columns=columns, filters=filters or None)
+    return frame.sort_values(["expiration", "strike", "date"], kind="stable").reset_index(
+        drop=True)
+
+def strike_history(series, column="call_oi"):
+    """ Pivots series rows into one column per (expiration, strike) and one row per date.
+
+    Returns:
+        DataFrame: values of column indexed by date
+    """
+    return series.pivot_table(index="date", columns=["expiration", "strike"], values=column,
+                              aggfunc="last")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Builds or extends the open interest and volume history of a capture archive")
+    parser.add_argument("outdir", help="Output directory of options_csv")
+    parser.add_argument("--symbol", default="spx",
+        help="Symbol to build, or a comma-separated list of symbols")
+    parser.add_argument("--root", help="Series store directory. Default is OUTDIR/timeseries.")
+    parser.add_argument("--since", help="First day to add, as YYYY-MM-DD")
+    parser.add_argument("--until", help="Last day to add, as YYYY-MM-DD")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    for symbol in args.symbol.split(","):
+        written = build_series(args.outdir, symbol.strip(), args.root, args.since, args.until)
+        print("{}: added {} days".format(symbol.strip(), len(written)))